@@ -6,7 +6,7 @@ from __future__ import (absolute_import, division, generators, nested_scopes,
 
 from django.contrib import admin
 
-from dicpick.models import Camp, Event, Participant, Tag, Task, TaskType
+from dicpick.models import AutoAssignRun, Camp, Event, NotificationRun, Participant, Tag, Task, TaskType
 
 admin.site.register(Camp)
 admin.site.register(Event)
@@ -14,3 +14,5 @@ admin.site.register(Tag)
 admin.site.register(Participant)
 admin.site.register(Task)
 admin.site.register(TaskType)
+admin.site.register(AutoAssignRun)
+admin.site.register(NotificationRun)
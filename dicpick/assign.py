@@ -4,13 +4,25 @@
 from __future__ import (absolute_import, division, generators, nested_scopes,
                         print_function, unicode_literals, with_statement)
 
+import copy
+import json
+import multiprocessing
+import os
 import random
-from collections import defaultdict
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Count, F
+from django.db.models import Count
 
-from dicpick.models import Assignment, Task
+from dicpick.fairness import score_stats
+from dicpick.intervals import task_interval
+from dicpick.locks import lock_event_dates
+from dicpick.models import Assignment, AutoAssignRun, Task, refresh_open_slots
+from dicpick.versions import bump_event_version
 
 """Helper functions to auto-assign participants to tasks."""
 
@@ -22,129 +34,244 @@ class NoEligibleParticipant(Exception):
     self.task = task
 
 
-def assign_for_task_ids(event, task_ids):
+# The auto-assigner runs on a snapshot of the relevant data, in plain picklable objects, so that we can run multiple
+# independent trials on it in parallel, in worker processes, without touching the database.
+
+# A task with open slots.
+#   interval: The (start, end) minutes of the day that the task takes (see intervals.py).
+#   excluded_ids: Ids of participants that mustn't be assigned to the task (including those already assigned).
+_SnapshotTask = namedtuple('_SnapshotTask', ['id', 'task_type_id', 'date', 'interval', 'score', 'num_assigned',
+                                             'num_people', 'tag_ids', 'excluded_ids'])
+
+# A participant.
+#   score: The initial score plus the scores of the already assigned tasks.
+#   available_dates: The dates of the snapshot's tasks on which the participant is available.
+#   busy_intervals: An IntervalIndex of the times at which the participant already has assigned tasks.
+_SnapshotParticipant = namedtuple('_SnapshotParticipant', ['id', 'score', 'tag_ids', 'available_dates',
+                                                           'busy_intervals'])
+
+# Everything the auto-assigner needs to know.
+#   task_type_counts: Map of task type id -> (map of participant id -> number of tasks of that type already
+#                     assigned to that participant), for the task types of the snapshot's tasks.
+AssignmentSnapshot = namedtuple('AssignmentSnapshot', ['tasks', 'participants', 'task_type_counts'])
+
+# The outcome of a single trial.
+#   assignments: A list of (task id, participant id) pairs.
+#   scores: The participants' resulting scores, in the same order as the snapshot's participants.
+TrialResult = namedtuple('TrialResult', ['seed', 'assignments', 'unassignable_task_ids', 'unfilled_slots', 'scores'])
+
+
+def assign_for_task_ids(event, task_ids, run_by=None, trials=None):
   """Auto-assign the specified tasks.
 
   :param event: The event the tasks belong to.
   :param task_ids: The tasks to assign (which must belong to the given event).
+  :param run_by: The user who requested the assignment, if any.
+  :param trials: See assign_for_filter().
   """
-  return assign_for_filter(event, id__in=task_ids)
+  return assign_for_filter(event, run_by=run_by, trials=trials, id__in=task_ids)
 
 
 @transaction.atomic
-def assign_for_filter(event, **task_filter):
+def assign_for_filter(event, run_by=None, seed=None, trials=None, parallel=True, **task_filter):
   """The actual auto-assign logic.
 
   Attempts to assign participants to all tasks that are selected by the given filter.
 
-  Note that we currently assign at most one task per participant per date, to avoid scheduling conflicts.
-  If this turns out to be too restrictive (that is, if we do need to assign the same person two tasks on the
-  same day) we'll have to have more fine-grained scheduling, e.g., a range of hours, or a simple
-  morning/afternoon/evening distinction.
+  Runs the given number of independently seeded trials, in parallel if possible, and keeps the best one: the one
+  that fills the most slots, and among those the one that spreads the scores most evenly.
+
+  Each call is recorded as an AutoAssignRun, and all the assignments it creates refer to that run,
+  so that the run can later be rolled back on its own.
+
+  Note that we never assign a participant two tasks that overlap in time.  Tasks without start and end times
+  take the whole day, so a participant assigned such a task is assigned no other task on that day.
 
   :param event: Assign this event's tasks.
+  :param run_by: The user who requested the assignment, if any.
+  :param seed: Seed for the random choices made by the first trial.  Each subsequent trial uses the next seed.
+               If unspecified, a random seed is used.
+  :param trials: The number of trials to run.  Defaults to DICPICK_ASSIGN_TRIALS.
+  :param parallel: Whether to run the trials in a pool of processes.  Callers that are themselves one of a pool of
+                   processes (e.g., scheduler jobs) should pass False, so as not to oversubscribe the CPUs.
   :param task_filter: Assign only to the event's tasks that match this QuerySet filter.
+  :return: The set of ids of the tasks that could not be fully assigned.
   """
+  start = time.time()
+  if seed is None:
+    seed = random.randrange(2 ** 31)
+  trials = trials or settings.DICPICK_ASSIGN_TRIALS
+
+  # Lock the dates we're assigning on before reading any assignments, so that concurrent changes to the assignments
+  # on those dates can't cause us to double-book a participant.
+  task_dates = (Task.objects.filter(task_type__event=event, **task_filter)
+                .order_by().values_list('date', flat=True).distinct())
+  lock_wait = lock_event_dates(event.id, task_dates)
+
+  snapshot = take_snapshot(event, **task_filter)
+  best = min(run_trials(snapshot, range(seed, seed + trials), parallel=parallel), key=trial_cost)
+
+  run = AutoAssignRun.objects.create(event=event, run_by=run_by, seed=best.seed, num_trials=trials,
+                                     lock_wait=lock_wait,
+                                     task_filter=json.dumps(task_filter, sort_keys=True, default=str))
+  Assignment.objects.bulk_create([Assignment(participant_id=participant_id, task_id=task_id, automatic=True, run=run)
+                                  for (task_id, participant_id) in best.assignments])
+  refresh_open_slots(set(task_id for (task_id, _) in best.assignments))
+  bump_event_version(event.id)  # bulk_create doesn't send signals.
+
+  run.duration = time.time() - start
+  run.num_tasks = len(snapshot.tasks)
+  run.num_assignments = len(best.assignments)
+  run.num_unassignable = len(best.unassignable_task_ids)
+  run.save()
+  return set(best.unassignable_task_ids)
+
+
+def take_snapshot(event, **task_filter):
+  """Returns an AssignmentSnapshot of the event's tasks with open slots that match the given filter."""
   # Note that the event filter is important even if we have a task_type_id in the task_filter,
   # to verify that the task_type does actually belong to the event.
   tasks = list(
       Task.objects
-        .annotate(assignee_count=Count('assignees'))
-        .filter(assignee_count__lt=F('num_people'), task_type__event=event, **task_filter)
-        .select_related('task_type')
+        .filter(open_slots__gt=0, task_type__event=event, **task_filter)
         .prefetch_related('tags', 'assignees', 'assignees__do_not_assign_with', 'do_not_assign_to')
-        .order_by()  # Clear the default ordering to avoid superfluous grouping.
+        # We assign the tasks in this order, so it must be deterministic for a seed to reproduce a run.  Note that
+        # the default ordering would join the task types.
+        .order_by('date', 'task_type_id', 'id')
   )
+  # Note that fetching via event.participants sets each participant's event, which Participant.is_available() uses.
   participants = list(
       event.participants
-        .select_related('user')
         .prefetch_related('tags', 'tasks')
-        .all()
+        .order_by('id')  # For reproducibility, as above.
   )
 
-  # Map of participant id -> Participant object with that id.
-  participants_by_id = {p.id: p for p in participants}
-
-  # Map of participant id -> set of dates on which that participant already has assigned tasks.
-  participant_busy_dates_by_id = {p.id: p.cached_task_dates for p in participants}
-
-  def _is_eligible(task, p):
-    """Returns True iff the participant is eligible to be assigned to the task."""
-    if p in task.cached_do_not_assign_to:
-      return False
+  snapshot_tasks = []
+  for task in tasks:
+    excluded_ids = set(p.id for p in task.cached_do_not_assign_to)
     for a in task.cached_assignees:
-      if p == a or p in a.cached_do_not_assign_with:
-        return False
-
-    task_tags = set(task.cached_tags)
-    return (p.is_in_date_range(task.date) and
-            task.date not in participant_busy_dates_by_id[p.id] and
-            (not task_tags or task_tags.intersection(p.cached_tags)))
+      excluded_ids.add(a.id)
+      excluded_ids.update(p.id for p in a.cached_do_not_assign_with)
+    snapshot_tasks.append(_SnapshotTask(task.id, task.task_type_id, task.date, task_interval(task), task.score,
+                                        task.num_people - task.open_slots, task.num_people, frozenset(t.id for t in task.cached_tags),
+                                        frozenset(excluded_ids)))
 
-  # All task_types we're dealing with.
-  task_types = set(task.task_type for task in tasks)
+  dates = set(task.date for task in tasks)
+  snapshot_participants = [
+    _SnapshotParticipant(p.id, p.assigned_score, frozenset(t.id for t in p.cached_tags),
+                         frozenset(dt for dt in dates if p.is_available(dt)), p.cached_busy_intervals)
+    for p in participants
+  ]
 
-  # Triples of (participant id, tasks__task_type, count), where count is always > 0.
+  # Triples of (participant id, task type id, count), where count is always > 0.
   # These state how many tasks of that type have been assigned to that participant.
   # This is useful for "task diversity" - attempting not to assign too many tasks of a single type to
   # a single participant.
+  # Note that we count from the assignment side, filtering before grouping, so that the count only covers the task
+  # types in the snapshot.
+  task_type_ids = set(task.task_type_id for task in tasks)
   participant_task_type_counts = (
-    event.participants
-      .values('id', 'tasks__task_type')
-      .annotate(count=Count('tasks__task_type'))
-      .filter(tasks__task_type__in=task_types, count__gt=0)
-      .all()
+    Assignment.objects
+      .filter(participant__event=event, task__task_type_id__in=task_type_ids)
+      .order_by()
+      .values('participant_id', 'task__task_type_id')
+      .annotate(count=Count('id'))
   )
+  task_type_counts = {task_type_id: {} for task_type_id in task_type_ids}
+  for x in participant_task_type_counts:
+    task_type_counts[x['task__task_type_id']][x['participant_id']] = x['count']
 
-  # Map of task_type -> (map of count -> participants already assigned this number of tasks of that task_type).
-  task_type_count_participants = defaultdict(lambda: defaultdict(set))
+  return AssignmentSnapshot(snapshot_tasks, snapshot_participants, task_type_counts)
 
-  # Start by assuming participants are assigned to 0 tasks of each type.
-  for task_type in task_types:
-    for participant in participants:
-      task_type_count_participants[task_type.id][0].add(participant)
 
-  # Then update based on actual data.
-  for x in participant_task_type_counts:
-    task_type_id = x['tasks__task_type']
-    participant_id = x['id']
-    task_type_count_participants[task_type_id][0].discard(participants_by_id[participant_id])
-    task_type_count_participants[task_type_id][x['count']].add(participants_by_id[participant_id])
+def run_trial(snapshot, seed):
+  """Runs a single auto-assign trial on the snapshot, making random choices with the given seed.
+
+  Doesn't modify the snapshot, and doesn't touch the database.
+
+  :return: A TrialResult.
+  """
+  rng = random.Random(seed)
+  participants = snapshot.participants
+
+  # Map of participant id -> score, updated as we assign tasks.
+  scores_by_id = {p.id: p.score for p in participants}
+
+  # Map of participant id -> IntervalIndex of the times at which that participant already has assigned tasks.
+  # Note that we copy these, as we modify them.
+  busy_intervals_by_id = {p.id: copy.deepcopy(p.busy_intervals) for p in participants}
+
+  def _is_eligible(task, p):
+    """Returns True iff the participant is eligible to be assigned to the task."""
+    return (p.id not in task.excluded_ids and
+            task.date in p.available_dates and
+            not busy_intervals_by_id[p.id].overlaps(task.date, *task.interval) and
+            (not task.tag_ids or not task.tag_ids.isdisjoint(p.tag_ids)))
+
+  # Map of task_type id -> (map of count -> participants already assigned this number of tasks of that task_type).
+  task_type_count_participants = defaultdict(lambda: defaultdict(set))
+  for task_type_id, counts_by_participant_id in snapshot.task_type_counts.items():
+    for participant in participants:
+      task_type_count_participants[task_type_id][counts_by_participant_id.get(participant.id, 0)].add(participant)
 
   # Tasks we failed to assign anyone to.
-  unassignable_tasks = set()
+  unassignable_task_ids = []
+
+  # (task id, participant id) pairs representing successful assignments.
+  assignments = []
 
-  # Assignment objects representing successful assignments that need to be stored in the database.
-  to_create = []
+  unfilled_slots = 0
 
   # Helper function to auto-assign a single task, if possible.
   def assign_task(task):
     # Assign the remaining empty assignment slots for this task.
-    for i in range(task.cached_assignees.count(), task.num_people):
+    for i in range(task.num_assigned, task.num_people):
       # First try candidates with 0 tasks of this type, then 1, etc.  This provides a good spread of task diversity.
       count_participant_pairs = sorted(task_type_count_participants[task.task_type_id].items())
       for count, candidates in count_participant_pairs:
         eligible = [p for p in candidates if _is_eligible(task, p)]
         if eligible:  # Pick some random candidate from among those with the lowest score.
-          lowest_score = min(p.assigned_score for p in eligible)
-          assign_to = random.choice([p for p in eligible if p.assigned_score == lowest_score])
+          lowest_score = min(scores_by_id[p.id] for p in eligible)
+          # Note that we sort the candidates, so that a given seed always yields the same choices.
+          assign_to = rng.choice(sorted([p for p in eligible if scores_by_id[p.id] == lowest_score],
+                                        key=lambda p: p.id))
           break
       else:
-        unassignable_tasks.add(task.id)
-        return
+        unassignable_task_ids.append(task.id)
+        return task.num_people - i
 
       # Do the accounting to update our data structures.
-      task_type_count_participants[task.task_type.id][count].remove(assign_to)
-      task_type_count_participants[task.task_type.id][count + 1].add(assign_to)
-      participant_busy_dates_by_id[assign_to.id].add(task.date)
-
-      # Create the Assignment object representing the successful assignment.
-      to_create.append(Assignment(participant=assign_to, task=task, automatic=True))
-      assign_to.assigned_score += task.score
+      task_type_count_participants[task.task_type_id][count].remove(assign_to)
+      task_type_count_participants[task.task_type_id][count + 1].add(assign_to)
+      busy_intervals_by_id[assign_to.id].add(task.date, *task.interval)
+      assignments.append((task.id, assign_to.id))
+      scores_by_id[assign_to.id] += task.score
+    return 0
 
   # Now attempt to assign each task.
-  for t in tasks:
-    assign_task(t)
+  for t in snapshot.tasks:
+    unfilled_slots += assign_task(t)
+
+  return TrialResult(seed, assignments, unassignable_task_ids, unfilled_slots,
+                     [scores_by_id[p.id] for p in participants])
 
-  Assignment.objects.bulk_create(to_create)
-  return unassignable_tasks
+
+def trial_cost(result):
+  """The cost of a trial's outcome, for choosing the best trial: first by unfilled slots, then by fairness."""
+  return result.unfilled_slots, score_stats(result.scores).stddev
+
+
+def run_trials(snapshot, seeds, parallel=True):
+  """Runs a trial for each of the given seeds and returns their results.
+
+  The trials run in a pool of processes if parallel is True and there's more than one of them, and otherwise in
+  this process.
+  """
+  seeds = list(seeds)
+  # Note that daemonic processes (e.g., multiprocessing.Pool workers) can't have child processes.
+  if not parallel or len(seeds) == 1 or multiprocessing.current_process().daemon:
+    return [run_trial(snapshot, seed) for seed in seeds]
+  # The worker processes inherit our database connection, which is safe as they neither use it nor close it: trials
+  # don't touch the database, and worker processes exit without running any cleanup.
+  with ProcessPoolExecutor(max_workers=min(len(seeds), os.cpu_count() or 1)) as pool:
+    return list(pool.map(run_trial, repeat(snapshot), seeds))
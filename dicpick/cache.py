@@ -0,0 +1,112 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+
+from dicpick.models import Camp, Event
+
+"""Per-process caches of data that almost every request needs, but that rarely changes.
+
+Every camp-related request resolves the camp and event slugs in its url, and checks that the user is an admin of
+the camp.  We cache the results in each process for up to DICPICK_CACHE_TTL seconds.
+
+Saving or deleting a camp or event, or changing a user's groups, invalidates the relevant entries (see signals.py).
+Note that this only affects the caches of the process that made the change.  Other processes see the change when
+their entries expire.
+"""
+
+
+class TTLCache(object):
+  """A simple thread-safe cache whose entries expire DICPICK_CACHE_TTL seconds after they were computed."""
+  # Expired entries are purged when the cache grows beyond this size.
+  max_size = 1000
+
+  def __init__(self):
+    self._entries = {}  # Map of key -> (expiry time, value).
+    self._lock = threading.Lock()
+
+  def get(self, key, compute):
+    """Returns the cached value for the key, computing (and caching) it by calling compute() if necessary."""
+    now = time.time()
+    with self._lock:
+      entry = self._entries.get(key)
+    if entry is not None and entry[0] > now:
+      return entry[1]
+    value = compute()  # Note that we don't cache exceptions (such as Http404).
+    with self._lock:
+      if len(self._entries) >= self.max_size:
+        self._entries = {k: v for (k, v) in self._entries.items() if v[0] > now}
+      self._entries[key] = (now + settings.DICPICK_CACHE_TTL, value)
+    return value
+
+  def invalidate(self, key):
+    with self._lock:
+      self._entries.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._entries = {}
+
+
+# Map of camp slug -> Camp.
+_camps_by_slug = TTLCache()
+
+# Map of (camp slug, event slug) -> Event, with its camp already fetched.
+_events_by_slugs = TTLCache()
+
+# Map of user id -> frozenset of the ids of the camps that user is an admin of.
+_admin_camp_ids_by_user_id = TTLCache()
+
+
+# Note that the getters below return copies of the cached objects.  Views modify the objects they're given (e.g.,
+# by evaluating cached properties or prefetching related objects), and those modifications must not leak into other
+# requests.
+
+def get_camp(camp_slug):
+  """Returns the camp with the given slug, or raises Http404."""
+  return copy.copy(_camps_by_slug.get(camp_slug, lambda: get_object_or_404(Camp, slug=camp_slug)))
+
+
+def get_event(camp_slug, event_slug):
+  """Returns the event with the given slug in the given camp, or raises Http404."""
+  event = copy.copy(_events_by_slugs.get(
+      (camp_slug, event_slug),
+      lambda: get_object_or_404(Event.objects.select_related('camp'), camp__slug=camp_slug, slug=event_slug)))
+  event.camp = copy.copy(event.camp)
+  return event
+
+
+def get_admin_camp_ids(user):
+  """Returns the set of ids of the camps the given user is an admin of."""
+  if not user.is_authenticated():
+    return frozenset()
+  return _admin_camp_ids_by_user_id.get(
+      user.id, lambda: frozenset(Camp.objects.filter(admin_group__user=user).values_list('id', flat=True)))
+
+
+def invalidate_camps():
+  # Events embed their camp, and admin camp ids depend on the camps' admin groups, so we clear those too.
+  _camps_by_slug.clear()
+  _events_by_slugs.clear()
+  _admin_camp_ids_by_user_id.clear()
+
+
+def invalidate_events():
+  # We don't know what slugs a changed event was cached under (its slug may have changed), so we clear all events.
+  _events_by_slugs.clear()
+
+
+def invalidate_admin_camp_ids(user_id=None):
+  """Invalidates the admin camp ids of the given user, or of all users if user_id is None."""
+  if user_id is None:
+    _admin_camp_ids_by_user_id.clear()
+  else:
+    _admin_camp_ids_by_user_id.invalidate(user_id)
@@ -0,0 +1,110 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+from django.db import transaction
+
+from dicpick.models import Event, Participant, Tag, Task, TaskType
+
+"""Helper functions to clone an event, e.g., to set up this year's event as a copy of last year's."""
+
+
+@transaction.atomic
+def clone_event(event, name, slug, start_date, with_do_not_assign_with=False):
+  """Creates a copy of an event, with all dates shifted so that the copy starts on the given start date.
+
+  Copies the event's tags, task types, tasks (including any per-task overrides) and participants, and the tags of
+  each of those.  Optionally also copies the pairs of participants that must not be assigned tasks together.
+
+  Does not copy task assignments, nor participants that must not be assigned to specific tasks, as those are specific
+  to the original event.  Nor does it copy participants' initial scores, as those reflect contributions to the
+  original event.
+
+  Each kind of object is copied with a single bulk_create, so this makes a constant number of database queries,
+  regardless of the size of the event.
+
+  :param event: The event to clone.
+  :param name: The name of the new event.
+  :param slug: The slug of the new event.
+  :param start_date: The first day of the new event.
+  :param with_do_not_assign_with: Whether to copy the participants' do_not_assign_with pairs.
+  :return: The new event.
+  """
+  shift = start_date - event.start_date
+  new_event = Event.objects.create(camp_id=event.camp_id, name=name, slug=slug,
+                                   start_date=event.start_date + shift, end_date=event.end_date + shift)
+
+  # Note that bulk_create doesn't set the primary keys of the objects it creates, so after each bulk_create we
+  # re-fetch the new ids, and map the old ids to the new ones via each model's natural unique key.
+
+  # Map of tag id -> id of the copy of that tag.
+  tags = list(event.tags.all())
+  Tag.objects.bulk_create([Tag(event=new_event, name=t.name) for t in tags])
+  new_tag_ids_by_name = dict(Tag.objects.filter(event=new_event).values_list('name', 'id'))
+  tag_id_map = {t.id: new_tag_ids_by_name[t.name] for t in tags}
+
+  # Map of task type id -> id of the copy of that task type.
+  # Note that bulk_create doesn't send the post_save signal, so create_task_instances() won't create the tasks.
+  # We copy the tasks ourselves below, so that we retain any per-task overrides.
+  task_types = list(event.task_types.all())
+  TaskType.objects.bulk_create([
+    TaskType(event=new_event, name=tt.name, num_people=tt.num_people, score=tt.score,
+             start_date=tt.start_date + shift, end_date=tt.end_date + shift,
+             start_time=tt.start_time, end_time=tt.end_time)
+    for tt in task_types
+  ])
+  new_task_type_ids_by_name = dict(TaskType.objects.filter(event=new_event).values_list('name', 'id'))
+  task_type_id_map = {tt.id: new_task_type_ids_by_name[tt.name] for tt in task_types}
+
+  # Map of task id -> id of the copy of that task.
+  tasks = list(Task.objects.filter(task_type__event=event).order_by())
+  Task.objects.bulk_create([
+    # Note that assignments aren't copied, so all of each task's slots are open.
+    Task(task_type_id=task_type_id_map[t.task_type_id], date=t.date + shift, num_people=t.num_people, score=t.score,
+         start_time=t.start_time, end_time=t.end_time, open_slots=t.num_people)
+    for t in tasks
+  ])
+  new_task_ids_by_key = {(task_type_id, date): task_id for (task_type_id, date, task_id) in
+                         Task.objects.filter(task_type__event=new_event).values_list('task_type_id', 'date', 'id')}
+  task_id_map = {t.id: new_task_ids_by_key[(task_type_id_map[t.task_type_id], t.date + shift)] for t in tasks}
+
+  # Map of participant id -> id of the copy of that participant.
+  participants = list(event.participants.all())
+  Participant.objects.bulk_create([
+    # Note that unavailable_days is relative to the start of the event, so it needs no shifting.
+    Participant(event=new_event, user_id=p.user_id, start_date=p.start_date + shift, end_date=p.end_date + shift,
+                unavailable_days=p.unavailable_days)
+    for p in participants
+  ])
+  new_participant_ids_by_user_id = dict(Participant.objects.filter(event=new_event).values_list('user_id', 'id'))
+  participant_id_map = {p.id: new_participant_ids_by_user_id[p.user_id] for p in participants}
+
+  _copy_m2m(TaskType.tags.through, {'tasktype__event': event}, 'tasktype', 'tag', task_type_id_map, tag_id_map)
+  _copy_m2m(Task.tags.through, {'task__task_type__event': event}, 'task', 'tag', task_id_map, tag_id_map)
+  _copy_m2m(Participant.tags.through, {'participant__event': event}, 'participant', 'tag',
+            participant_id_map, tag_id_map)
+  if with_do_not_assign_with:
+    # Note that this relationship is symmetrical, so the through table already has a row for each direction.
+    _copy_m2m(Participant.do_not_assign_with.through, {'from_participant__event': event},
+              'from_participant', 'to_participant', participant_id_map, participant_id_map)
+
+  return new_event
+
+
+def _copy_m2m(through, source_filter, from_field, to_field, from_id_map, to_id_map):
+  """Copies rows of a many-to-many through table, mapping the ids at both ends to the ids of their copies.
+
+  :param through: The through model.
+  :param source_filter: A QuerySet filter that selects the rows to copy.
+  :param from_field: The name of the through model's foreign key to the 'from' side of the relationship.
+  :param to_field: The name of the through model's foreign key to the 'to' side of the relationship.
+  :param from_id_map: Map of 'from' id -> id of its copy.
+  :param to_id_map: Map of 'to' id -> id of its copy.
+  """
+  rows = through.objects.filter(**source_filter).values_list(from_field, to_field)
+  through.objects.bulk_create([
+    through(**{'{}_id'.format(from_field): from_id_map[from_id], '{}_id'.format(to_field): to_id_map[to_id]})
+    for (from_id, to_id) in rows
+  ])
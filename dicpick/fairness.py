@@ -0,0 +1,120 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+from collections import namedtuple
+
+import numpy as np
+
+from dicpick.cache import TTLCache
+from dicpick.models import Assignment, Participant
+from dicpick.versions import get_event_version
+
+"""Metrics of how fairly an event's tasks are spread among its participants.
+
+A participant's score is their initial score plus the scores of their assigned tasks.  In a fair assignment all
+participants have similar scores, or, if they're not all available for the same number of days, similar scores
+per available day.
+
+The metrics are computed with NumPy from a few flat queries.  score_stats() needs no database access at all, and is
+cheap enough to call on every candidate assignment inside an optimization loop.
+"""
+
+
+# Statistics of a set of scores.
+#   gap: The difference between the highest and lowest scores.
+#   gini: The Gini coefficient of the scores, from 0 (all equal) to 1 (one participant has everything).
+ScoreStats = namedtuple('ScoreStats', ['count', 'mean', 'stddev', 'minimum', 'maximum', 'gap', 'gini'])
+
+# Statistics of the scores of a group of participants, e.g., all participants with some tag.
+GroupScoreStats = namedtuple('GroupScoreStats', ['name', 'stats'])
+
+# All of an event's fairness metrics.
+#   overall: ScoreStats of all participants' scores.
+#   per_available_day: ScoreStats of all participants' scores divided by the number of days they're available.
+#   by_tag: A list of GroupScoreStats, one per tag, in tag name order.
+#   by_availability: A list of GroupScoreStats, one per number of available days, in descending order.
+#   diversity: The mean over participants with assigned tasks of the fraction of their tasks that are of distinct
+#              types.  1.0 means that no one has two tasks of the same type.
+FairnessMetrics = namedtuple('FairnessMetrics', ['overall', 'per_available_day', 'by_tag', 'by_availability',
+                                                 'diversity'])
+
+
+def score_stats(scores):
+  """Returns the ScoreStats of the given scores (any sequence of numbers, or a NumPy array)."""
+  scores = np.sort(np.asarray(scores, dtype=float))
+  n = len(scores)
+  if n == 0:
+    return ScoreStats(0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+  total = scores.sum()
+  # The standard formula for the Gini coefficient of values sorted in ascending order.
+  gini = 2.0 * np.dot(np.arange(1, n + 1), scores) / (n * total) - (n + 1.0) / n if total > 0 else 0.0
+  minimum = float(scores[0])
+  maximum = float(scores[-1])
+  return ScoreStats(n, float(scores.mean()), float(scores.std()), minimum, maximum, maximum - minimum, float(gini))
+
+
+def compute_fairness_metrics(event):
+  """Computes the FairnessMetrics of the given event, with three flat database queries."""
+  participant_rows = list(event.participants.order_by('id').values_list(
+      'id', 'initial_score', 'start_date', 'end_date', 'unavailable_days'))
+  if not participant_rows:
+    return FairnessMetrics(score_stats([]), score_stats([]), [], [], 1.0)
+  participant_ids = np.array([r[0] for r in participant_rows])
+  n = len(participant_ids)
+
+  assignment_rows = list(Assignment.objects.filter(task__task_type__event=event).values_list(
+      'participant_id', 'task__score', 'task__task_type_id'))
+  # The index of each assignment's participant in participant_ids (which is sorted).
+  assignee_indexes = np.searchsorted(participant_ids, np.array([r[0] for r in assignment_rows], dtype=int))
+  task_scores = np.array([r[1] for r in assignment_rows], dtype=float)
+  task_type_ids = np.array([r[2] for r in assignment_rows], dtype=int)
+
+  scores = (np.array([r[1] for r in participant_rows], dtype=float) +
+            np.bincount(assignee_indexes, weights=task_scores, minlength=n))
+
+  # The number of days each participant is available: their date range, less any unavailable days within it.
+  def available_days(start_date, end_date, unavailable_days):
+    num_days = (end_date - start_date).days + 1
+    offset = (start_date - event.start_date).days
+    if unavailable_days and offset >= 0:
+      num_days -= bin((unavailable_days >> offset) & ((1 << num_days) - 1)).count('1')
+    return max(num_days, 0)
+  days = np.array([available_days(*r[2:]) for r in participant_rows])
+
+  tag_rows = Participant.tags.through.objects.filter(participant__event=event).values_list('participant_id',
+                                                                                           'tag__name')
+  participant_indexes_by_tag = {}
+  for participant_id, tag_name in tag_rows:
+    participant_indexes_by_tag.setdefault(tag_name, []).append(np.searchsorted(participant_ids, participant_id))
+
+  # Task-type diversity: count each participant's tasks, and their distinct (participant, task type) pairs.
+  num_tasks = np.bincount(assignee_indexes, minlength=n)
+  if len(assignment_rows):
+    pairs = np.unique(assignee_indexes * (task_type_ids.max() + 1) + task_type_ids)
+    num_task_types = np.bincount(pairs // (task_type_ids.max() + 1), minlength=n)
+    has_tasks = num_tasks > 0
+    diversity = float(np.mean(num_task_types[has_tasks] / num_tasks[has_tasks]))
+  else:
+    diversity = 1.0
+
+  return FairnessMetrics(
+    overall=score_stats(scores),
+    per_available_day=score_stats(scores[days > 0] / days[days > 0]),
+    by_tag=[GroupScoreStats(name, score_stats(scores[indexes]))
+            for (name, indexes) in sorted(participant_indexes_by_tag.items())],
+    by_availability=[GroupScoreStats(int(d), score_stats(scores[days == d])) for d in np.unique(days)[::-1]],
+    diversity=diversity,
+  )
+
+
+# Map of (event id, event version) -> FairnessMetrics.
+_metrics_by_event_version = TTLCache()
+
+
+def get_fairness_metrics(event):
+  """Returns the FairnessMetrics of the given event, from this process's cache if the event hasn't changed."""
+  key = (event.id, get_event_version(event.id))
+  return _metrics_by_event_version.get(key, lambda: compute_fairness_metrics(event))
@@ -0,0 +1,276 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+from collections import defaultdict, deque, namedtuple
+
+from dicpick.intervals import task_interval
+from dicpick.models import Task
+
+"""Checks whether an event's open task slots can possibly all be filled, without running the auto-assigner.
+
+For each date we build a flow network: the source feeds each task with its number of open slots, each task feeds
+each participant eligible for it, and each participant feeds the sink with the number of that date's tasks they
+could take on.  The maximum flow through the network is an upper bound on the number of open slots on that date
+that any assignment could fill.
+
+The bound is a relaxation: we cap each participant by the largest number of non-overlapping tasks they're eligible
+for, and we ignore "do not assign with" constraints between participants who aren't yet assigned.  So if the flow
+falls short, then no assignment can fill all the slots, but not vice versa.
+
+When the flow falls short, the tasks reachable from the source in the residual network form a Hall violator: a set
+of tasks whose open slots outnumber what their candidates can fill between them.  We report such a set as a whole,
+as a shortfall: the flow shows that the set can't be filled, but not which of its tasks will go short.  A single
+task is reported as impossible to fill only if it has fewer candidates than open slots.
+
+Similarly, for each distinct set of required tags we compute the flows through the networks of just the tasks that
+require those tags, one per date, which bound the number of those tasks' slots that can be filled.
+"""
+
+
+# The feasibility of a single task.
+#   num_candidates: The number of participants eligible for the task.
+#   max_fillable: An upper bound on the number of the task's open slots that can be filled.
+#   reason: Why the task can't be filled, or None if it might be.
+TaskFeasibility = namedtuple('TaskFeasibility', ['task', 'open_slots', 'num_candidates', 'max_fillable', 'reason'])
+
+# The feasibility of a group of tasks, e.g., all tasks on a date, or all tasks requiring the same tags.
+#   max_fillable: An upper bound on the number of the group's open slots that can be filled, from its flow networks.
+GroupFeasibility = namedtuple('GroupFeasibility', ['name', 'num_tasks', 'open_slots', 'max_fillable'])
+
+# A set of tasks on a single date whose open slots can't all be filled, as they compete for too few candidates.
+#   num_candidates: The number of participants eligible for any of the tasks.
+#   max_fillable: An upper bound on the number of the tasks' open slots that can be filled, between them.
+Shortfall = namedtuple('Shortfall', ['date', 'tasks', 'num_candidates', 'open_slots', 'max_fillable'])
+
+
+class FeasibilityReport(object):
+  def __init__(self, tasks, dates, tag_groups, shortfalls):
+    # List of TaskFeasibility, for each task with open slots, in date order.
+    self.tasks = tasks
+    # List of GroupFeasibility, one per date, in date order.
+    self.dates = dates
+    # List of GroupFeasibility, one per distinct set of required tags.
+    self.tag_groups = tag_groups
+    # List of Shortfall, at most one per date, in date order.
+    self.shortfalls = shortfalls
+
+  @property
+  def infeasible_tasks(self):
+    return [t for t in self.tasks if t.reason is not None]
+
+  @property
+  def open_slots(self):
+    return sum(t.open_slots for t in self.tasks)
+
+  @property
+  def max_fillable(self):
+    return sum(d.max_fillable for d in self.dates)
+
+  @property
+  def is_feasible(self):
+    return not self.infeasible_tasks and not self.shortfalls
+
+
+class _FlowNetwork(object):
+  """A flow network with a max-flow solver (Dinic's algorithm)."""
+  def __init__(self, num_nodes):
+    # Adjacency lists.  Each edge is a list [to node, residual capacity, index of the reverse edge in graph[to]].
+    self.graph = [[] for _ in range(num_nodes)]
+
+  def add_edge(self, u, v, capacity):
+    """Adds an edge from u to v, and returns it."""
+    edge = [v, capacity, len(self.graph[v])]
+    self.graph[u].append(edge)
+    self.graph[v].append([u, 0, len(self.graph[u]) - 1])
+    return edge
+
+  def max_flow(self, source, sink):
+    flow = 0
+    while True:
+      levels = self._levels(source)
+      if levels[sink] is None:
+        return flow
+      next_edge = [0] * len(self.graph)
+      while True:
+        pushed = self._push(source, sink, float('inf'), levels, next_edge)
+        if not pushed:
+          break
+        flow += pushed
+
+  def reachable(self, source):
+    """Returns the set of nodes reachable from the source in the residual network."""
+    return set(i for (i, level) in enumerate(self._levels(source)) if level is not None)
+
+  def _levels(self, source):
+    levels = [None] * len(self.graph)
+    levels[source] = 0
+    queue = deque([source])
+    while queue:
+      u = queue.popleft()
+      for v, capacity, _ in self.graph[u]:
+        if capacity > 0 and levels[v] is None:
+          levels[v] = levels[u] + 1
+          queue.append(v)
+    return levels
+
+  def _push(self, u, sink, limit, levels, next_edge):
+    # Note that paths in our networks have only four nodes, so this recursion is shallow.
+    if u == sink:
+      return limit
+    edges = self.graph[u]
+    while next_edge[u] < len(edges):
+      edge = edges[next_edge[u]]
+      v, capacity, rev = edge
+      if capacity > 0 and levels[v] == levels[u] + 1:
+        pushed = self._push(v, sink, min(limit, capacity), levels, next_edge)
+        if pushed:
+          edge[1] -= pushed
+          self.graph[v][rev][1] += pushed
+          return pushed
+      next_edge[u] += 1
+    return 0
+
+
+def _max_non_overlapping(intervals):
+  """Returns the largest number of pairwise non-overlapping intervals among the given (start, end) intervals."""
+  count = 0
+  current_end = None
+  for start, end in sorted(intervals, key=lambda x: x[1]):
+    if current_end is None or start >= current_end:
+      count += 1
+      current_end = end
+  return count
+
+
+def analyze_feasibility(event, **task_filter):
+  """Analyzes whether the open slots of the event's tasks that match the given filter can all be filled.
+
+  Makes a constant number of database queries, regardless of the size of the event.
+
+  :param event: Analyze this event's tasks.
+  :param task_filter: Analyze only the event's tasks that match this QuerySet filter.
+  :return: A FeasibilityReport.
+  """
+  tasks = list(
+      Task.objects
+        .filter(open_slots__gt=0, task_type__event=event, **task_filter)
+        .select_related('task_type')
+        .prefetch_related('tags', 'assignees', 'assignees__do_not_assign_with', 'do_not_assign_to')
+        .order_by('date', 'start_time', 'task_type__name')
+  )
+  # Note that fetching via event.participants sets each participant's event, which Participant.is_available() uses.
+  participants = list(event.participants.select_related('user').prefetch_related('tags', 'tasks'))
+
+  tasks_by_date = defaultdict(list)
+  for task in tasks:
+    tasks_by_date[task.date].append(task)
+
+  results = []
+  dates = []
+  shortfalls = []
+  candidates_by_task_id = {}
+  for date in sorted(tasks_by_date):
+    date_tasks = tasks_by_date[date]
+    date_candidates_by_task_id, no_candidates_reasons = _candidates(date, date_tasks, participants)
+    candidates_by_task_id.update(date_candidates_by_task_id)
+    for task in date_tasks:
+      results.append(_task_feasibility(task, date_candidates_by_task_id[task.id],
+                                       no_candidates_reasons.get(task.id)))
+
+    open_slots = sum(task.open_slots for task in date_tasks)
+    flow, hall_tasks = _max_flow(date_tasks, date_candidates_by_task_id)
+    dates.append(GroupFeasibility(str(date), len(date_tasks), open_slots, flow))
+    if hall_tasks:
+      hall_open_slots = sum(task.open_slots for task in hall_tasks)
+      hall_candidate_ids = set(p.id for task in hall_tasks for p in date_candidates_by_task_id[task.id])
+      # The flow falls short by open_slots - flow, and all of the shortfall is in the Hall violator.
+      shortfalls.append(Shortfall(date, hall_tasks, len(hall_candidate_ids), hall_open_slots,
+                                  hall_open_slots - (open_slots - flow)))
+
+  # Map of sorted tuple of tag names -> date -> list of the tasks on that date that require exactly those tags.
+  tasks_by_tags = defaultdict(lambda: defaultdict(list))
+  for task in tasks:
+    tasks_by_tags[tuple(sorted(t.name for t in task.cached_tags))][task.date].append(task)
+  tag_groups = []
+  for tag_names, group_tasks_by_date in sorted(tasks_by_tags.items()):
+    group_tasks = [task for date_tasks in group_tasks_by_date.values() for task in date_tasks]
+    tag_groups.append(GroupFeasibility(
+        ', '.join(tag_names) or '(none)', len(group_tasks), sum(task.open_slots for task in group_tasks),
+        sum(_max_flow(date_tasks, candidates_by_task_id)[0] for date_tasks in group_tasks_by_date.values())))
+
+  return FeasibilityReport(results, dates, tag_groups, shortfalls)
+
+
+def _candidates(date, tasks, participants):
+  """Finds the candidates for the given tasks on a single date.
+
+  :return: A pair (map of task id -> list of eligible participants, map of task id -> the reason it has none).
+  """
+  available = [p for p in participants if p.is_available(date)]
+  candidates_by_task_id = {}
+  no_candidates_reasons = {}
+  for task in tasks:
+    start, end = task_interval(task)
+    task_tags = set(task.cached_tags)
+    candidates = [p for p in available if not task_tags or task_tags.intersection(p.cached_tags)]
+    if not candidates:
+      no_candidates_reasons[task.id] = (
+        'No one with the required tags is available on this date.' if available and task_tags else
+        'No one is available on this date.')
+    else:
+      excluded = set(task.cached_do_not_assign_to)
+      for a in task.cached_assignees:
+        excluded.add(a)
+        excluded.update(a.cached_do_not_assign_with)
+      candidates = [p for p in candidates if p not in excluded]
+      if not candidates:
+        no_candidates_reasons[task.id] = 'Everyone eligible is excluded by "do not assign" rules.'
+      else:
+        candidates = [p for p in candidates if not p.cached_busy_intervals.overlaps(date, start, end)]
+        if not candidates:
+          no_candidates_reasons[task.id] = 'Everyone eligible is already assigned a task at this time.'
+    candidates_by_task_id[task.id] = candidates
+  return candidates_by_task_id, no_candidates_reasons
+
+
+def _task_feasibility(task, candidates, no_candidates_reason):
+  """Returns the TaskFeasibility of a single task, from the checks that involve that task alone."""
+  open_slots = task.open_slots
+  num_candidates = len(candidates)
+  if no_candidates_reason is not None:
+    reason = no_candidates_reason
+  elif num_candidates < open_slots:
+    reason = 'Only {} eligible for {} open slots.'.format(num_candidates, open_slots)
+  else:
+    reason = None
+  # Each candidate can fill at most one of the task's slots.
+  return TaskFeasibility(task, open_slots, num_candidates, min(open_slots, num_candidates), reason)
+
+
+def _max_flow(tasks, candidates_by_task_id):
+  """Computes the maximum flow through the network of the given tasks, all on a single date (see above).
+
+  :return: A pair (flow, Hall violator), where the Hall violator is the list of the tasks reachable from the source
+           in the residual network if the flow falls short of the tasks' open slots, and empty otherwise.
+  """
+  # Node 0 is the source, node 1 is the sink, then come the tasks and the participants.
+  participant_ids = sorted(set(p.id for task in tasks for p in candidates_by_task_id[task.id]))
+  participant_nodes = {p_id: 2 + len(tasks) + i for (i, p_id) in enumerate(participant_ids)}
+  network = _FlowNetwork(2 + len(tasks) + len(participant_ids))
+  intervals_by_participant_id = defaultdict(list)
+  for i, task in enumerate(tasks):
+    network.add_edge(0, 2 + i, task.open_slots)
+    for p in candidates_by_task_id[task.id]:
+      network.add_edge(2 + i, participant_nodes[p.id], 1)
+      intervals_by_participant_id[p.id].append(task_interval(task))
+  for p_id in participant_ids:
+    network.add_edge(participant_nodes[p_id], 1, _max_non_overlapping(intervals_by_participant_id[p_id]))
+
+  flow = network.max_flow(0, 1)
+  if flow == sum(task.open_slots for task in tasks):
+    return flow, []
+  reachable = network.reachable(0)
+  return flow, [task for (i, task) in enumerate(tasks) if 2 + i in reachable]
@@ -0,0 +1,169 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import datetime
+from collections import defaultdict
+
+from django.core import signing
+from django.utils import timezone
+
+from dicpick.cache import TTLCache
+from dicpick.models import Task, short_name
+from dicpick.versions import get_event_version
+
+"""iCalendar (RFC 5545) feeds of an event's tasks: one per participant, and one per task type.
+
+Calendar clients poll feeds frequently, so the feed views support conditional GETs, with ETags derived from the
+event's version: a poll of an unchanged event costs a single version lookup, and a 304.
+
+When the event has changed, we generate all of its feeds at once, from a single ordered query, and cache them by
+event version.
+"""
+
+
+_PRODID = '-//Mystopia//DicPick//EN'
+
+
+def _escape(text):
+  """Escapes the given text for use as an iCalendar TEXT value."""
+  return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+          .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line):
+  """Folds the given content line so that no line is longer than 75 octets, as RFC 5545 requires."""
+  encoded = line.encode('utf-8')
+  if len(encoded) <= 75:
+    return line
+  parts = []
+  limit = 75
+  while encoded:
+    # Don't split a multi-byte character: back up to the start of the character.
+    i = min(limit, len(encoded))
+    while i < len(encoded) and (encoded[i] & 0xC0) == 0x80:
+      i -= 1
+    parts.append(encoded[:i].decode('utf-8'))
+    encoded = encoded[i:]
+    limit = 74  # Continuation lines start with a space.
+  return '\r\n '.join(parts)
+
+
+def _date_time_value(date, time, default_time):
+  """Returns the iCalendar property parameters and value for the given date and time (floating local time)."""
+  time = time if time is not None else default_time
+  if time is None:
+    return ';VALUE=DATE:{:%Y%m%d}'.format(date)
+  return ':{:%Y%m%dT%H%M%S}'.format(datetime.datetime.combine(date, time))
+
+
+def _vevent(task_id, task_type_name, date, start_time, end_time, description, dtstamp):
+  """Returns the lines of a VEVENT for a task.  A task with no times spans its whole day."""
+  if start_time is None and end_time is None:
+    start = _date_time_value(date, None, None)
+    end = _date_time_value(date + datetime.timedelta(days=1), None, None)
+  else:
+    start = _date_time_value(date, start_time, datetime.time(0, 0))
+    # A missing end time means the end of the day.
+    end = (_date_time_value(date, end_time, None) if end_time is not None else
+           _date_time_value(date + datetime.timedelta(days=1), datetime.time(0, 0), None))
+  lines = [
+    'BEGIN:VEVENT',
+    'UID:task-{}@dicpick'.format(task_id),
+    'DTSTAMP:{}'.format(dtstamp),
+    'DTSTART{}'.format(start),
+    'DTEND{}'.format(end),
+    'SUMMARY:{}'.format(_escape(task_type_name)),
+  ]
+  if description:
+    lines.append('DESCRIPTION:{}'.format(_escape(description)))
+  lines.append('END:VEVENT')
+  return lines
+
+
+def render_calendar(name, vevents):
+  """Returns an iCalendar document with the given name, containing the given VEVENTs (each a list of lines)."""
+  lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:{}'.format(_PRODID), 'CALSCALE:GREGORIAN',
+           'X-WR-CALNAME:{}'.format(_escape(name))]
+  for vevent in vevents:
+    lines.extend(vevent)
+  lines.append('END:VCALENDAR')
+  return '\r\n'.join(_fold(line) for line in lines) + '\r\n'
+
+
+class EventFeeds(object):
+  def __init__(self):
+    # Map of participant id -> list of VEVENTs of the participant's tasks, in chronological order.
+    self.by_participant_id = defaultdict(list)
+    # Map of task type id -> list of VEVENTs of the task type's tasks, in chronological order.
+    self.by_task_type_id = defaultdict(list)
+    # Map of task type id -> name, for the task types that have tasks.
+    self.task_type_names = {}
+
+
+def compute_feeds(event):
+  """Computes the VEVENTs of all of the event's feeds, with a single database query."""
+  # One row per (task, assignee) pair, or a single row with a null assignee for a task with no assignees.
+  rows = (
+    Task.objects
+      .filter(task_type__event=event)
+      .order_by('date', 'start_time', 'task_type__name', 'id')
+      .values_list('id', 'task_type_id', 'task_type__name', 'date', 'start_time', 'end_time',
+                   'assignees__id', 'assignees__user__first_name', 'assignees__user__last_name')
+  )
+  # List of (task values, list of (assignee id, assignee name)), in chronological order.
+  tasks = []
+  for row in rows:
+    if not tasks or tasks[-1][0][0] != row[0]:
+      tasks.append((row[:6], []))
+    if row[6] is not None:
+      tasks[-1][1].append((row[6], short_name(row[7], row[8])))
+
+  dtstamp = '{:%Y%m%dT%H%M%SZ}'.format(timezone.now().astimezone(timezone.utc))
+  feeds = EventFeeds()
+  for (task_id, task_type_id, task_type_name, date, start_time, end_time), assignees in tasks:
+    names = [name for (_, name) in assignees]
+    description = 'Assigned: {}'.format(', '.join(names)) if names else 'Not assigned yet'
+    feeds.task_type_names[task_type_id] = task_type_name
+    feeds.by_task_type_id[task_type_id].append(
+        _vevent(task_id, task_type_name, date, start_time, end_time, description, dtstamp))
+    for participant_id, name in assignees:
+      others = [n for (p_id, n) in assignees if p_id != participant_id]
+      description = 'With: {}'.format(', '.join(others)) if others else ''
+      feeds.by_participant_id[participant_id].append(
+          _vevent(task_id, task_type_name, date, start_time, end_time, description, dtstamp))
+  return feeds
+
+
+# Map of (event id, event version) -> EventFeeds.
+_feeds_by_event_version = TTLCache()
+
+
+def get_feeds(event):
+  """Returns the EventFeeds of the given event, from this process's cache if the event hasn't changed."""
+  key = (event.id, get_event_version(event.id))
+  return _feeds_by_event_version.get(key, lambda: compute_feeds(event))
+
+
+def feed_etag(event):
+  """Returns the ETag of all of the given event's feeds, which changes whenever any of the event's data changes."""
+  return '{}-{}'.format(event.id, get_event_version(event.id))
+
+
+# Tokens signed with this salt can't be confused with any other signed values (e.g., schedule tokens).
+_TASK_TYPE_TOKEN_SALT = 'dicpick.feeds.task_type'
+
+
+def task_type_feed_token(task_type_id):
+  """Returns a token that grants access to the feed of the given task type.  Note that it doesn't expire."""
+  return signing.Signer(salt=_TASK_TYPE_TOKEN_SALT).sign(str(task_type_id))
+
+
+def task_type_id_from_token(token):
+  """Returns the id of the task type whose feed the given token grants access to.
+
+  Raises signing.BadSignature if the token is invalid.
+  """
+  return int(signing.Signer(salt=_TASK_TYPE_TOKEN_SALT).unsign(token))
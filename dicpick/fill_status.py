@@ -0,0 +1,109 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+from collections import namedtuple
+from itertools import groupby
+
+from django.db.models import Count, F, Sum
+
+from dicpick.cache import TTLCache
+from dicpick.intervals import time_interval
+from dicpick.models import Assignment, Task
+from dicpick.versions import get_event_version
+
+"""How far along the assignment of an event's tasks is, per date and per task type.
+
+This lets admins see at a glance which dates and task types still need work, rather than opening each of their
+pages in turn.
+
+The slot and point totals come from a single GROUP BY over the event's tasks, using each task's open_slots, and the
+conflicts from a single flat query over its assignments.  The result is cached by event version.
+"""
+
+
+# The fill status of a set of tasks.
+#   filled: The number of assigned slots.
+#   needed: The number of slots in total (i.e., the sum of the tasks' num_people).
+#   points: The total score of the assigned slots.
+#   conflicts: The number of assignments that overlap in time with another assignment of the same participant.
+FillStatus = namedtuple('FillStatus', ['num_tasks', 'filled', 'needed', 'points', 'conflicts'])
+
+EMPTY_FILL_STATUS = FillStatus(0, 0, 0, 0, 0)
+
+
+def _add(statuses, key, num_tasks=0, filled=0, needed=0, points=0, conflicts=0):
+  """Adds the given counts to the FillStatus of the given key in the given map."""
+  status = statuses.get(key, EMPTY_FILL_STATUS)
+  statuses[key] = FillStatus(status.num_tasks + num_tasks, status.filled + filled, status.needed + needed,
+                             status.points + points, status.conflicts + conflicts)
+
+
+class EventFillStatus(object):
+  def __init__(self, task_types):
+    # List of (task type id, name), in name order.
+    self.task_types = task_types
+    # Map of date -> FillStatus of the tasks on that date.
+    self.by_date = {}
+    # Map of task type id -> FillStatus of the tasks of that type.
+    self.by_task_type_id = {}
+    # The FillStatus of all of the event's tasks.
+    self.total = EMPTY_FILL_STATUS
+
+
+def _conflicting_assignments(event):
+  """Returns a list of (date, task type id) of each assignment that conflicts with another of its participant's."""
+  rows = (
+    Assignment.objects
+      .filter(task__task_type__event=event)
+      .order_by('participant_id', 'task__date')
+      .values_list('participant_id', 'task__date', 'task__task_type_id', 'task__start_time', 'task__end_time')
+  )
+  ret = []
+  for (_, date), group in groupby(rows, lambda r: r[:2]):
+    # A participant rarely has more than a few tasks on any one date, so we just compare all pairs.
+    tasks = [(task_type_id, time_interval(start_time, end_time)) for (_, _, task_type_id, start_time, end_time)
+             in group]
+    for i, (task_type_id, (start, end)) in enumerate(tasks):
+      if any(start < other_end and other_start < end
+             for j, (_, (other_start, other_end)) in enumerate(tasks) if j != i):
+        ret.append((date, task_type_id))
+  return ret
+
+
+def compute_fill_status(event):
+  """Computes the EventFillStatus of the given event, with three database queries."""
+  status = EventFillStatus(list(event.task_types.order_by('name').values_list('id', 'name')))
+  rows = (
+    Task.objects
+      .filter(task_type__event=event)
+      .order_by()
+      .values('date', 'task_type_id')
+      .annotate(num_tasks=Count('id'), needed=Sum('num_people'), total_open_slots=Sum('open_slots'),
+                points=Sum(F('score') * (F('num_people') - F('open_slots'))))
+  )
+  for row in rows:
+    counts = dict(num_tasks=row['num_tasks'], filled=row['needed'] - row['total_open_slots'], needed=row['needed'],
+                  points=row['points'])
+    _add(status.by_date, row['date'], **counts)
+    _add(status.by_task_type_id, row['task_type_id'], **counts)
+
+  for date, task_type_id in _conflicting_assignments(event):
+    _add(status.by_date, date, conflicts=1)
+    _add(status.by_task_type_id, task_type_id, conflicts=1)
+
+  if status.by_date:
+    status.total = FillStatus(*[sum(counts) for counts in zip(*status.by_date.values())])
+  return status
+
+
+# Map of (event id, event version) -> EventFillStatus.
+_fill_status_by_event_version = TTLCache()
+
+
+def get_fill_status(event):
+  """Returns the EventFillStatus of the given event, from this process's cache if the event hasn't changed."""
+  key = (event.id, get_event_version(event.id))
+  return _fill_status_by_event_version.get(key, lambda: compute_fill_status(event))
@@ -4,22 +4,27 @@
 from __future__ import (absolute_import, division, generators, nested_scopes,
                         print_function, unicode_literals, with_statement)
 
+import datetime
 import re
 
 import requests
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.db import transaction
-from django.forms import (BaseInlineFormSet, BaseModelFormSet, Field, FileField, FileInput,
-                          Form, ModelForm, ModelMultipleChoiceField, SelectMultiple, TextInput, URLField,
-                          ValidationError)
+from django.forms import (BaseInlineFormSet, BaseModelFormSet, BooleanField, CharField, DateField, Field, FileField,
+                          FileInput, Form, ModelForm, ModelMultipleChoiceField, SelectMultiple, SlugField, TextInput,
+                          URLField, ValidationError)
 from django.forms.utils import pretty_name
 from django.utils.html import format_html
 from django.utils.translation import ugettext as _
 
-from dicpick.models import Assignment, Event, Participant, Tag, Task, TaskType
+from dicpick.intervals import time_interval
+from dicpick.locks import lock_event_dates
+from dicpick.models import (MAX_DAYS_IN_MASK, Assignment, Event, Participant, Tag, Task, TaskType, dates_to_day_mask,
+                            day_mask_to_dates, refresh_open_slots)
 from dicpick.templatetags.dicpick_helpers import date_to_slug
 from dicpick.util import create_user
+from dicpick.versions import bump_event_version
 
 
 # Note: This file contains many performance hacks to work around Django's naive handling of inline formsets.
@@ -75,9 +80,71 @@ class EventForm(DicPickModelFormBase):
     data = super(EventForm, self).clean()
     if data.get('start_date') > data.get('end_date'):
       raise ValidationError('Start date must precede end date.')
+    # Participants' unavailable days are stored as a bitmask over the days of the event (see dates_to_day_mask()).
+    if (data.get('end_date') - data.get('start_date')).days >= MAX_DAYS_IN_MASK:
+      raise ValidationError('Events may be at most {} days long.'.format(MAX_DAYS_IN_MASK))
     return data
 
 
+def clean_time_range(data):
+  """Validates the start_time and end_time in the given cleaned form data."""
+  start_time = data.get('start_time')
+  end_time = data.get('end_time')
+  if start_time is not None and end_time is not None and start_time >= end_time:
+    raise ValidationError('Start time must precede end time.')
+
+
+class EventCloneForm(Form):
+  """A form to create a new event as a copy of an existing one."""
+  name = CharField(max_length=40, help_text='E.g., "Burning Man 2017".')
+  slug = SlugField(max_length=10, help_text='A short string to use in URLs.  E.g., "2017".')
+  start_date = DateField(help_text='First day of the new event.  All other dates are shifted accordingly.')
+  with_do_not_assign_with = BooleanField(required=False, label='Copy "do not assign with"',
+                                         help_text='Also copy which people must not be assigned tasks together')
+
+  def __init__(self, *args, **kwargs):
+    self.camp = kwargs.pop('camp')
+    super(EventCloneForm, self).__init__(*args, **kwargs)
+
+  def clean(self):
+    data = super(EventCloneForm, self).clean()
+    # The new event will be created outside of a ModelForm, so we must check uniqueness ourselves.
+    for field in ['name', 'slug']:
+      if data.get(field) and Event.objects.filter(camp=self.camp, **{field: data[field]}).exists():
+        self.add_error(field, 'An event with this {} already exists.'.format(field))
+    return data
+
+
+class TagMultipleChoiceField(ModelMultipleChoiceField):
+  """A field for selecting multiple tags, with performance hacks.
+
+  Forms deriving from FormWithTagsBase must use this for their 'tags' field (via their Meta.field_classes).
+  """
+  tags_by_id = None  # Set by the form on each instance, on creation.
+
+  def clean(self, value):
+    # Copied from the superclass clean() method.
+    if self.required and not value:
+      raise ValidationError(self.error_messages['required'], code='required')
+    elif not self.required and not value:
+      return self.queryset.none()
+    if not isinstance(value, (list, tuple)):
+      raise ValidationError(self.error_messages['list'], code='list')
+
+    # Here the superclass creates a queryset and triggers a new db query every time.
+    # However we know we can satisfy the lookup in memory, so we do so here instead.
+    ret = []
+    for tag_id in value:
+      try:
+        ret.append(self.tags_by_id[int(tag_id)])
+      except (KeyError, ValueError):
+        raise ValidationError('Invalid tag id: {}'.format(tag_id))
+
+    # Back to the superclass clean() method's implementation.
+    self.run_validators(value)
+    return ret
+
+
 class FormWithTagsBase(DicPickModelFormBase):
   """A base class for forms with many-to-many field, named 'tags', to the Tag model.
 
@@ -96,6 +163,7 @@ class FormWithTagsBase(DicPickModelFormBase):
     field = self.fields['tags']
     field.choices = [(field.prepare_value(tags_by_id[x]), field.label_from_instance(tags_by_id[x]))
                      for x in self.initial.get('tags', [])]
+    field.tags_by_id = tags_by_id
 
 
 class TagForm(DicPickModelFormBase):
@@ -114,21 +182,31 @@ class TaskTypeForm(FormWithTagsBase):
   """A form to add/edit a single task type."""
   class Meta:
     model = TaskType
-    fields = ['name', 'start_date', 'end_date', 'num_people', 'score', 'tags']
+    fields = ['name', 'start_date', 'end_date', 'start_time', 'end_time', 'num_people', 'score', 'tags']
     qualifier = 'tasktype'
     labels = {
       'num_people': '# people',
       'score': 'Points'
     }
+    field_classes = {
+      'tags': TagMultipleChoiceField,
+    }
     help_texts = {
       'name': 'E.g., Dinner Sous Chef',
       'start_date': 'First day on which tasks of this type must be performed',
       'end_date': 'Last day on which tasks of this type must be performed',
+      'start_time': 'Time of day at which tasks of this type start (leave empty for all day)',
+      'end_time': 'Time of day at which tasks of this type end (leave empty for all day)',
       'num_people': 'Number of people needed to perform tasks of this type each day',
       'score': 'Points each person performing this task earns for doing so',
       'tags': 'Only people with at least one of these tags can be assigned tasks of this type'
     }
 
+  def clean(self):
+    data = super(TaskTypeForm, self).clean()
+    clean_time_range(data)
+    return data
+
 
 class AssigneesSelect(SelectMultiple):
   """A custom widget to render assignees efficiently."""
@@ -182,15 +260,18 @@ class TaskFormBase(FormWithTagsBase):
   class Meta:
     model = Task
     # Subclasses must copy the fields list, because it gets modified by the framework.
-    fields = ['num_people', 'assignees', 'score', 'tags', 'do_not_assign_to']
+    fields = ['start_time', 'end_time', 'num_people', 'assignees', 'score', 'tags', 'do_not_assign_to']
     qualifier = 'task'
     labels = {
+      'start_time': 'Start',
+      'end_time': 'End',
       'num_people': '# people',
       'assignees': 'Assigned to',
       'score': 'Points',
       'do_not_assign_to': 'Unassignable',
     }
     field_classes = {
+      'tags': TagMultipleChoiceField,
       'assignees': ParticipantMultipleChoiceField,
       'do_not_assign_to': ParticipantMultipleChoiceField,
     }
@@ -198,6 +279,8 @@ class TaskFormBase(FormWithTagsBase):
       'assignees': AssigneesSelect,
     }
     help_texts = {
+      'start_time': 'Time at which this task starts (leave empty for all day)',
+      'end_time': 'Time at which this task ends (leave empty for all day)',
       'num_people': 'Number of people needed to perform this task on this day',
       'assignees': 'People currently assigned to this task',
       'score': 'Points each person performing this task on this day earns for doing so',
@@ -236,34 +319,36 @@ class TaskFormBase(FormWithTagsBase):
   def clean_assignees(self):
     """Custom validation logic.
 
-    Disallows a participant from being assigned two tasks on the same date.
+    Disallows a participant from being assigned a task on a day they're not available, or two tasks that overlap
+    in time.
     """
     assignees = self.cleaned_data.get('assignees')
+    # Note that the time fields precede this one, so they've already been cleaned.
+    start, end = time_interval(self.cleaned_data.get('start_time'), self.cleaned_data.get('end_time'))
     for assignee in assignees:
-      if (self.instance.date in assignee.cached_task_dates and
-          self.instance.id not in [t.id for t in assignee.cached_tasks]):
-        raise ValidationError('{} already assigned to a {} on this date.'.format(assignee, _('task')))
+      if self.instance.id in [t.id for t in assignee.cached_tasks]:
+        continue  # Already assigned to this task.
+      if not assignee.is_available(self.instance.date):
+        raise ValidationError('{} not available on this date.'.format(assignee))
+      if assignee.cached_busy_intervals.overlaps(self.instance.date, start, end):
+        raise ValidationError('{} already assigned to a {} at this time.'.format(assignee, _('task')))
     return assignees
 
+  def clean(self):
+    data = super(TaskFormBase, self).clean()
+    clean_time_range(data)
+    return data
+
+  # The assignees submitted for this task, set by save().
+  # Note that save() does not itself save the assignees: the formset saves the assignees of all its forms at once.
+  # See TaskFormsetMixin.save() below.
+  assignees_to_save = None
+
   def save(self, commit=True):
     # Pop off the asignees so that the super() call doesn't try to save them (which it can't do because
     # the through table isn't autocreated, and it won't know how to create instances of it).
-    assignees = self.cleaned_data.pop('assignees')
-    with transaction.atomic():
-      # Save without the assignees.
-      super(TaskFormBase, self).save(commit)
-      # Manually save the assignees.
-      existing_assignments = set(self.instance.assignment_set.all())
-      self.instance.assignees.clear()
-      to_create = []
-      for assignee in assignees:
-        automatic = False
-        for ea in existing_assignments:
-          if ea.participant == assignee and ea.task == self.instance:
-            automatic = ea.automatic
-            break
-        to_create.append(Assignment(participant=assignee, task=self.instance, automatic=automatic))
-      Assignment.objects.bulk_create(to_create)
+    self.assignees_to_save = self.cleaned_data.pop('assignees')
+    return super(TaskFormBase, self).save(commit)
 
 
 class TaskByTypeForm(TaskFormBase):
@@ -350,11 +435,14 @@ class ParticipantForm(FormWithTagsBase):
   """Form to add/edit a single participant."""
   class Meta:
     model = Participant
-    fields = ['user', 'start_date', 'end_date', 'tags', 'initial_score', 'do_not_assign_with']
+    fields = ['user', 'start_date', 'end_date', 'unavailable_dates', 'tags', 'initial_score', 'do_not_assign_with']
     qualifier = 'participant'
     labels = {
       'initial_score': 'Extra&nbsp;Pts'
     }
+    field_classes = {
+      'tags': TagMultipleChoiceField,
+    }
     help_texts = {
       'start_date': 'First day person is available for tasks',
       'end_date': 'Last day person is available for tasks',
@@ -365,13 +453,22 @@ class ParticipantForm(FormWithTagsBase):
 
   user = UserField(help_text='Identify new or existing users as Firstname Lastname (email)')
 
+  # Edits the participant's unavailable_days bitmask, as a list of dates.
+  unavailable_dates = CharField(required=False, label='Unavailable',
+                                help_text='Days between the first and last days on which this person is not '
+                                          'available for tasks, as comma-separated YYYY-MM-DD dates')
+
   def __init__(self, *args, **kwargs):
     # Apply the hack to pass the id -> user map into the widget.
     # See UserWidget above and ParticipantAndTagChoicesFormsetMixin below for details.
     participants_by_id = kwargs.pop('participants_by_id')
     users_by_id = kwargs.pop('users_by_id')
+    self.event = kwargs.pop('event')
     super(ParticipantForm, self).__init__(*args, **kwargs)
     self.fields['user'].widget.users_by_id = users_by_id
+    if self.instance.unavailable_days:
+      self.initial['unavailable_dates'] = ', '.join(
+          str(dt) for dt in day_mask_to_dates(self.event.start_date, self.instance.unavailable_days))
 
     do_not_assign_with_field = self.fields['do_not_assign_with']
     # Create <option> tags for the currently selected values in this form, so that the initial data displays
@@ -381,6 +478,21 @@ class ParticipantForm(FormWithTagsBase):
                                          do_not_assign_with_field.label_from_instance(participants_by_id[x]))
                                         for x in self.initial.get('do_not_assign_with', [])]
 
+  def clean_unavailable_dates(self):
+    dates = []
+    for date_str in self.cleaned_data.get('unavailable_dates', '').replace(',', ' ').split():
+      try:
+        dates.append(datetime.datetime.strptime(date_str, '%Y-%m-%d').date())
+      except ValueError:
+        raise ValidationError('Invalid date: {}'.format(date_str))
+    try:
+      self.instance.unavailable_days = dates_to_day_mask(self.event.start_date, dates)
+    except ValueError:
+      raise ValidationError('Dates must be within the first {} days of the event.'.format(MAX_DAYS_IN_MASK))
+    if any(not self.event.is_in_date_range(dt) for dt in dates):
+      raise ValidationError('Dates must be within the event.')
+    return dates
+
   def _get_validation_exclusions(self):
     # Don't validate the user field, because it will cause at least one db query per form in the formset.
     return super(ParticipantForm, self)._get_validation_exclusions() + ['user']
@@ -461,7 +573,8 @@ class ParticipantAndTagChoicesFormsetMixin(TagChoicesFormsetMixin):
   def __init__(self, *args, **kwargs):
     event = kwargs.get('event')  # Superclass needs this kwarg, and will pop it off before passing the kwargs up.
     super(ParticipantAndTagChoicesFormsetMixin, self).__init__(*args, **kwargs)
-    participant_choices = Participant.objects.filter(event=event).select_related('user').prefetch_related('tasks').all()
+    # Note that fetching via event.participants sets each participant's event, which Participant.is_available() uses.
+    participant_choices = event.participants.select_related('user').prefetch_related('tasks').all()
     self._participants_by_id = {p.id: p for p in participant_choices}
     self._users_by_id = {p.user_id: p.user for p in participant_choices}
 
@@ -484,6 +597,7 @@ class TaskFormsetMixin(ParticipantAndTagChoicesFormsetMixin):
   """Formset mixin for editing tasks."""
   def __init__(self, *args, **kwargs):
     queryset = kwargs.get('queryset')
+    self._event = kwargs.get('event')
     super(TaskFormsetMixin, self).__init__(*args, **kwargs)
     self._tasks_by_id = {t.id: t for t in queryset.all()}
 
@@ -501,6 +615,47 @@ class TaskFormsetMixin(ParticipantAndTagChoicesFormsetMixin):
     form.fields['do_not_assign_to'].to_python = self.participant_id_to_python
     form.fields['id'].to_python = self.task_id_to_python
 
+  def save(self, commit=True):
+    with transaction.atomic():
+      # Changes to the assignments on these dates must not interleave with other such changes (see locks.py).
+      # Note that callers must already hold these locks when validating the formset, as validation checks the
+      # assignees' other tasks (see InlineTaskFormsetUpdateBase.post).  Re-acquiring a held lock is a no-op.
+      lock_event_dates(self._event.id, [form.instance.date for form in self.forms if form.has_changed()])
+      ret = super(TaskFormsetMixin, self).save(commit)
+      self._save_assignees()
+    return ret
+
+  def _save_assignees(self):
+    """Saves the assignees of all the forms in this formset with one diff against the existing assignments.
+
+    Only the task <-> participant pairs that were removed are deleted, and only those that were added are created,
+    in a single query each.  Unchanged assignments are left untouched, so they retain their 'automatic' flag.
+    """
+    to_delete = []
+    to_create = []
+    saved_task_ids = []
+    for form in self.forms:
+      if form.assignees_to_save is None:  # This form wasn't saved, e.g., because it didn't change.
+        continue
+      task = form.instance
+      saved_task_ids.append(task.id)
+      # Note that the task's assignment_set is prefetched by the views that use us.
+      existing_assignments_by_participant_id = {a.participant_id: a for a in task.assignment_set.all()}
+      assignees_by_id = {p.id: p for p in form.assignees_to_save}
+      to_delete.extend(a.id for (participant_id, a) in existing_assignments_by_participant_id.items()
+                       if participant_id not in assignees_by_id)
+      to_create.extend(Assignment(participant=p, task=task, automatic=False)
+                       for (participant_id, p) in assignees_by_id.items()
+                       if participant_id not in existing_assignments_by_participant_id)
+    if to_delete:
+      Assignment.objects.filter(id__in=to_delete).delete()
+    if to_create:
+      Assignment.objects.bulk_create(to_create)
+    # Note that we refresh all the saved tasks, not just those whose assignees changed, as num_people may have too.
+    refresh_open_slots(saved_task_ids)
+    if to_delete or to_create:
+      bump_event_version(self._event.id)
+
 
 class TaskInlineFormset(TaskFormsetMixin, BaseInlineFormSet):
   """InlineFormset for editing tasks that all share a foreign key to a single TaskType."""
@@ -514,6 +669,11 @@ class TaskModelFormset(TaskFormsetMixin, BaseModelFormSet):
 
 class ParticipantInlineFormset(ParticipantAndTagChoicesFormsetMixin, BaseInlineFormSet):
   """Formset for editing participants inline."""
+  def get_form_kwargs(self, index):
+    kwargs = super(ParticipantInlineFormset, self).get_form_kwargs(index)
+    kwargs['event'] = self.instance  # Our parent instance is the event.
+    return kwargs
+
   def add_fields(self, form, index):
     super(ParticipantInlineFormset, self).add_fields(form, index)
     # The naive to_python queries the database each time.  But we know we've already fetched
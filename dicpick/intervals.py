@@ -0,0 +1,73 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import bisect
+
+"""Helpers for detecting scheduling conflicts between tasks that occupy time intervals within a day.
+
+A task with no start/end time occupies its entire day, and therefore conflicts with any other task on that day.
+"""
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def time_interval(start_time, end_time):
+  """Returns the half-open interval [start, end) covered by the given times, in minutes since midnight.
+
+  A missing start time means the start of the day, and a missing end time means the end of the day.
+  """
+  start = start_time.hour * 60 + start_time.minute if start_time is not None else 0
+  end = end_time.hour * 60 + end_time.minute if end_time is not None else MINUTES_PER_DAY
+  return start, end
+
+
+def task_interval(task):
+  """Returns the half-open interval [start, end) covered by the given task, in minutes since midnight."""
+  return time_interval(task.start_time, task.end_time)
+
+
+class IntervalIndex(object):
+  """The time intervals during which someone is busy, on various dates.
+
+  Overlap tests take O(log n) time, where n is the number of intervals on the date in question.
+
+  Note that we only need to know whether someone is busy at any given time, not why, so we merge overlapping
+  (and adjacent) intervals.  This keeps the intervals on each date disjoint, and therefore sorted by both start
+  and end, which is what allows us to binary-search them.
+  """
+  def __init__(self, tasks=()):
+    # Map of date -> (sorted list of interval starts, sorted list of the corresponding interval ends).
+    self._intervals_by_date = {}
+    for task in tasks:
+      self.add_task(task)
+
+  def add(self, date, start, end):
+    """Marks the half-open interval [start, end) on the given date as busy."""
+    starts, ends = self._intervals_by_date.setdefault(date, ([], []))
+    # The existing intervals that overlap or touch the new one are those at indexes i..k-1.
+    i = bisect.bisect_left(ends, start)
+    k = bisect.bisect_right(starts, end)
+    if i < k:
+      start = min(start, starts[i])
+      end = max(end, ends[k - 1])
+    starts[i:k] = [start]
+    ends[i:k] = [end]
+
+  def add_task(self, task):
+    self.add(task.date, *task_interval(task))
+
+  def overlaps(self, date, start, end):
+    """Returns True iff any part of the half-open interval [start, end) on the given date is busy."""
+    intervals = self._intervals_by_date.get(date)
+    if intervals is None:
+      return False
+    starts, ends = intervals
+    # The first interval that ends after our start is the only one that can overlap us.
+    i = bisect.bisect_right(ends, start)
+    return i < len(starts) and starts[i] < end
+
+  def overlaps_task(self, task):
+    return self.overlaps(task.date, *task_interval(task))
@@ -0,0 +1,91 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import logging
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+"""Lightweight per-event, per-date locks, to serialize concurrent changes to the assignments on the same dates.
+
+Whether a participant may be assigned a task depends on their other assignments on the same date.  So two
+transactions that assign tasks on the same date (e.g., two admins auto-assigning overlapping dates) must not run
+concurrently, or they may double-book a participant.  Transactions that only touch different dates may.
+
+Locking all the relevant task rows with select_for_update would serialize far too much, so instead we use Postgres
+transaction-level advisory locks, keyed by (event id, date).  These are released automatically when the transaction
+commits or rolls back.  On other databases (e.g., sqlite in development) locking is a no-op.
+"""
+
+logger = logging.getLogger(__name__)
+
+# The SQLSTATE Postgres reports when lock_timeout expires.
+_LOCK_NOT_AVAILABLE = '55P03'
+
+
+class LockTimeout(Exception):
+  def __init__(self, event_id, dates):
+    super(LockTimeout, self).__init__(
+        'Timed out waiting for another change to the assignments of event {} on {}'.format(
+            event_id, ', '.join(str(dt) for dt in sorted(dates))))
+    self.event_id = event_id
+    self.dates = dates
+
+
+def lock_event_dates(event_id, dates):
+  """Locks the given dates of the given event until the end of the current transaction.
+
+  Waits for at most DICPICK_LOCK_TIMEOUT milliseconds for other transactions holding any of these locks.
+
+  Must be called inside a transaction (e.g., in a transaction.atomic block).
+
+  :param event_id: The id of the event.
+  :param dates: An iterable of the dates to lock.
+  :return: The number of seconds spent waiting for the locks.
+  :raises LockTimeout: If the locks weren't acquired in time.
+  """
+  # Note that we always acquire locks in the same order, so that two transactions can't deadlock on each other.
+  keys = sorted(set(dt.toordinal() for dt in dates))
+  if not keys or connection.vendor != 'postgresql':
+    return 0.0
+
+  start = time.time()
+  with connection.cursor() as cursor:
+    # Set the lock timeout for the duration of this function only, so that other statements in the transaction
+    # aren't affected.  Note that the third argument to set_config makes the setting transaction-local.
+    cursor.execute("SELECT current_setting('lock_timeout')")
+    previous_lock_timeout = cursor.fetchone()[0]
+    cursor.execute("SELECT set_config('lock_timeout', %s, true)", ['{}ms'.format(settings.DICPICK_LOCK_TIMEOUT)])
+    try:
+      for key in keys:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [event_id, key])
+    except OperationalError as e:
+      if getattr(e.__cause__, 'pgcode', None) == _LOCK_NOT_AVAILABLE:
+        logger.warning('Timed out after %.1f ms waiting for locks on event %d', (time.time() - start) * 1000, event_id)
+        raise LockTimeout(event_id, dates)
+      raise
+    cursor.execute("SELECT set_config('lock_timeout', %s, true)", [previous_lock_timeout])
+
+  wait = time.time() - start
+  logger.info('Waited %.1f ms for %d date locks on event %d', wait * 1000, len(keys), event_id)
+  return wait
+
+
+# The second half of the key of the lock that serializes the starting of an event's schedule notification sends (see
+# notify.py).  Date locks use the dates' ordinals, which are positive, so this can't clash with them.
+_NOTIFICATIONS_KEY = -1
+
+
+def lock_event_notifications(event_id):
+  """Locks the starting of the given event's schedule notification sends until the end of the current transaction.
+
+  Must be called inside a transaction.  Callers hold this lock only briefly, so we don't time out.
+  """
+  if connection.vendor != 'postgresql':
+    return
+  with connection.cursor() as cursor:
+    cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [event_id, _NOTIFICATIONS_KEY])
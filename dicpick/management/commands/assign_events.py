@@ -0,0 +1,73 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import time
+from concurrent.futures import as_completed
+
+from django.core.management import BaseCommand, CommandError
+
+from dicpick.models import Event
+from dicpick.scheduler import AssignmentScheduler
+
+
+class Command(BaseCommand):
+  help = ('Auto-assigns all unassigned tasks of the given events, running the events concurrently in a pool of '
+          'worker processes, with the camps taking turns.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('events', nargs='*', metavar='camp_slug/event_slug',
+                        help='The events to auto-assign.  A camp slug on its own selects all events of that camp.')
+    parser.add_argument('--all', action='store_true', default=False, help='Auto-assign all events.')
+    parser.add_argument('--workers', type=int, help='Number of worker processes.  Defaults to the number of cores.')
+    parser.add_argument('--seed', type=int, help='Random seed for every auto-assign run, for reproducible results.')
+    parser.add_argument('--trials', type=int,
+                        help='Number of independently seeded trials per event, keeping the best.  Each event runs '
+                             'its trials one after the other, in its worker process.  Defaults to '
+                             'DICPICK_ASSIGN_TRIALS.')
+
+  def handle(self, *args, **options):
+    events = self.get_events(options)
+    if not events:
+      raise CommandError('No events to auto-assign.')
+
+    start = time.time()
+    scheduler = AssignmentScheduler(max_workers=options['workers'])
+    events_by_future = {scheduler.submit(event, seed=options['seed'], trials=options['trials']): event
+                        for event in events}
+    failed = 0
+    try:
+      for future in as_completed(events_by_future):
+        event = events_by_future[future]
+        try:
+          result = future.result()
+        except Exception as e:
+          failed += 1
+          self.stderr.write('{}/{}: failed: {}'.format(event.camp.slug, event.slug, e))
+        else:
+          self.stdout.write('{}/{}: done in {:.1f} seconds, {} tasks could not be fully assigned'.format(
+              event.camp.slug, event.slug, result.duration, len(result.unassignable_task_ids)))
+    finally:
+      scheduler.shutdown()
+    self.stdout.write('Auto-assigned {} events in {:.1f} seconds'.format(len(events) - failed, time.time() - start))
+    if failed:
+      raise CommandError('{} events failed'.format(failed))
+
+  @staticmethod
+  def get_events(options):
+    events = Event.objects.select_related('camp').order_by('camp__slug', 'start_date')
+    if options['all']:
+      return list(events)
+    ret = []
+    for spec in options['events']:
+      camp_slug, _, event_slug = spec.partition('/')
+      selected = events.filter(camp__slug=camp_slug)
+      if event_slug:
+        selected = selected.filter(slug=event_slug)
+      selected = list(selected)
+      if not selected:
+        raise CommandError('No event matches {}'.format(spec))
+      ret.extend(e for e in selected if e not in ret)
+    return ret
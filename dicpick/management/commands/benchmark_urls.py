@@ -0,0 +1,218 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import json
+import math
+import threading
+import timeit
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.core.urlresolvers import resolve, reverse
+from django.db import connections, transaction
+from django.test import Client, RequestFactory
+
+from dicpick import urls as dicpick_urls
+from dicpick.feeds import task_type_feed_token
+from dicpick.middleware import capture_queries
+from dicpick.models import Event
+from dicpick.schedules import schedule_token
+from dicpick.templatetags.dicpick_helpers import date_to_slug
+
+
+# Query string parameters for views that need them.
+_query_params = {
+  'tag_autocomplete': {'q': 'tag'},
+  'participant_autocomplete': {'q': 'a'},
+}
+
+# Views that only accept POSTs, with data we don't synthesize.
+_post_only = {'swap_assignments'}
+
+# Representative POSTs, as a map of url name -> extra POST data.  The rest of the POST data is the form's initial
+# data, i.e., what the browser would submit if the user didn't change anything.
+# We don't POST to any other views, as they either delete data or require data we can't synthesize (e.g., uploads).
+_posts = {
+  'tasks_by_date_update': {'assign': 'Auto-Assign'},
+  'tasks_by_type_update': {'form-submit': 'Submit'},
+}
+
+
+def percentile(sorted_values, p):
+  """Returns the p'th percentile of the given sorted values, using the nearest-rank method."""
+  if not sorted_values:
+    return None
+  return sorted_values[max(0, int(math.ceil(p / 100.0 * len(sorted_values))) - 1)]
+
+
+class Command(BaseCommand):
+  help = ('Measures the latency of every route in dicpick/urls.py against an existing data set (e.g., one created '
+          'by generate_load_data), and reports latency percentiles, throughput and query counts per route as JSON. '
+          'POSTs are rolled back, so the data set is not modified.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('camp_slug', help='Benchmark against an event in this camp.')
+    parser.add_argument('event_slug', help='Benchmark against this event.')
+    parser.add_argument('--user', help='Email of the user to make requests as.  Defaults to an admin of the camp.')
+    parser.add_argument('--requests', type=int, default=20, help='Number of requests per route.')
+    parser.add_argument('--concurrency', type=int, default=1, help='Number of concurrent requests per route.')
+    parser.add_argument('--route', action='append', dest='routes', help='Only benchmark this route (repeatable).')
+    parser.add_argument('--no-posts', action='store_true', default=False, help="Don't benchmark POSTs.")
+    parser.add_argument('--host', help='HTTP Host header to send.  Defaults to the first entry in ALLOWED_HOSTS.')
+    parser.add_argument('--secure', action='store_true', default=False, help='Make requests over (simulated) https.')
+    parser.add_argument('--output', help='Write the JSON report to this file, instead of to stdout.')
+
+  def handle(self, *args, **options):
+    try:
+      event = Event.objects.select_related('camp').get(camp__slug=options['camp_slug'], slug=options['event_slug'])
+    except Event.DoesNotExist:
+      raise CommandError('No event {} in camp {}'.format(options['event_slug'], options['camp_slug']))
+    if options['user']:
+      user = User.objects.filter(email=options['user']).first()
+    else:
+      user = (User.objects.filter(groups=event.camp.admin_group).order_by('id').first() or
+              User.objects.filter(is_superuser=True).order_by('id').first())
+    if user is None:
+      raise CommandError('No user to make requests as.')
+    self.user = user
+    self.options = options
+    self.client_kwargs = {'HTTP_HOST': options['host'] or self._default_host()}
+    if options['secure']:
+      self.client_kwargs['wsgi.url_scheme'] = 'https'
+      self.client_kwargs['SERVER_PORT'] = '443'
+
+    task_type_pk = event.task_types.order_by('id').values_list('id', flat=True).first()
+    participant_pk = event.participants.order_by('id').values_list('id', flat=True).first()
+    all_kwargs = {
+      'camp_slug': event.camp.slug,
+      'event_slug': event.slug,
+      'task_type_pk': task_type_pk,
+      'date': date_to_slug(event.start_date),
+      'token': schedule_token(participant_pk),
+      'task_type_token': task_type_feed_token(task_type_pk),
+    }
+    results = []
+    for pattern in dicpick_urls.urlpatterns:
+      if options['routes'] and pattern.name not in options['routes']:
+        continue
+      if pattern.name in _post_only:
+        continue
+      url = reverse('dicpick:{}'.format(pattern.name), kwargs={k: all_kwargs[k] for k in pattern.regex.groupindex})
+      results.append(self.benchmark(pattern.name, 'GET', url, _query_params.get(pattern.name, {})))
+      if pattern.name in _posts and not options['no_posts']:
+        data = self.initial_post_data(url)
+        data.update(_posts[pattern.name])
+        results.append(self.benchmark(pattern.name, 'POST', url, data))
+
+    report = json.dumps({
+      'event': '{}/{}'.format(event.camp.slug, event.slug),
+      'user': user.email,
+      'requests_per_route': options['requests'],
+      'concurrency': options['concurrency'],
+      'routes': results,
+    }, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as outfile:
+        outfile.write(report)
+    else:
+      self.stdout.write(report)
+
+  @staticmethod
+  def _default_host():
+    hosts = [h for h in settings.ALLOWED_HOSTS if h != '*']
+    return hosts[0].lstrip('.') if hosts else 'localhost'
+
+  def initial_post_data(self, url):
+    """Returns the POST data a browser would submit for the form at the given url, if the user changed nothing."""
+    request = RequestFactory().get(url, **self.client_kwargs)
+    request.user = self.user
+    match = resolve(url)
+    view = match.func.view_class(**match.func.view_initkwargs)
+    view.request = request
+    view.args = match.args
+    view.kwargs = match.kwargs
+    form = view.get_form()
+
+    data = {}
+    management_form = form.management_form
+    for name, field in management_form.fields.items():
+      data[management_form.add_prefix(name)] = management_form.initial.get(name, field.initial)
+    for f in form.forms:
+      for bound_field in f:
+        value = bound_field.value()
+        if value is not None and value is not False:
+          data[bound_field.html_name] = value
+    return data
+
+  def benchmark(self, name, method, url, data):
+    """Makes the configured number of requests to the url, and returns the statistics."""
+    self.stderr.write('{} {} ...'.format(method, url))
+    num_requests = self.options['requests']
+    # Each entry is a tuple (seconds, number of queries, status code).
+    samples = []
+    lock = threading.Lock()
+    next_request = [0]
+
+    def worker():
+      client = Client(**self.client_kwargs)
+      client.force_login(self.user)
+      try:
+        while True:
+          with lock:
+            if next_request[0] >= num_requests:
+              return
+            next_request[0] += 1
+          samples.append(self.timed_request(client, method, url, data))
+      finally:
+        for connection in connections.all():
+          connection.close()
+
+    start = timeit.default_timer()
+    threads = [threading.Thread(target=worker) for _ in range(self.options['concurrency'])]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    elapsed = timeit.default_timer() - start
+
+    latencies = sorted(s[0] * 1000 for s in samples)
+    query_counts = sorted(s[1] for s in samples)
+
+    def ms(x):
+      return None if x is None else round(x, 2)
+
+    return {
+      'name': name,
+      'method': method,
+      'url': url,
+      'requests': len(samples),
+      'status_codes': dict(Counter(s[2] for s in samples)),
+      'p50_ms': ms(percentile(latencies, 50)),
+      'p95_ms': ms(percentile(latencies, 95)),
+      'p99_ms': ms(percentile(latencies, 99)),
+      'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+      'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+      'queries_median': percentile(query_counts, 50),
+      'queries_max': query_counts[-1] if query_counts else None,
+    }
+
+  @staticmethod
+  def timed_request(client, method, url, data):
+    queries = []
+    start = timeit.default_timer()
+    with capture_queries(queries):
+      if method == 'GET':
+        response = client.get(url, data)
+      else:
+        # Roll back POSTs, so that we don't modify the data set, and every request does the same work.
+        with transaction.atomic():
+          response = client.post(url, data)
+          transaction.set_rollback(True)
+      if response.streaming:
+        b''.join(response.streaming_content)
+    return timeit.default_timer() - start, len(queries), response.status_code
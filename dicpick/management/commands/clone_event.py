@@ -0,0 +1,45 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import datetime
+
+from django.core.management import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from dicpick.clone import clone_event
+from dicpick.models import Event
+
+
+class Command(BaseCommand):
+  help = 'Creates a new event as a copy of an existing one, with all dates shifted to a new start date.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('camp_slug', help='The camp the event belongs to.')
+    parser.add_argument('event_slug', help='The event to copy.')
+    parser.add_argument('new_slug', help='The slug of the new event.')
+    parser.add_argument('new_name', help='The name of the new event.')
+    parser.add_argument('start_date', help='The first day of the new event, as YYYY-MM-DD.')
+    parser.add_argument('--with-do-not-assign-with', action='store_true', default=False,
+                        help='Also copy which participants must not be assigned tasks together.')
+
+  def handle(self, *args, **options):
+    try:
+      event = Event.objects.get(camp__slug=options['camp_slug'], slug=options['event_slug'])
+    except Event.DoesNotExist:
+      raise CommandError('No event {} in camp {}'.format(options['event_slug'], options['camp_slug']))
+    try:
+      start_date = datetime.datetime.strptime(options['start_date'], '%Y-%m-%d').date()
+    except ValueError:
+      raise CommandError('Invalid start date: {}'.format(options['start_date']))
+
+    try:
+      new_event = clone_event(event, options['new_name'], options['new_slug'], start_date,
+                              options['with_do_not_assign_with'])
+    except IntegrityError:
+      # Note that clone_event() is atomic, so nothing was created.
+      raise CommandError('Camp {} already has an event named {} or with slug {}'.format(
+          options['camp_slug'], options['new_name'], options['new_slug']))
+    self.stdout.write('Created {} ({} to {})'.format(new_event, new_event.start_date, new_event.end_date))
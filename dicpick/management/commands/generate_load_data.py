@@ -0,0 +1,234 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import datetime
+import random
+import time
+from collections import defaultdict
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from dicpick.intervals import IntervalIndex
+from dicpick.models import (MAX_DAYS_IN_MASK, Assignment, Camp, Event, Participant, Tag, Task, TaskType,
+                            dates_to_day_mask, refresh_open_slots)
+
+
+_first_names = ['Alice', 'Bob', 'Carol', 'Dave', 'Erin', 'Frank', 'Grace', 'Heidi', 'Ivan', 'Judy', 'Mallory',
+                'Niaj', 'Olivia', 'Peggy', 'Rupert', 'Sybil', 'Trent', 'Victor', 'Walter', 'Zoe']
+_last_names = ['Adams', 'Baker', 'Clark', 'Davis', 'Evans', 'Fisher', 'Garcia', 'Hughes', 'Irwin', 'Jones',
+               'King', 'Lopez', 'Moore', 'Nolan', 'Owens', 'Parker', 'Quinn', 'Reed', 'Smith', 'Turner']
+_task_names = ['Breakfast', 'Lunch', 'Dinner', 'MOOP Sweep', 'Kitchen Cleanup', 'Shade Repair', 'Greeter',
+               'Bar', 'Water Run', 'Ice Run', 'Camp Manager', 'Sound', 'Lights', 'Art Car', 'Gate']
+_task_roles = ['Lead', 'Helper', 'Morning', 'Evening', 'Night']
+_scores = [5, 10, 10, 15, 20, 20, 30]
+_shifts = [(datetime.time(h), datetime.time(h + 4)) for h in [6, 10, 14, 18]]
+
+
+class Command(BaseCommand):
+  help = ('Generates a large, realistic data set (camps, events, users, participants, tasks, conflicts and '
+          'manual assignments), for performance work and demos.  Uses batched bulk inserts and a fixed seed.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('--prefix', default='load',
+                        help='Prefix for camp slugs, group names and usernames, so that runs with different prefixes '
+                             'can coexist.  Must be short, as camp slugs are limited to 10 characters.')
+    parser.add_argument('--camps', type=int, default=2, help='Number of camps.')
+    parser.add_argument('--events-per-camp', type=int, default=2, help='Number of events per camp.')
+    parser.add_argument('--participants', type=int, default=1000, help='Number of participants per event.')
+    parser.add_argument('--task-types', type=int, default=30, help='Number of task types per event.')
+    parser.add_argument('--tags', type=int, default=10, help='Number of tags per event.')
+    parser.add_argument('--days', type=int, default=14, help='Number of days per event.')
+    parser.add_argument('--start-date', default='2016-08-24', help='Start date of the first event, as YYYY-MM-DD.')
+    parser.add_argument('--conflicts', type=int, default=100,
+                        help='Number of "do not assign with" participant pairs per event.')
+    parser.add_argument('--assigned-fraction', type=float, default=0.3,
+                        help='Fraction of task slots to pre-assign manually.')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Batch size for bulk inserts.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible data.')
+
+  def handle(self, *args, **options):
+    self.options = options
+    self.batch_size = options['batch_size']
+    self.rng = random.Random(options['seed'])
+    self.start_date = datetime.datetime.strptime(options['start_date'], '%Y-%m-%d').date()
+    start = time.time()
+    with transaction.atomic():
+      camps = self.create_camps()
+      for camp in camps:
+        users = self.create_users(camp)
+        for i in range(options['events_per_camp']):
+          self.create_event(camp, users, i)
+    self.stdout.write('Done in {:.1f} seconds'.format(time.time() - start))
+
+  def log(self, msg):
+    self.stdout.write(msg)
+
+  def bulk_create(self, model, objs):
+    model.objects.bulk_create(objs, batch_size=self.batch_size)
+    self.log('  Created {} {}'.format(len(objs), model._meta.verbose_name_plural))
+
+  # Note that bulk_create doesn't set the primary keys of the objects it creates, so after each bulk_create we
+  # re-fetch the new objects by their natural unique keys.
+
+  def create_camps(self):
+    prefix = self.options['prefix']
+    num_camps = self.options['camps']
+    group_names = []
+    for i in range(num_camps):
+      group_names.extend(['{}{}_admin'.format(prefix, i), '{}{}_member'.format(prefix, i)])
+    self.bulk_create(Group, [Group(name=name) for name in group_names])
+    groups_by_name = {g.name: g for g in Group.objects.filter(name__in=group_names)}
+
+    self.bulk_create(Camp, [Camp(name='{} Camp {}'.format(prefix.title(), i), slug='{}{}'.format(prefix, i),
+                                 admin_group=groups_by_name['{}{}_admin'.format(prefix, i)],
+                                 member_group=groups_by_name['{}{}_member'.format(prefix, i)])
+                            for i in range(num_camps)])
+    return list(Camp.objects.filter(slug__in=['{}{}'.format(prefix, i) for i in range(num_camps)]).order_by('slug'))
+
+  def create_users(self, camp):
+    """Creates the camp's members (one per participant in each of its events) and an admin user.
+
+    Returns the list of members.
+    """
+    self.log('Camp {}:'.format(camp))
+    # Hashing is deliberately slow, so we hash the password once, and share the hash.
+    password = make_password('123456')
+    admin = User(username='{}-admin'.format(camp.slug), email='{}-admin@example.com'.format(camp.slug),
+                 first_name='Admin', last_name=camp.name.replace(' ', ''), password=password)
+    users = [admin]
+    for i in range(self.options['participants']):
+      first_name = self.rng.choice(_first_names)
+      last_name = self.rng.choice(_last_names)
+      users.append(User(username='{}u{}'.format(camp.slug, i), email='{}u{}@example.com'.format(camp.slug, i),
+                        first_name=first_name, last_name=last_name, password=password))
+    self.bulk_create(User, users)
+    users = list(User.objects.filter(username__in=[u.username for u in users]).order_by('id'))
+    admin = [u for u in users if u.username == '{}-admin'.format(camp.slug)][0]
+    members = [u for u in users if u != admin]
+
+    memberships = [User.groups.through(user_id=u.id, group_id=camp.member_group_id) for u in users]
+    memberships.append(User.groups.through(user_id=admin.id, group_id=camp.admin_group_id))
+    self.bulk_create(User.groups.through, memberships)
+    self.log('  Admin user: {} (password 123456)'.format(admin.email))
+    return members
+
+  def create_event(self, camp, users, index):
+    rng = self.rng
+    options = self.options
+    year = self.start_date.year + index
+    start_date = self.start_date.replace(year=year)
+    end_date = start_date + datetime.timedelta(days=options['days'] - 1)
+    event = Event.objects.create(camp=camp, name='Event {}'.format(year), slug=str(year),
+                                 start_date=start_date, end_date=end_date)
+    self.log(' Event {} ({} to {}):'.format(event, start_date, end_date))
+
+    def day(n):
+      return start_date + datetime.timedelta(days=n)
+
+    # Tags.
+    self.bulk_create(Tag, [Tag(event=event, name='tag {}'.format(i)) for i in range(options['tags'])])
+    tag_ids = list(Tag.objects.filter(event=event).order_by('id').values_list('id', flat=True))
+
+    # Task types.  Most are needed every day, but some only during setup or strike.
+    task_types = []
+    for i in range(options['task_types']):
+      name = '{} {} {}'.format(rng.choice(_task_names), rng.choice(_task_roles), i)
+      kind = rng.random()
+      if kind < 0.15:  # Setup.
+        first, last = 0, min(2, options['days'] - 1)
+      elif kind < 0.3:  # Strike.
+        first, last = max(0, options['days'] - 3), options['days'] - 1
+      else:
+        first, last = 0, options['days'] - 1
+      # About half the task types are shifts of a few hours, and the rest take the whole day.
+      start_time, end_time = rng.choice(_shifts) if rng.random() < 0.5 else (None, None)
+      task_types.append(TaskType(event=event, name=name, start_date=day(first), end_date=day(last),
+                                 start_time=start_time, end_time=end_time,
+                                 num_people=rng.choice([1, 1, 2, 2, 3, 4]), score=rng.choice(_scores)))
+    self.bulk_create(TaskType, task_types)
+    task_types = list(TaskType.objects.filter(event=event).order_by('id'))
+
+    # Roughly a third of task types are restricted to participants with certain tags.
+    task_type_tag_ids = {}
+    for tt in task_types:
+      task_type_tag_ids[tt.id] = rng.sample(tag_ids, min(len(tag_ids), rng.randint(1, 2))) if rng.random() < 0.3 else []
+    self.bulk_create(TaskType.tags.through, [TaskType.tags.through(tasktype_id=tt_id, tag_id=tag_id)
+                                             for (tt_id, tt_tag_ids) in task_type_tag_ids.items()
+                                             for tag_id in tt_tag_ids])
+
+    # Tasks (which we must create explicitly, as bulk_create doesn't send the post_save signal that usually does so).
+    self.bulk_create(Task, [Task(task_type=tt, date=dt, num_people=tt.num_people, score=tt.score,
+                                 start_time=tt.start_time, end_time=tt.end_time, open_slots=tt.num_people)
+                            for tt in task_types for dt in tt.date_range()])
+    tasks = list(Task.objects.filter(task_type__event=event).order_by('date', 'id'))
+    self.bulk_create(Task.tags.through, [Task.tags.through(task_id=t.id, tag_id=tag_id)
+                                         for t in tasks for tag_id in task_type_tag_ids[t.task_type_id]])
+
+    # Participants.  Most are around for the whole event, but some arrive late and/or leave early, and a few
+    # leave in the middle for a couple of days.
+    participants = []
+    for user in users:
+      first, last = 0, options['days'] - 1
+      if rng.random() < 0.4:
+        first = min(last, rng.randint(0, 3))
+        last = max(first, last - rng.randint(0, 3))
+      unavailable_dates = []
+      if rng.random() < 0.1 and last - first > 4 and last < MAX_DAYS_IN_MASK:
+        gap_start = rng.randint(first + 1, last - 3)
+        unavailable_dates = [day(gap_start), day(gap_start + 1)]
+      participants.append(Participant(event=event, user=user, start_date=day(first), end_date=day(last),
+                                      unavailable_days=dates_to_day_mask(start_date, unavailable_dates),
+                                      initial_score=rng.choice([0, 0, 0, 5, 10, 20])))
+    self.bulk_create(Participant, participants)
+    participants = list(event.participants.order_by('id'))
+
+    participant_tag_ids = {p.id: rng.sample(tag_ids, min(len(tag_ids), rng.choice([0, 0, 1, 1, 2, 3])))
+                           for p in participants}
+    self.bulk_create(Participant.tags.through, [Participant.tags.through(participant_id=p_id, tag_id=tag_id)
+                                                for (p_id, p_tag_ids) in participant_tag_ids.items()
+                                                for tag_id in p_tag_ids])
+
+    # Pairs of participants who must not be assigned together.  The relationship is symmetrical, so we create
+    # a through table row for each direction.
+    conflicts = set()
+    if len(participants) > 1:
+      while len(conflicts) < min(options['conflicts'], len(participants) * (len(participants) - 1) // 2):
+        p1, p2 = rng.sample(participants, 2)
+        conflicts.add((min(p1.id, p2.id), max(p1.id, p2.id)))
+    through = Participant.do_not_assign_with.through
+    self.bulk_create(through, [through(from_participant_id=a, to_participant_id=b) for (x, y) in conflicts
+                               for (a, b) in [(x, y), (y, x)]])
+
+    # Map of participant id -> set of ids of the participants they must not be assigned together with.
+    conflicting_ids = defaultdict(set)
+    for x, y in conflicts:
+      conflicting_ids[x].add(y)
+      conflicting_ids[y].add(x)
+
+    # Manual assignments, respecting dates, tags, the no-overlapping-tasks rule and the do-not-assign-with pairs.
+    busy_intervals = defaultdict(IntervalIndex)
+    assignments = []
+    for task in tasks:
+      required_tag_ids = set(task_type_tag_ids[task.task_type_id])
+      assignee_ids = set()
+      for _ in range(task.num_people):
+        if rng.random() >= options['assigned_fraction']:
+          continue
+        for _ in range(10):  # Give up on this slot after a few misses.
+          p = rng.choice(participants)
+          if (p.is_available(task.date) and not busy_intervals[p.id].overlaps_task(task) and
+              (not required_tag_ids or required_tag_ids.intersection(participant_tag_ids[p.id])) and
+              not assignee_ids & conflicting_ids[p.id]):
+            busy_intervals[p.id].add_task(task)
+            assignee_ids.add(p.id)
+            assignments.append(Assignment(participant_id=p.id, task_id=task.id, automatic=False))
+            break
+    self.bulk_create(Assignment, assignments)
+    for i in range(0, len(tasks), self.batch_size):
+      refresh_open_slots(t.id for t in tasks[i:i + self.batch_size])
@@ -0,0 +1,41 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+from django.core.management import BaseCommand, CommandError
+
+from dicpick.models import Event
+from dicpick.notify import NotificationError, NotificationInProgress, NothingToResume, send_schedule_notifications
+
+
+class Command(BaseCommand):
+  help = 'Emails the participants of an event their schedules.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('camp_slug', help='The camp the event belongs to.')
+    parser.add_argument('event_slug', help='The event whose participants to notify.')
+    parser.add_argument('--changed-only', action='store_true', default=False,
+                        help='Only notify participants whose schedules changed since they were last notified.')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help="Resume the event's last unfinished send, skipping the participants it already notified.")
+    parser.add_argument('--batch-size', type=int,
+                        help='Number of emails per batch.  Defaults to DICPICK_NOTIFY_BATCH_SIZE.')
+    parser.add_argument('--rate-limit', type=int,
+                        help='Maximum number of emails per minute.  Defaults to DICPICK_NOTIFY_RATE_LIMIT.')
+
+  def handle(self, *args, **options):
+    try:
+      event = Event.objects.select_related('camp').get(camp__slug=options['camp_slug'], slug=options['event_slug'])
+    except Event.DoesNotExist:
+      raise CommandError('No event {} in camp {}'.format(options['event_slug'], options['camp_slug']))
+
+    try:
+      run = send_schedule_notifications(event, changed_only=options['changed_only'], resume=options['resume'],
+                                        batch_size=options['batch_size'], rate_limit=options['rate_limit'])
+    except (NothingToResume, NotificationInProgress) as e:
+      raise CommandError(e)
+    except NotificationError as e:
+      raise CommandError('{}\nRun again with --resume to notify the remaining participants.'.format(e))
+    self.stdout.write('Sent {} emails'.format(run.num_sent))
@@ -0,0 +1,70 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import glob
+import io
+import json
+import os
+import pstats
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+  help = ('Lists the request profiles captured by dicpick.middleware.ProfilingMiddleware, '
+          'or summarizes a single profile.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('name', nargs='?', help='Summarize the profile with this name (or name prefix).')
+    parser.add_argument('--dir', default=settings.DICPICK_PROFILE_DIR, help='The directory profiles are saved in.')
+    parser.add_argument('--limit', type=int, default=25, help='Number of functions/queries to show in a summary.')
+    parser.add_argument('--sort', default='cumulative', help='pstats sort key for the function summary.')
+
+  def handle(self, *args, **options):
+    profile_dir = options['dir']
+    names = sorted(os.path.basename(p)[:-len('.prof')] for p in glob.glob(os.path.join(profile_dir, '*.prof')))
+    if options['name']:
+      matches = [n for n in names if n.startswith(options['name'])]
+      if len(matches) != 1:
+        raise CommandError('{} profiles match {} in {}'.format(len(matches), options['name'], profile_dir))
+      self.summarize(profile_dir, matches[0], options['limit'], options['sort'])
+    else:
+      self.list(profile_dir, names)
+
+  def list(self, profile_dir, names):
+    if not names:
+      self.stdout.write('No profiles in {}'.format(profile_dir))
+      return
+    self.stdout.write('{:<60} {:>10} {:>8} {:>10}  {}'.format('Name', 'Total ms', 'Queries', 'SQL ms', 'Path'))
+    for name in names:
+      sql_log = self._load_sql_log(profile_dir, name)
+      sql_time = sum(float(q['time']) for q in sql_log['queries'])
+      self.stdout.write('{:<60} {:>10.1f} {:>8} {:>10.1f}  {}'.format(
+          name, sql_log['elapsed'] * 1000, len(sql_log['queries']), sql_time * 1000, sql_log['path']))
+
+  def summarize(self, profile_dir, name, limit, sort):
+    sql_log = self._load_sql_log(profile_dir, name)
+    queries = sql_log['queries']
+    self.stdout.write('{} by {}'.format(sql_log['path'], sql_log['user']))
+    self.stdout.write('Total time: {:.1f} ms'.format(sql_log['elapsed'] * 1000))
+    self.stdout.write('SQL: {} queries in {:.1f} ms'.format(len(queries), sum(float(q['time']) for q in queries) * 1000))
+
+    self.stdout.write('\nSlowest queries:')
+    for query in sorted(queries, key=lambda q: float(q['time']), reverse=True)[:limit]:
+      self.stdout.write('  {:>8.1f} ms [{}] {}'.format(float(query['time']) * 1000, query['alias'], query['sql']))
+
+    # pstats writes partial lines, so we can't hand it self.stdout directly.
+    out = io.StringIO()
+    stats = pstats.Stats(os.path.join(profile_dir, '{}.prof'.format(name)), stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    self.stdout.write('\nFunctions:')
+    self.stdout.write(out.getvalue())
+
+  @staticmethod
+  def _load_sql_log(profile_dir, name):
+    with open(os.path.join(profile_dir, '{}.sql.json'.format(name))) as infile:
+      return json.load(infile)
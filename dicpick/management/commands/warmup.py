@@ -0,0 +1,25 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+from django.core.management import BaseCommand
+
+from dicpick.warmup import connect_databases, format_report, steps, warm_up
+
+
+class Command(BaseCommand):
+  help = ('Warms up the app (imports modules, compiles templates, resolves urls and connects to databases), '
+          'and reports where the cold-start time goes.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('--skip-databases', action='store_true', default=False,
+                        help="Don't connect to the databases.")
+
+  def handle(self, *args, **options):
+    step_functions = [func for (_, func) in steps]
+    if options['skip_databases']:
+      step_functions.remove(connect_databases)
+    for line in format_report(warm_up(step_functions)):
+      self.stdout.write(line)
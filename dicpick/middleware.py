@@ -0,0 +1,203 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import collections
+import cProfile
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCountMiddleware(object):
+  """Records the number of SQL queries, and the total time spent on them, for each request.
+
+  The counts are logged per resolved URL name, and are exposed to staff users in the X-DicPick-Queries
+  response header.  A warning is logged for any request that exceeds DICPICK_QUERY_BUDGET queries, to help us
+  notice when a template or form change brings back a flood of queries.
+
+  Recording queries keeps each one in memory until the end of the request, so we only do it when DEBUG is on, or
+  for requests by staff users.  The user isn't known until AuthenticationMiddleware has run, so for staff requests
+  with DEBUG off we start counting in process_view(), and the counts exclude the queries that load the session and
+  the user.
+
+  This middleware should be first in MIDDLEWARE_CLASSES, so that with DEBUG on it also sees the queries made by
+  other middleware (e.g., to load the session and the user).
+  """
+  header = 'X-DicPick-Queries'
+
+  def process_request(self, request):
+    if settings.DEBUG:
+      self._start(request)
+
+  def process_view(self, request, view_func, view_args, view_kwargs):
+    if not hasattr(request, '_dicpick_query_state'):
+      user = getattr(request, 'user', None)
+      if user is not None and user.is_staff:
+        self._start(request)
+
+  @staticmethod
+  def _start(request):
+    # Map of connection alias -> (whether the connection was already logging queries, number of queries logged so far).
+    state = {}
+    for connection in connections.all():
+      state[connection.alias] = (connection.queries_logged, len(connection.queries_log))
+      # Note that this is how django's own CaptureQueriesContext turns on query logging when DEBUG is False.
+      connection.force_debug_cursor = True
+    request._dicpick_query_state = state
+
+  def process_response(self, request, response):
+    state = getattr(request, '_dicpick_query_state', None)
+    if state is None:  # We're not counting this request's queries, or an earlier middleware short-circuited it.
+      return response
+
+    num_queries = 0
+    db_time = 0.0
+    for connection in connections.all():
+      was_logged, start = state.get(connection.alias, (connection.queries_logged, 0))
+      for query in itertools.islice(connection.queries_log, start, None):
+        num_queries += 1
+        db_time += float(query['time'])
+      if not was_logged:
+        # We turned on logging only for this request, so turn it off and discard the log.
+        connection.force_debug_cursor = False
+        connection.queries_log.clear()
+
+    resolver_match = getattr(request, 'resolver_match', None)
+    url_name = resolver_match.view_name if resolver_match else request.path
+    budget = getattr(settings, 'DICPICK_QUERY_BUDGET', None)
+    if budget is not None and num_queries > budget:
+      logger.warning('%s: %d queries (budget is %d) in %.1f ms', url_name, num_queries, budget, db_time * 1000)
+    else:
+      logger.info('%s: %d queries in %.1f ms', url_name, num_queries, db_time * 1000)
+
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+      response[self.header] = '{} queries, {:.1f} ms'.format(num_queries, db_time * 1000)
+    return response
+
+
+@contextmanager
+def capture_queries(queries):
+  """A context manager that appends all queries executed within it, on all connections, to the given list.
+
+  Each query is a dict with the connection 'alias', and the 'sql' and 'time' (in seconds, as a string) as logged by
+  django.
+  """
+  state = {}
+  for connection in connections.all():
+    state[connection.alias] = (connection.force_debug_cursor, len(connection.queries_log))
+    connection.force_debug_cursor = True
+  try:
+    yield queries
+  finally:
+    for connection in connections.all():
+      force_debug_cursor, start = state.get(connection.alias, (False, 0))
+      for query in itertools.islice(connection.queries_log, start, None):
+        queries.append(dict(query, alias=connection.alias))
+      connection.force_debug_cursor = force_debug_cursor
+
+
+class ProfilingMiddleware(object):
+  """Profiles individual requests on demand, to help diagnose slow pages on the live site.
+
+  A staff user can have a request profiled by adding a __profile query parameter to the url, or by sending an
+  X-DicPick-Profile header.  cProfile is then enabled from just before the view runs until the response (including
+  any template rendering) is complete, and the resulting pstats file, and a JSON file containing the request's SQL
+  log, are saved in DICPICK_PROFILE_DIR.
+  Use the `profiles` management command to list and summarize them.
+
+  To protect the site, at most DICPICK_PROFILE_RATE_LIMIT requests are profiled per process in any
+  DICPICK_PROFILE_RATE_PERIOD seconds.  Requests over that limit are served normally, without profiling.
+  """
+  header = 'X-DicPick-Profile'
+  query_param = '__profile'
+
+  # Timestamps of recently profiled requests, for rate limiting.
+  _recent = collections.deque()
+  _lock = threading.Lock()
+
+  def process_view(self, request, view_func, view_args, view_kwargs):
+    if not self._wants_profile(request) or not self._acquire_rate_limit():
+      return None
+    queries = []
+    capture = ExitStack()
+    capture.enter_context(capture_queries(queries))
+    profiler = cProfile.Profile()
+    request._dicpick_profile = (profiler, capture, queries, time.time())
+    profiler.enable()
+    return None
+
+  def process_exception(self, request, exception):
+    self._finish(request)
+    return None
+
+  def process_response(self, request, response):
+    # Note that template responses have been rendered by now, so the profile includes the template rendering,
+    # which is often where the time goes.
+    name = self._finish(request)
+    if name is not None:
+      response[self.header] = name
+    return response
+
+  def _finish(self, request):
+    """Stops profiling the request, and returns the name the profile was saved under, or None if not profiling."""
+    profile = getattr(request, '_dicpick_profile', None)
+    if profile is None:
+      return None
+    del request._dicpick_profile
+    profiler, capture, queries, start = profile
+    profiler.disable()
+    elapsed = time.time() - start
+    capture.close()
+    return self._save(request, profiler, queries, elapsed)
+
+  def _wants_profile(self, request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_staff:
+      return False
+    return self.query_param in request.GET or 'HTTP_X_DICPICK_PROFILE' in request.META
+
+  @classmethod
+  def _acquire_rate_limit(cls):
+    now = time.time()
+    with cls._lock:
+      while cls._recent and cls._recent[0] < now - settings.DICPICK_PROFILE_RATE_PERIOD:
+        cls._recent.popleft()
+      if len(cls._recent) >= settings.DICPICK_PROFILE_RATE_LIMIT:
+        return False
+      cls._recent.append(now)
+      return True
+
+  @staticmethod
+  def _save(request, profiler, queries, elapsed):
+    """Saves the profile data, and returns the name it was saved under."""
+    resolver_match = getattr(request, 'resolver_match', None)
+    url_name = resolver_match.view_name if resolver_match else 'unknown'
+    name = '{}-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), re.sub(r'[^\w]+', '.', url_name), os.getpid())
+    profile_dir = settings.DICPICK_PROFILE_DIR
+    if not os.path.isdir(profile_dir):
+      os.makedirs(profile_dir)
+    profiler.dump_stats(os.path.join(profile_dir, '{}.prof'.format(name)))
+    with open(os.path.join(profile_dir, '{}.sql.json'.format(name)), 'w') as outfile:
+      json.dump({
+        'url_name': url_name,
+        'path': request.get_full_path(),
+        'user': request.user.get_username(),
+        'elapsed': elapsed,
+        'queries': queries,
+      }, outfile, indent=2)
+    logger.info('Profiled %s in %.1f ms, saved as %s', request.get_full_path(), elapsed * 1000, name)
+    return name
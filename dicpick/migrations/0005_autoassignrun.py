@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 12:00
+
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dicpick', '0004_task_assignees'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutoAssignRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('task_filter', models.TextField(blank=True)),
+                ('seed', models.BigIntegerField()),
+                ('duration', models.FloatField(default=0)),
+                ('num_tasks', models.IntegerField(default=0)),
+                ('num_assignments', models.IntegerField(default=0)),
+                ('num_unassignable', models.IntegerField(default=0)),
+                ('rolled_back', models.BooleanField(default=False)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='auto_assign_runs', to='dicpick.Event')),
+                ('run_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='run',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='assignments', to='dicpick.AutoAssignRun'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 12:30
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dicpick', '0005_autoassignrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autoassignrun',
+            name='lock_wait',
+            field=models.FloatField(default=0),
+        ),
+    ]
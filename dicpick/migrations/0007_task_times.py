@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 13:00
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dicpick', '0006_autoassignrun_lock_wait'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='end_time',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='start_time',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tasktype',
+            name='end_time',
+            field=models.TimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tasktype',
+            name='start_time',
+            field=models.TimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 13:30
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dicpick', '0007_task_times'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='unavailable_days',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 15:00
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dicpick', '0009_event_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autoassignrun',
+            name='num_trials',
+            field=models.IntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 17:00
+
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dicpick', '0011_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='open_slots',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            'UPDATE dicpick_task SET open_slots = num_people - '
+            '(SELECT COUNT(*) FROM dicpick_assignment WHERE dicpick_assignment.task_id = dicpick_task.id)',
+            migrations.RunSQL.noop,
+        ),
+        # Only a small fraction of tasks have open slots once an event is assigned, so a partial index on them is
+        # small, and finding them doesn't touch the rest.
+        migrations.RunSQL(
+            'CREATE INDEX dicpick_task_open_slots ON dicpick_task (task_type_id, date) WHERE open_slots > 0',
+            'DROP INDEX dicpick_task_open_slots',
+        ),
+    ]
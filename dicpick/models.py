@@ -4,14 +4,20 @@
 from __future__ import (absolute_import, division, generators, nested_scopes,
                         print_function, unicode_literals, with_statement)
 
+from collections import defaultdict, namedtuple
 from datetime import timedelta
 
 from django.contrib.auth.models import Group, User
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.functional import cached_property
 
+from dicpick.intervals import IntervalIndex
+from dicpick.locks import lock_event_dates
+
 
 # NOTE: The models purposely use vanilla terminology (e.g., Task, Participant) instead of the more
 # evocative terms used by Mystopia (DIC, Camper), as other camps may not share those terms, or
@@ -57,11 +63,43 @@ class ModelWithDateRange(models.Model):
       yield date
       date += timedelta(days=1)
 
+  @cached_property
+  def dates(self):
+    """A list of every date in the range, in ascending order.
+
+    Use this instead of date_range() when iterating over the dates repeatedly.
+    """
+    return list(self.date_range())
+
   def is_in_date_range(self, dt):
     """Returns true iff dt is in the date range."""
     return self.start_date <= dt <= self.end_date
 
 
+# The maximum number of event days that a day bitmask can represent.  We use a signed 64-bit database column, and
+# keep clear of the sign bit.
+MAX_DAYS_IN_MASK = 63
+
+
+def dates_to_day_mask(first_date, dates):
+  """Returns a bitmask of the given dates, in which bit i represents the date i days after first_date.
+
+  Raises ValueError if any of the dates can't be represented.
+  """
+  mask = 0
+  for dt in dates:
+    day = (dt - first_date).days
+    if not 0 <= day < MAX_DAYS_IN_MASK:
+      raise ValueError('{} is not within {} days of {}'.format(dt, MAX_DAYS_IN_MASK, first_date))
+    mask |= 1 << day
+  return mask
+
+
+def day_mask_to_dates(first_date, mask):
+  """Returns the list of dates in the given bitmask (see dates_to_day_mask()), in ascending order."""
+  return [first_date + timedelta(days=day) for day in range(MAX_DAYS_IN_MASK) if mask & (1 << day)]
+
+
 class Event(ModelWithDateRange):
   """An event for some camp, e.g., Mystopia at Burning Man 2016.
 
@@ -79,10 +117,66 @@ class Event(ModelWithDateRange):
   # Short name for use as a slug in URLs.
   slug = models.SlugField(max_length=10, db_index=True, help_text='A short string to use in URLs.  E.g., "2016".')
 
+  # Incremented whenever any of the event's data changes, so that caches of derived data can be keyed by it.
+  # Only ever modified by versions.bump_event_version().
+  version = models.IntegerField(default=0)
+
+  def save(self, *args, **kwargs):
+    # Don't overwrite the version, which may have been bumped since this object was fetched.
+    if self.pk is not None and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+      kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields if not f.primary_key and
+                                 f.name != 'version']
+    old_start_date = None
+    if self.pk is not None and not kwargs.get('force_insert'):
+      old_start_date = Event.objects.filter(pk=self.pk).values_list('start_date', flat=True).first()
+    with transaction.atomic():
+      super(Event, self).save(*args, **kwargs)
+      if old_start_date is not None and old_start_date != self.start_date:
+        self._rebase_unavailable_days(old_start_date)
+
+  def _rebase_unavailable_days(self, old_start_date):
+    """Re-bases the participants' unavailable_days bitmasks, which are relative to the start date, on a new one.
+
+    Unavailable dates that can't be represented relative to the new start date (i.e., those before it, or at
+    least MAX_DAYS_IN_MASK days after it) are outside the event, so can't affect any task, and we drop them.
+    """
+    # Map of new mask -> ids of the participants to set it on, so that we make one update per distinct mask.
+    participant_ids_by_mask = defaultdict(list)
+    for participant_id, mask in self.participants.exclude(unavailable_days=0).values_list('id', 'unavailable_days'):
+      dates = [dt for dt in day_mask_to_dates(old_start_date, mask)
+               if 0 <= (dt - self.start_date).days < MAX_DAYS_IN_MASK]
+      participant_ids_by_mask[dates_to_day_mask(self.start_date, dates)].append(participant_id)
+    for mask, participant_ids in participant_ids_by_mask.items():
+      Participant.objects.filter(id__in=participant_ids).update(unavailable_days=mask)
+
   def participants_sorted_by_score(self):
-    """Returns a list of all participants in this event, sorted by descending assigned task scores."""
-    return sorted(self.participants.all().prefetch_related('user', 'tasks', 'tasks__task_type'),
-                  key=lambda p: p.assigned_score, reverse=True)
+    """Returns a queryset of all participants in this event, sorted by descending assigned task scores.
+
+    The ranking is done in the database: each participant is annotated with its assigned_score (the initial score
+    plus the scores of all assigned tasks), which takes the place of the Participant.assigned_score property.
+    """
+    return (
+      self.participants
+        .annotate(assigned_score=F('initial_score') + Coalesce(Sum('tasks__score'), 0))
+        .select_related('user')
+        .order_by('-assigned_score', 'user__first_name', 'user__last_name')
+    )
+
+  def assigned_tasks_by_participant_id(self):
+    """Returns a map of participant id -> list of AssignedTask in date order, for all participants in this event.
+
+    Uses a single flat query, instead of fetching every participant's tasks and their task types as model objects.
+    """
+    ret = defaultdict(list)
+    rows = (
+      Assignment.objects
+        .filter(task__task_type__event=self)
+        .order_by('task__date', 'task__task_type__name')
+        .values_list('participant_id', 'task__score', 'task__task_type__name', 'task__date')
+    )
+    for participant_id, score, task_type_name, date in rows:
+      ret[participant_id].append(AssignedTask(score, task_type_name, date))
+    return ret
 
   @cached_property
   def total_score(self):
@@ -140,10 +234,16 @@ class Tag(models.Model):
     return self.name
 
 
+def short_name(first_name, last_name):
+  """A useful display name for a participant with the given user names."""
+  return '{} {}.'.format(first_name.split()[0], last_name[:1])
+
+
 class Participant(ModelWithDateRange):
   """Someone eligible to perform tasks in an event, e.g., a Mystopian going to Burning Man 2016.
 
-  The date range specifies when the participant is available to perform tasks.
+  The date range specifies when the participant is available to perform tasks, except for any unavailable days
+  within that range.
   """
   class Meta:
     unique_together = [('event', 'user')]
@@ -165,6 +265,29 @@ class Participant(ModelWithDateRange):
   # Useful if we know that two people don't get along...
   do_not_assign_with = models.ManyToManyField('self', blank=True)
 
+  # Days within the date range on which this participant is not available, e.g., because they leave the event
+  # for a couple of days.  A bitmask over the days of the event: bit i is set iff the participant is unavailable
+  # on the i'th day of the event (counting from 0).  See dates_to_day_mask().
+  unavailable_days = models.BigIntegerField(default=0)
+
+  def is_available(self, dt):
+    """Returns true iff this participant is available to perform tasks on dt.
+
+    Note: Uses the participant's event, so if calling on multiple participants be sure that they were fetched via
+    event.participants, which sets their event without a database query.
+    """
+    if not self.is_in_date_range(dt):
+      return False
+    if not self.unavailable_days:  # The common case, which doesn't need the event.
+      return True
+    day = (dt - self.event.start_date).days
+    return not (0 <= day < MAX_DAYS_IN_MASK and self.unavailable_days & (1 << day))
+
+  @property
+  def unavailable_dates(self):
+    """The list of dates within this participant's date range on which they're unavailable."""
+    return day_mask_to_dates(self.event.start_date, self.unavailable_days) if self.unavailable_days else []
+
   @cached_property
   def assigned_score(self):
     """The total score of tasks assigned to this participant, including the initial score."""
@@ -176,7 +299,7 @@ class Participant(ModelWithDateRange):
     Note: Will cause the user to be fetched, so if calling on multiple participants be sure
     that the users have been prefetched efficiently using select_related().
     """
-    return '{} {}.'.format(self.user.first_name.split()[0], self.user.last_name[:1])
+    return short_name(self.user.first_name, self.user.last_name)
 
   # Cached querysets, so they aren't re-created (and therefore re-evaluated) on every call.
 
@@ -193,8 +316,9 @@ class Participant(ModelWithDateRange):
     return self.tasks.all()
 
   @cached_property
-  def cached_task_dates(self):
-    return set(t.date for t in self.cached_tasks)
+  def cached_busy_intervals(self):
+    """An IntervalIndex of the times at which this participant is busy with their assigned tasks."""
+    return IntervalIndex(self.cached_tasks)
 
   def __str__(self):
     return self.user.get_full_name()
@@ -226,6 +350,11 @@ class TaskType(ModelWithDateRange):
   # Tasks of this type can only be assigned to participants with at least one of these tags.
   tags = models.ManyToManyField(Tag, related_name='task_types', blank=True)
 
+  # The time of day at which tasks of this type start and end.  If unspecified, tasks of this type take the
+  # whole day, and so can't be assigned to someone who has any other task on that day.
+  start_time = models.TimeField(null=True, blank=True)
+  end_time = models.TimeField(null=True, blank=True)
+
   # Cached querysets, so they aren't re-created (and therefore re-evaluated) on every call.
 
   @cached_property
@@ -260,6 +389,11 @@ class Task(models.Model):
   # Initialized to task_type.tags, but can be overridden here.
   tags = models.ManyToManyField(Tag, related_name='tasks', blank=True)
 
+  # The time of day at which this task starts and ends.  If unspecified, this task takes the whole day.
+  # Initialized to task_type.start_time and task_type.end_time, but can be overridden here.
+  start_time = models.TimeField(null=True, blank=True)
+  end_time = models.TimeField(null=True, blank=True)
+
   # The participants assigned to this task.
   assignees = models.ManyToManyField(Participant, through='Assignment', related_name='tasks', blank=True)
 
@@ -267,6 +401,21 @@ class Task(models.Model):
   # E.g., because we know they have another commitment on this date.
   do_not_assign_to = models.ManyToManyField(Participant, related_name='unassignable_tasks', blank=True)
 
+  # The number of people still needed for this task: num_people less the number of assignees.  Negative if the task
+  # has more assignees than it needs (e.g., because num_people was reduced after it was assigned).
+  # Only ever modified by refresh_open_slots() (and initialized to num_people), so that we can find the tasks with
+  # open slots via a partial index, instead of counting the assignees of every task.
+  open_slots = models.IntegerField(default=0)
+
+  def save(self, *args, **kwargs):
+    if self._state.adding:
+      self.open_slots = self.num_people
+    # Don't overwrite the open slots, which may have changed since this object was fetched.
+    elif not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+      kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields if not f.primary_key and
+                                 f.name != 'open_slots']
+    super(Task, self).save(*args, **kwargs)
+
   # Cached querysets, so they aren't re-created (and therefore re-evaluated) on every call.
 
   @cached_property
@@ -285,6 +434,94 @@ class Task(models.Model):
     return '{} on {}'.format(self.task_type.name, self.date)
 
 
+def refresh_open_slots(task_ids):
+  """Recomputes the open_slots of the given tasks from their num_people and their assignments.
+
+  Must be called after any change to the assignments or num_people of tasks, in the same transaction.
+  Makes a single query, regardless of the number of tasks.
+  """
+  task_ids = list(task_ids)
+  if not task_ids:
+    return
+  # Django 1.9 has no subquery expressions, so we use raw SQL.
+  sql = ('UPDATE {task} SET open_slots = num_people - '
+         '(SELECT COUNT(*) FROM {assignment} WHERE {assignment}.task_id = {task}.id) '
+         'WHERE id IN ({ids})').format(task=Task._meta.db_table, assignment=Assignment._meta.db_table,
+                                       ids=', '.join(['%s'] * len(task_ids)))
+  with connection.cursor() as cursor:
+    cursor.execute(sql, task_ids)
+
+
+class AutoAssignRun(models.Model):
+  """A record of a single run of the auto-assigner (see assign.py).
+
+  Every assignment created by the run refers to the run, so that we can roll back a single run without touching
+  any other assignments, automatic or manual.
+  """
+  class Meta:
+    ordering = ['-started_at']
+
+  # The event whose tasks were auto-assigned.
+  event = models.ForeignKey(Event, related_name='auto_assign_runs')
+
+  # The user who triggered the run, if any.
+  run_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+  # When the run started.
+  started_at = models.DateTimeField(default=timezone.now)
+
+  # The QuerySet filter that selected the tasks to assign, as JSON.
+  task_filter = models.TextField(blank=True)
+
+  # The seed for the random choices made by the run's chosen trial, so that the run can be reproduced.
+  seed = models.BigIntegerField()
+
+  # The number of independently seeded trials the run chose its assignments from (see assign.py).
+  num_trials = models.IntegerField(default=1)
+
+  # How long the run took, in seconds.
+  duration = models.FloatField(default=0)
+
+  # How long the run waited for other changes to the assignments on the same dates, in seconds (see locks.py).
+  lock_wait = models.FloatField(default=0)
+
+  # The number of tasks with empty slots that the run attempted to assign.
+  num_tasks = models.IntegerField(default=0)
+
+  # The number of assignments the run created.
+  num_assignments = models.IntegerField(default=0)
+
+  # The number of tasks the run failed to fully assign.
+  num_unassignable = models.IntegerField(default=0)
+
+  # Whether the run's assignments were rolled back.
+  rolled_back = models.BooleanField(default=False)
+
+  def rollback(self):
+    """Deletes all the assignments created by this run (that haven't already been deleted).
+
+    :raises LockTimeout: If another change to the assignments on the same dates took too long (see locks.py).
+    """
+    with transaction.atomic():
+      assignments = Assignment.objects.filter(run=self)
+      # Lock the dates of the run's assignments before deleting them, so that we don't interleave with other
+      # changes to the assignments on those dates.
+      rows = list(assignments.values_list('task_id', 'task__date'))
+      lock_event_dates(self.event_id, set(date for (_, date) in rows))
+      task_ids = set(task_id for (task_id, _) in rows)
+      assignments.delete()
+      refresh_open_slots(task_ids)
+      self.rolled_back = True
+      self.save(update_fields=['rolled_back'])
+
+  def __str__(self):
+    return 'Auto-assign run at {}'.format(self.started_at)
+
+
+# A lightweight, read-only representation of a task assigned to some participant.
+AssignedTask = namedtuple('AssignedTask', ['score', 'task_type_name', 'date'])
+
+
 class Assignment(models.Model):
   """The through table for task <-> participant assignments.
 
@@ -295,3 +532,50 @@ class Assignment(models.Model):
   task = models.ForeignKey(Task, on_delete=models.CASCADE)
   # Was this auto-assigned (if not, it was manually assigned).
   automatic = models.BooleanField()
+  # The auto-assign run that created this assignment, if it was auto-assigned.
+  run = models.ForeignKey(AutoAssignRun, null=True, blank=True, on_delete=models.SET_NULL, related_name='assignments')
+
+
+class NotificationRun(models.Model):
+  """A record of a single send of schedule notification emails to an event's participants (see notify.py)."""
+  class Meta:
+    ordering = ['-started_at']
+
+  # The event whose participants were notified.
+  event = models.ForeignKey(Event, related_name='notification_runs')
+
+  # The user who triggered the send, if any.
+  run_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+  # When the send started.
+  started_at = models.DateTimeField(default=timezone.now)
+
+  # When the send finished, or null if it hasn't (yet), e.g., because it failed part way through.
+  finished_at = models.DateTimeField(null=True, blank=True)
+
+  # Whether only participants whose schedules changed since they were last notified were notified.
+  changed_only = models.BooleanField(default=False)
+
+  # The number of emails sent.
+  num_sent = models.IntegerField(default=0)
+
+  # The error that stopped the send, if any.
+  error = models.TextField(blank=True)
+
+  def __str__(self):
+    return 'Notification run at {}'.format(self.started_at)
+
+
+class ScheduleNotification(models.Model):
+  """A record of a single schedule notification email sent to a participant."""
+  # The run that sent the email.
+  run = models.ForeignKey(NotificationRun, related_name='notifications', on_delete=models.CASCADE)
+
+  # The participant the email was sent to.
+  participant = models.ForeignKey(Participant, related_name='schedule_notifications', on_delete=models.CASCADE)
+
+  # When the email was sent.
+  sent_at = models.DateTimeField(default=timezone.now)
+
+  # A hash of the email's content, to detect whether the participant's schedule changed since.
+  content_hash = models.CharField(max_length=64)
@@ -0,0 +1,199 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.urlresolvers import reverse
+from django.db import connection as db_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from dicpick.locks import lock_event_notifications
+from dicpick.models import NotificationRun, ScheduleNotification
+from dicpick.schedules import compute_schedules, schedule_token
+
+"""Emails participants their schedules.
+
+All emails of a send go through a single connection to the mail server, in batches of DICPICK_NOTIFY_BATCH_SIZE,
+at most DICPICK_NOTIFY_RATE_LIMIT emails per minute.
+
+Each send is recorded as a NotificationRun, and each email sent as a ScheduleNotification, including a hash of its
+content.  This allows:
+
+  - Sending only to participants whose schedules changed since they were last notified (changed_only).
+  - Resuming a send that failed part way through, without re-notifying the participants already notified (resume).
+
+We record each batch after the mail server accepts it, so if a send fails mid-batch, resuming it may re-send some of
+that batch's emails.  We err on the side of notifying twice rather than not at all.
+
+At most one send per event is in progress at any time: that is, at most one run that's neither finished nor failed.
+Note that a send whose process dies without recording an error therefore blocks further sends, until an admin sets
+an error on its run.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationInProgress(Exception):
+  def __init__(self, run):
+    super(NotificationInProgress, self).__init__(
+        'Already sending schedule notifications for {} (started at {})'.format(run.event, run.started_at))
+    self.run = run
+
+
+class NothingToResume(Exception):
+  def __init__(self, event):
+    super(NothingToResume, self).__init__('No unfinished notification run to resume for {}'.format(event))
+
+
+class NotificationError(Exception):
+  def __init__(self, run, cause):
+    super(NotificationError, self).__init__(
+        'Sending schedule notifications stopped after {} emails: {}'.format(run.num_sent, cause))
+    self.run = run
+    self.cause = cause
+
+
+def render_notification(event, schedule):
+  """Returns the (subject, body) of the email notifying the participant of the given schedule."""
+  url = '{}{}'.format(settings.DICPICK_SITE_URL, reverse('dicpick:schedule_by_token', kwargs={
+    'camp_slug': event.camp.slug,
+    'event_slug': event.slug,
+    'token': schedule_token(schedule.participant_id),
+  }))
+  subject = 'Your schedule for {}'.format(event.name)
+  body = render_to_string('dicpick/schedule_email.txt', {'event': event, 'schedule': schedule, 'url': url})
+  return subject, body
+
+
+def _content_hash(subject, body):
+  return hashlib.sha256('{}\n{}'.format(subject, body).encode('utf-8')).hexdigest()
+
+
+def start_notification_run(event, run_by=None, changed_only=False, resume=False):
+  """Returns the NotificationRun for a new send, or the one to resume, marked as in progress.
+
+  :raises NotificationInProgress: If another send for the event is in progress.
+  :raises NothingToResume: If resuming, and there's no failed send to resume.
+  """
+  with transaction.atomic():
+    # Two sends starting at once (e.g., on a double-click) must not both see that no other send is in progress.
+    lock_event_notifications(event.id)
+    in_progress = event.notification_runs.filter(finished_at__isnull=True, error='').first()
+    if in_progress is not None:
+      raise NotificationInProgress(in_progress)
+    if not resume:
+      return NotificationRun.objects.create(event=event, run_by=run_by, changed_only=changed_only)
+    run = event.notification_runs.filter(finished_at__isnull=True).first()
+    if run is None:
+      raise NothingToResume(event)
+    run.error = ''  # Marks the run as in progress again.
+    run.save(update_fields=['error'])
+    return run
+
+
+def send_schedule_notifications(event, run_by=None, changed_only=False, resume=False, connection=None,
+                                batch_size=None, rate_limit=None, sleep=time.sleep, run=None):
+  """Emails the event's participants their schedules.
+
+  :param event: Notify this event's participants.
+  :param run_by: The user who requested the send, if any.
+  :param changed_only: Notify only participants whose emails would differ from the last ones they were sent.
+  :param resume: Resume the event's most recent unfinished send, instead of starting a new one.
+  :param connection: The email connection to send through.  Defaults to a new connection to the configured backend.
+  :param batch_size: Defaults to DICPICK_NOTIFY_BATCH_SIZE.
+  :param rate_limit: The maximum number of emails per minute.  Defaults to DICPICK_NOTIFY_RATE_LIMIT.
+  :param sleep: The function to wait with, for rate limiting.
+  :param run: The NotificationRun to send, as returned by start_notification_run().  If None, we start one ourselves
+              from the run_by, changed_only and resume arguments.
+  :return: The NotificationRun.
+  :raises NotificationInProgress: If another send for the event is in progress.
+  :raises NothingToResume: If resuming, and there's no failed send to resume.
+  :raises NotificationError: If sending failed.  The emails sent until then are recorded, and the run can be
+                             resumed.
+  """
+  batch_size = batch_size or settings.DICPICK_NOTIFY_BATCH_SIZE
+  rate_limit = rate_limit or settings.DICPICK_NOTIFY_RATE_LIMIT
+  if run is None:
+    run = start_notification_run(event, run_by=run_by, changed_only=changed_only, resume=resume)
+  already_notified_ids = set(run.notifications.values_list('participant_id', flat=True))
+
+  # Map of participant id -> the content hash of the last email sent to that participant.  Note that the dict keeps
+  # the last (i.e., most recent) hash of each participant.
+  last_hashes = dict(ScheduleNotification.objects.filter(participant__event=event)
+                     .order_by('participant_id', 'sent_at', 'id').values_list('participant_id', 'content_hash'))
+
+  # List of (participant id, email message, content hash) for each email to send.
+  to_send = []
+  schedules = compute_schedules(event)
+  for participant_id, schedule in sorted(schedules.by_participant_id.items()):
+    if not schedule.email or participant_id in already_notified_ids:
+      continue
+    subject, body = render_notification(event, schedule)
+    content_hash = _content_hash(subject, body)
+    if run.changed_only and last_hashes.get(participant_id) == content_hash:
+      continue
+    to_send.append((participant_id, EmailMessage(subject, body, to=[schedule.email]), content_hash))
+
+  connection = connection or get_connection()
+  try:
+    connection.open()
+    for i in range(0, len(to_send), batch_size):
+      batch = to_send[i:i + batch_size]
+      start = time.time()
+      connection.send_messages([message for (_, message, _) in batch])
+      with transaction.atomic():
+        ScheduleNotification.objects.bulk_create([
+          ScheduleNotification(run=run, participant_id=participant_id, content_hash=content_hash)
+          for (participant_id, _, content_hash) in batch
+        ])
+        run.num_sent += len(batch)
+        run.save(update_fields=['num_sent'])
+      # Wait until the batch's share of the rate limit has passed, unless this was the last batch.
+      delay = len(batch) * 60.0 / rate_limit - (time.time() - start)
+      if delay > 0 and i + batch_size < len(to_send):
+        sleep(delay)
+  except Exception as e:
+    run.error = str(e)
+    run.save(update_fields=['error'])
+    raise NotificationError(run, e)
+  finally:
+    connection.close()
+
+  run.finished_at = timezone.now()
+  run.error = ''
+  run.save(update_fields=['finished_at', 'error'])
+  return run
+
+
+def _send_in_background(event, run):
+  try:
+    send_schedule_notifications(event, run=run)
+  except Exception:
+    logger.exception('Failed to send schedule notifications for {}'.format(event))
+  finally:
+    # This thread's database connection isn't managed by the request cycle, so we must close it ourselves.
+    db_connection.close()
+
+
+def start_background_send(event, run_by=None, changed_only=False, resume=False):
+  """Sends schedule notifications (see send_schedule_notifications) in a background thread.
+
+  :raises NotificationInProgress: If another send for the event is in progress.  We check before starting the thread.
+  :raises NothingToResume: If resuming, and there's no failed send to resume.
+  """
+  run = start_notification_run(event, run_by=run_by, changed_only=changed_only, resume=resume)
+  thread = threading.Thread(target=_send_in_background, args=(event, run),
+                            name='dicpick-notify-{}'.format(event.id))
+  thread.daemon = True
+  thread.start()
+  return thread
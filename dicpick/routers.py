@@ -0,0 +1,84 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+"""Routes the queries of read-only views to a read replica, if there is one.
+
+Views opt in (see ReadFromReplicaMixin in views.py), and within them all reads go to the DICPICK_REPLICA_DATABASE.
+Everything else, including all writes, goes to the default database.
+
+The replica may lag behind the default database, so a user who just changed something might not see their change.
+To avoid that, ReadYourWritesMiddleware sets a short-lived cookie on the response to every write request, and while
+the cookie is present that user's reads all go to the default database.
+"""
+
+
+_state = threading.local()
+
+
+@contextmanager
+def reads_from_replica(enabled=True):
+  """A context manager within which reads in the current thread go to the replica (if enabled, and if there is one)."""
+  previous = getattr(_state, 'use_replica', False)
+  _state.use_replica = enabled
+  try:
+    yield
+  finally:
+    _state.use_replica = previous
+
+
+class ReplicaRouter(object):
+  """A database router that sends reads to the replica within reads_from_replica(), and everything else to default.
+
+  Note that we always return an alias, as otherwise django would route a query about an object to the database the
+  object came from, which for objects read from the replica is the replica.
+  """
+  def db_for_read(self, model, **hints):
+    if settings.DICPICK_REPLICA_DATABASE and getattr(_state, 'use_replica', False):
+      return settings.DICPICK_REPLICA_DATABASE
+    return DEFAULT_DB_ALIAS
+
+  def db_for_write(self, model, **hints):
+    return DEFAULT_DB_ALIAS
+
+  def allow_relation(self, obj1, obj2, **hints):
+    # The replica has the same data as the default database.
+    return True
+
+  def allow_migrate(self, db, app_label, model_name=None, **hints):
+    # The replica gets its schema from the default database.
+    return db == DEFAULT_DB_ALIAS
+
+
+# The name of the cookie that marks a client as having recently written.  Its value is the time of the write.
+READ_YOUR_WRITES_COOKIE = 'dicpick_wrote'
+
+
+def recently_wrote(request):
+  """Returns True iff the client that made the request wrote within the last DICPICK_READ_YOUR_WRITES_SECONDS."""
+  try:
+    wrote_at = float(request.COOKIES.get(READ_YOUR_WRITES_COOKIE, ''))
+  except ValueError:
+    return False
+  return time.time() - wrote_at < settings.DICPICK_READ_YOUR_WRITES_SECONDS
+
+
+class ReadYourWritesMiddleware(object):
+  """Marks clients that make write requests, so that their reads don't go to the replica for a while (see above)."""
+  def process_response(self, request, response):
+    if settings.DICPICK_REPLICA_DATABASE and request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+      # Note that we truncate the time rather than round it, as a time in the future would count as recent even with
+      # a zero DICPICK_READ_YOUR_WRITES_SECONDS.
+      response.set_cookie(READ_YOUR_WRITES_COOKIE, '{:.3f}'.format(math.floor(time.time() * 1000) / 1000),
+                          max_age=settings.DICPICK_READ_YOUR_WRITES_SECONDS, httponly=True)
+    return response
@@ -0,0 +1,150 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.db import connections
+
+from dicpick.assign import assign_for_filter
+from dicpick.models import Event
+
+"""Runs auto-assign jobs for many events concurrently, in a bounded pool of worker processes.
+
+Auto-assigning is CPU-bound Python, so threads won't help.  Instead each job runs in a worker process, in its own
+transaction, holding locks on the dates it assigns on (see locks.py).
+
+Jobs are queued per camp, and the camps take turns: whenever a worker is free we dispatch the next job of the next
+camp in round-robin order.  So a camp that submits many jobs can't starve a camp that submits one.  We also never
+run two jobs for the same event at the same time, as they would likely only wait on each other's locks.
+"""
+
+
+# The result of a single job.
+AssignmentResult = namedtuple('AssignmentResult', ['event_id', 'unassignable_task_ids', 'duration'])
+
+# A queued job.  The future is the one returned to the submitter.
+_Job = namedtuple('_Job', ['camp_id', 'event_id', 'run_by_id', 'seed', 'trials', 'task_filter', 'future'])
+
+
+def _run_job(event_id, run_by_id, seed, trials, task_filter):
+  """Runs a single job.  Called in a worker process."""
+  start = time.time()
+  # Note that we don't lock the event's row: every edit to the event bumps its version with an update of that row, so
+  # that would block all edits to the event for the duration of the job.  Instead, assign_for_filter() locks just the
+  # dates it assigns on, so jobs for the same event submitted elsewhere (e.g., by another scheduler) wait for this one
+  # only if they touch the same dates.
+  event = Event.objects.get(pk=event_id)
+  run_by = User.objects.get(pk=run_by_id) if run_by_id is not None else None
+  # We're already one of a pool of processes, so we run the trials in this process.
+  unassignable_tasks = assign_for_filter(event, run_by=run_by, seed=seed, trials=trials, parallel=False,
+                                         **task_filter)
+  return AssignmentResult(event_id, sorted(unassignable_tasks), time.time() - start)
+
+
+class AssignmentScheduler(object):
+  """Accepts auto-assign jobs for any number of events, and runs them in a bounded process pool.
+
+  Usage:
+
+    scheduler = AssignmentScheduler(max_workers=4)
+    futures = [scheduler.submit(event) for event in events]
+    for future in futures:
+      print(future.result())
+    scheduler.shutdown()
+  """
+  def __init__(self, max_workers=None):
+    self.max_workers = max_workers or os.cpu_count() or 1
+    self._executor = None
+    self._lock = threading.Lock()
+    # Map of camp id -> deque of that camp's queued jobs, in the order in which the camps will next be served.
+    self._queues = OrderedDict()
+    # Ids of the events whose jobs are currently running.
+    self._running_event_ids = set()
+
+  def submit(self, event, run_by=None, seed=None, trials=None, **task_filter):
+    """Queues an auto-assign job for the event's tasks that match the task filter (see assign_for_filter).
+
+    :return: A concurrent.futures.Future whose result will be an AssignmentResult.
+    """
+    future = Future()
+    job = _Job(event.camp_id, event.id, run_by.id if run_by else None, seed, trials, task_filter, future)
+    with self._lock:
+      self._queues.setdefault(event.camp_id, deque()).append(job)
+    self._dispatch()
+    return future
+
+  def shutdown(self, wait=True):
+    """Stops the pool.
+
+    If wait is True, first waits for all queued and running jobs to finish.  Otherwise cancels all queued jobs.
+    """
+    if not wait:
+      with self._lock:
+        queued_jobs = [job for queue in self._queues.values() for job in queue]
+        self._queues.clear()
+      for job in queued_jobs:
+        job.future.cancel()
+    else:
+      while True:
+        with self._lock:
+          futures = [job.future for queue in self._queues.values() for job in queue]
+        if not futures:
+          break
+        for future in futures:
+          future.exception()  # Waits for the job to finish, without raising its exception.
+    if self._executor is not None:
+      self._executor.shutdown(wait=wait)
+
+  def _next_job(self):
+    """Removes and returns the next job to run, or None if there is no runnable job.  Must hold self._lock."""
+    for camp_id in list(self._queues.keys()):
+      queue = self._queues[camp_id]
+      for job in queue:
+        if job.event_id not in self._running_event_ids:
+          queue.remove(job)
+          # This camp has had its turn, so it goes to the back of the line.
+          if queue:
+            self._queues.move_to_end(camp_id)
+          else:
+            del self._queues[camp_id]
+          return job
+    return None
+
+  def _dispatch(self):
+    """Submits runnable jobs to the pool, while it has free workers."""
+    with self._lock:
+      while len(self._running_event_ids) < self.max_workers:
+        job = self._next_job()
+        if job is None:
+          break
+        if not job.future.set_running_or_notify_cancel():
+          continue  # Cancelled while queued.
+        if self._executor is None:
+          # The pool forks its worker processes now, and a forked database connection must not be used by both
+          # processes, so we close ours first.  Each worker then opens its own connection.
+          for connection in connections.all():
+            connection.close()
+          self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self._running_event_ids.add(job.event_id)
+        pool_future = self._executor.submit(_run_job, job.event_id, job.run_by_id, job.seed, job.trials,
+                                             job.task_filter)
+        pool_future.add_done_callback(partial(self._job_done, job))
+
+  def _job_done(self, job, pool_future):
+    with self._lock:
+      self._running_event_ids.discard(job.event_id)
+    exception = pool_future.exception()
+    if exception is None:
+      job.future.set_result(pool_future.result())
+    else:
+      job.future.set_exception(exception)
+    self._dispatch()
@@ -0,0 +1,111 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+from collections import defaultdict, namedtuple
+
+from django.core import signing
+
+from dicpick.cache import TTLCache
+from dicpick.models import Assignment, short_name
+from dicpick.versions import get_event_version
+
+"""Each participant's own schedule: the tasks they're assigned to, and who they're doing them with.
+
+During an event many participants check their schedules, so rather than query per request we compute the schedules
+of all of an event's participants at once, from two flat queries, and cache them by event version.  Viewing a
+schedule then costs just a version lookup and a cache lookup.
+
+Participants can view their schedules either by logging in, or via a signed link that identifies them, so that they
+needn't have a password.
+"""
+
+
+# A task on a participant's schedule.
+#   co_assignees: The short names of the other participants assigned to the same task.
+ScheduledTask = namedtuple('ScheduledTask', ['task_id', 'task_type_name', 'date', 'start_time', 'end_time', 'score',
+                                             'co_assignees'])
+
+# A participant's schedule.
+#   score: The participant's initial score plus the scores of their tasks.
+#   tasks: A list of ScheduledTask, in chronological order.
+ParticipantSchedule = namedtuple('ParticipantSchedule', ['participant_id', 'user_id', 'name', 'email', 'score',
+                                                         'tasks'])
+
+
+class EventSchedules(object):
+  def __init__(self, schedules):
+    # Map of participant id -> ParticipantSchedule.
+    self.by_participant_id = {s.participant_id: s for s in schedules}
+    # Map of user id -> ParticipantSchedule.
+    self.by_user_id = {s.user_id: s for s in schedules}
+
+
+def compute_schedules(event):
+  """Computes the schedules of all of the event's participants, with two flat database queries."""
+  participant_rows = list(event.participants.order_by('id').values_list(
+      'id', 'user_id', 'user__first_name', 'user__last_name', 'user__email', 'initial_score'))
+  names_by_participant_id = {r[0]: short_name(r[2], r[3]) for r in participant_rows}
+
+  assignment_rows = (
+    Assignment.objects
+      .filter(task__task_type__event=event)
+      .order_by('task__date', 'task__start_time', 'task__task_type__name', 'task_id', 'id')
+      .values_list('task_id', 'participant_id', 'task__task_type__name', 'task__date', 'task__start_time',
+                   'task__end_time', 'task__score')
+  )
+  # Map of task id -> list of ids of the task's assignees, and list of (task id, task values), in schedule order.
+  assignee_ids_by_task_id = defaultdict(list)
+  tasks = []
+  for row in assignment_rows:
+    task_id, participant_id = row[:2]
+    if task_id not in assignee_ids_by_task_id:
+      tasks.append((task_id, row[2:]))
+    assignee_ids_by_task_id[task_id].append(participant_id)
+
+  tasks_by_participant_id = defaultdict(list)
+  for task_id, (task_type_name, date, start_time, end_time, score) in tasks:
+    assignee_ids = assignee_ids_by_task_id[task_id]
+    for participant_id in assignee_ids:
+      co_assignees = [names_by_participant_id[p_id] for p_id in assignee_ids if p_id != participant_id]
+      tasks_by_participant_id[participant_id].append(
+          ScheduledTask(task_id, task_type_name, date, start_time, end_time, score, co_assignees))
+
+  schedules = []
+  for participant_id, user_id, _, _, email, initial_score in participant_rows:
+    participant_tasks = tasks_by_participant_id[participant_id]
+    schedules.append(ParticipantSchedule(participant_id, user_id, names_by_participant_id[participant_id], email,
+                                         initial_score + sum(t.score for t in participant_tasks), participant_tasks))
+  return EventSchedules(schedules)
+
+
+# Map of (event id, event version) -> EventSchedules.
+_schedules_by_event_version = TTLCache()
+
+
+def get_schedules(event):
+  """Returns the EventSchedules of the given event, from this process's cache if the event hasn't changed."""
+  key = (event.id, get_event_version(event.id))
+  return _schedules_by_event_version.get(key, lambda: compute_schedules(event))
+
+
+# Tokens signed with this salt can't be confused with any other signed values.
+_TOKEN_SALT = 'dicpick.schedules'
+
+
+def schedule_token(participant_id):
+  """Returns a token that grants access to the schedule of the given participant.
+
+  The token is signed with the SECRET_KEY, so it can't be forged.  Note that it doesn't expire.
+  """
+  return signing.Signer(salt=_TOKEN_SALT).sign(str(participant_id))
+
+
+def participant_id_from_token(token):
+  """Returns the id of the participant whose schedule the given token grants access to.
+
+  Raises signing.BadSignature if the token is invalid.
+  """
+  return int(signing.Signer(salt=_TOKEN_SALT).unsign(token))
@@ -4,10 +4,13 @@
 from __future__ import (absolute_import, division, generators, nested_scopes,
                         print_function, unicode_literals, with_statement)
 
-from django.db.models.signals import m2m_changed, post_save
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
-from dicpick.models import Task, TaskType
+from dicpick import cache
+from dicpick.models import Camp, Event, Participant, Tag, Task, TaskType, refresh_open_slots
+from dicpick.versions import bump_event_version
 
 
 # The signal handlers below ensure that certain changes to TaskType are reflected onto all the tasks of that type.
@@ -26,10 +29,14 @@ def create_task_instances(sender, instance, **kwargs):
   superfluous_dates = existing_dates - required_dates
   Task.objects.filter(task_type=task_type, date__in=superfluous_dates).delete()
   for missing_date in missing_dates:
-    task = Task(task_type=task_type, date=missing_date, num_people=task_type.num_people, score=task_type.score)
+    task = Task(task_type=task_type, date=missing_date, num_people=task_type.num_people, score=task_type.score,
+                start_time=task_type.start_time, end_time=task_type.end_time)
     task.save()
 
-  Task.objects.filter(task_type=task_type).update(num_people=task_type.num_people, score=task_type.score)
+  Task.objects.filter(task_type=task_type).update(num_people=task_type.num_people, score=task_type.score,
+                                                  start_time=task_type.start_time, end_time=task_type.end_time)
+  # The update may have changed num_people, and therefore the open slots.
+  refresh_open_slots(task_type.tasks.values_list('id', flat=True))
 
 
 @receiver(m2m_changed, sender=TaskType.tags.through)
@@ -43,3 +50,70 @@ def tags_updated(sender, instance, action, **kwargs):
   elif action == 'post_remove':
     for task in task_type.tasks.all():
       task.tags.remove(*pk_set)
+
+
+# The signal handlers below keep Task.open_slots up to date when deleting a participant deletes its assignments.
+# Other changes to assignments call refresh_open_slots() explicitly.
+
+@receiver(pre_delete, sender=Participant)
+def participant_deleting(sender, instance, **kwargs):
+  instance.assigned_task_ids = list(instance.assignment_set.values_list('task_id', flat=True))
+
+
+@receiver(post_delete, sender=Participant)
+def participant_deleted(sender, instance, **kwargs):
+  refresh_open_slots(getattr(instance, 'assigned_task_ids', []))
+
+
+# The signal handlers below invalidate this process's caches of camps, events and admin permissions.
+# See cache.py for details.
+
+@receiver([post_save, post_delete], sender=Camp)
+def camp_changed(sender, instance, **kwargs):
+  cache.invalidate_camps()
+
+
+@receiver([post_save, post_delete], sender=Event)
+def event_changed(sender, instance, **kwargs):
+  cache.invalidate_events()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, **kwargs):
+  if action.startswith('post_'):
+    # If reverse is True then instance is a Group whose users changed, so we don't know which users to invalidate.
+    cache.invalidate_admin_camp_ids(None if reverse else instance.id)
+
+
+# The signal handlers below bump the version of the event whose data changed.  See versions.py for details.
+# Note that we don't handle Task deletions: tasks are only deleted along with (or by a save of) their task type,
+# which bumps the version anyway.
+
+def _event_id(instance):
+  # Note that views that save tasks fetch them with their task types, so this doesn't cause a query per task.
+  return instance.task_type.event_id if isinstance(instance, Task) else instance.event_id
+
+
+@receiver(post_save, sender=Event)
+def event_saved(sender, instance, created, **kwargs):
+  if not created:
+    bump_event_version(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Participant)
+@receiver([post_save, post_delete], sender=TaskType)
+@receiver(post_save, sender=Task)
+def event_data_changed(sender, instance, **kwargs):
+  bump_event_version(_event_id(instance))
+
+
+@receiver(m2m_changed, sender=Participant.tags.through)
+@receiver(m2m_changed, sender=Participant.do_not_assign_with.through)
+@receiver(m2m_changed, sender=TaskType.tags.through)
+@receiver(m2m_changed, sender=Task.tags.through)
+@receiver(m2m_changed, sender=Task.do_not_assign_to.through)
+def event_relations_changed(sender, instance, action, **kwargs):
+  # Note that the instance may be on either side of the relationship, but both sides belong to the same event.
+  if action.startswith('post_'):
+    bump_event_version(_event_id(instance))
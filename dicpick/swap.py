@@ -0,0 +1,144 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils.translation import ugettext as _
+
+from dicpick.intervals import time_interval
+from dicpick.locks import lock_event_dates
+from dicpick.models import Assignment, Task, short_name
+from dicpick.versions import bump_event_version
+
+"""Swapping tasks between two participants, or handing tasks over from one participant to another.
+
+Doing this via the task formsets takes two saves, the first of which may well fail validation, as the participant
+taking over a task may still be busy with the task they're about to hand over in return.  Here we make the whole
+change at once, in a single transaction.
+
+We check the change against an in-memory snapshot of the two participants' assignments on the affected dates,
+loaded with a few small queries after locking those dates (see locks.py), so a swap costs milliseconds regardless
+of the size of the event.  We apply the same constraints as manual edits do (see TaskFormBase.clean_assignees),
+plus the tasks' do-not-assign-to lists.
+"""
+
+
+class SwapError(Exception):
+  pass
+
+
+@transaction.atomic
+def swap_assignments(event, participant_id, other_participant_id, task_ids, other_task_ids=()):
+  """Moves the given tasks from one participant to another, and (optionally) other tasks the other way.
+
+  :param event: The event the participants and tasks belong to.
+  :param participant_id: The participant to move task_ids from.
+  :param other_participant_id: The participant to move task_ids to, and other_task_ids from.
+  :param task_ids: Ids of tasks assigned to the participant, to assign to the other participant instead.
+  :param other_task_ids: Ids of tasks assigned to the other participant, to assign to the participant instead.
+                         Empty if the other participant is simply substituting for the participant.
+  :return: A list of the updated cells, one per task, each a dict with the task's id, task type id, date (as an ISO
+           string) and the short names of its assignees.
+  :raises SwapError: If the change isn't allowed.  Nothing is changed.
+  :raises LockTimeout: If another change to the assignments on the same dates took too long.
+  """
+  task_ids = set(task_ids)
+  other_task_ids = set(other_task_ids)
+  if participant_id == other_participant_id:
+    raise SwapError('Cannot swap {} between a {} and themselves.'.format(_('tasks'), _('participant')))
+  if not task_ids and not other_task_ids:
+    raise SwapError('No {} to swap.'.format(_('tasks')))
+  if task_ids & other_task_ids:
+    raise SwapError('Cannot swap a {} with itself.'.format(_('task')))
+
+  # Note that filtering by event verifies that the participants and tasks actually belong to it.
+  participants = {p.id: p for p in event.participants.filter(id__in=[participant_id, other_participant_id])
+                  .select_related('user')}
+  if len(participants) != 2:
+    raise SwapError('Unknown {}.'.format(_('participant')))
+  tasks = {t['id']: t for t in Task.objects.filter(task_type__event=event, id__in=task_ids | other_task_ids)
+           .order_by().values('id', 'task_type_id', 'date', 'start_time', 'end_time')}
+  if len(tasks) != len(task_ids | other_task_ids):
+    raise SwapError('Unknown {}.'.format(_('task')))
+
+  # Lock the affected dates before reading any assignments, so that concurrent changes to the assignments on those
+  # dates can't cause us to double-book a participant.
+  dates = set(t['date'] for t in tasks.values())
+  lock_event_dates(event.id, dates)
+
+  # The snapshot: map of participant id -> map of task id -> (assignment id, date, interval), of the participants'
+  # assignments on the affected dates.
+  assignments = defaultdict(dict)
+  rows = (
+    Assignment.objects
+      .filter(participant_id__in=list(participants), task__date__in=dates)
+      .values_list('id', 'participant_id', 'task_id', 'task__date', 'task__start_time', 'task__end_time')
+  )
+  for assignment_id, p_id, task_id, date, start_time, end_time in rows:
+    assignments[p_id][task_id] = (assignment_id, date, time_interval(start_time, end_time))
+  # Set of (task id, participant id) pairs that mustn't be assigned.
+  excluded = set(Task.do_not_assign_to.through.objects
+                 .filter(task_id__in=list(tasks), participant_id__in=list(participants))
+                 .values_list('task_id', 'participant_id'))
+
+  # List of (task ids, from participant id, to participant id).
+  moves = [(task_ids, participant_id, other_participant_id), (other_task_ids, other_participant_id, participant_id)]
+  for moved_task_ids, from_id, to_id in moves:
+    for task_id in moved_task_ids:
+      if task_id not in assignments[from_id]:
+        raise SwapError('{} is not assigned to this {}.'.format(participants[from_id], _('task')))
+      if task_id in assignments[to_id]:
+        raise SwapError('{} is already assigned to this {}.'.format(participants[to_id], _('task')))
+
+  # Map of task id -> the (start, end) minutes of the day that the task takes.
+  intervals = {task_id: time_interval(t['start_time'], t['end_time']) for (task_id, t) in tasks.items()}
+  to_delete = []
+  to_create = []
+  for moved_task_ids, from_id, to_id in moves:
+    to_participant = participants[to_id]
+    # The tasks the receiving participant will have on the affected dates, once the swap is done.
+    final_intervals = [(date, interval) for (task_id, (assignment_id, date, interval)) in assignments[to_id].items()
+                       if task_id not in task_ids | other_task_ids]
+    final_intervals.extend((tasks[task_id]['date'], intervals[task_id]) for task_id in moved_task_ids)
+    for task_id in moved_task_ids:
+      task = tasks[task_id]
+      if not to_participant.is_available(task['date']):
+        raise SwapError('{} not available on {}.'.format(to_participant, task['date']))
+      if (task_id, to_id) in excluded:
+        raise SwapError('{} may not be assigned to this {}.'.format(to_participant, _('task')))
+      start, end = intervals[task_id]
+      num_overlapping = sum(1 for (date, (other_start, other_end)) in final_intervals
+                            if date == task['date'] and start < other_end and other_start < end)
+      if num_overlapping > 1:  # The task always overlaps itself.
+        raise SwapError('{} would have overlapping {} on {}.'.format(to_participant, _('tasks'), task['date']))
+      to_delete.append(assignments[from_id][task_id][0])
+      to_create.append(Assignment(participant_id=to_id, task_id=task_id, automatic=False))
+
+  Assignment.objects.filter(id__in=to_delete).delete()
+  Assignment.objects.bulk_create(to_create)
+  # Note that each task loses one assignee and gains another, so its open_slots doesn't change.
+  bump_event_version(event.id)  # bulk_create and QuerySet.delete() don't send signals.
+  return _cells(tasks)
+
+
+def _cells(tasks):
+  """Returns the updated cells of the given tasks (a map of task id -> task values)."""
+  names_by_task_id = defaultdict(list)
+  rows = (
+    Assignment.objects
+      .filter(task_id__in=list(tasks))
+      .order_by('id')
+      .values_list('task_id', 'participant__user__first_name', 'participant__user__last_name')
+  )
+  for task_id, first_name, last_name in rows:
+    names_by_task_id[task_id].append(short_name(first_name, last_name))
+  return [{
+    'task': task_id,
+    'task_type': task['task_type_id'],
+    'date': task['date'].isoformat(),
+    'assignees': names_by_task_id[task_id],
+  } for (task_id, task) in sorted(tasks.items())]
@@ -1,8 +1,39 @@
 # coding=utf-8
 # Copyright 2016 Mystopia.
 
+import datetime
+import json
+from collections import defaultdict
+from unittest import mock
 
-from django.test import SimpleTestCase
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from dicpick import cache
+from dicpick import urls as dicpick_urls
+from dicpick.assign import assign_for_filter, take_snapshot
+from dicpick.clone import clone_event
+from dicpick.feeds import task_type_feed_token
+from dicpick.fairness import ScoreStats, compute_fairness_metrics, score_stats
+from dicpick.fill_status import compute_fill_status
+from dicpick.intervals import MINUTES_PER_DAY, IntervalIndex
+from dicpick.models import (MAX_DAYS_IN_MASK, Assignment, AutoAssignRun, Camp, Event, NotificationRun, Participant,
+                            Tag, Task, TaskType, dates_to_day_mask, day_mask_to_dates, refresh_open_slots)
+from dicpick.notify import (NotificationError, NotificationInProgress, NothingToResume, send_schedule_notifications,
+                            start_notification_run)
+from dicpick.routers import (READ_YOUR_WRITES_COOKIE, ReadYourWritesMiddleware, ReplicaRouter, reads_from_replica,
+                             recently_wrote)
+from dicpick.schedules import schedule_token
+from dicpick.swap import SwapError, swap_assignments
+from dicpick.templatetags.dicpick_helpers import date_to_slug
+from dicpick.util import create_user
 
 
 class TestTrue(SimpleTestCase):
@@ -12,3 +43,705 @@ class TestTrue(SimpleTestCase):
     def test_false_is_true_raises(self):
         with self.assertRaises(AssertionError):
             self.assertTrue(False)
+
+
+class EventFixture(object):
+    """Builds a camp with a single event, which can be grown to an arbitrary size."""
+    def __init__(self, num_days=7):
+        admin_group = Group.objects.create(name='testcamp_admin')
+        member_group = Group.objects.create(name='testcamp_member')
+        self.admin = create_user('admin@testcamp.com', 'Admin', 'User')
+        self.admin.groups.add(admin_group, member_group)
+        self.camp = Camp.objects.create(name='Test Camp', slug='testcamp',
+                                        admin_group=admin_group, member_group=member_group)
+        self.event = Event.objects.create(camp=self.camp, name='Test Event', slug='test',
+                                          start_date=datetime.date(2016, 8, 24),
+                                          end_date=datetime.date(2016, 8, 24) + datetime.timedelta(days=num_days - 1))
+        self.num_participants = 0
+        self.num_task_types = 0
+        self.num_tags = 0
+
+    def grow(self, num_participants, num_task_types, num_tags):
+        """Adds the given numbers of participants, task types and tags, and auto-assigns all tasks."""
+        event = self.event
+        tags = []
+        for i in range(self.num_tags, self.num_tags + num_tags):
+            tags.append(Tag.objects.create(event=event, name='tag{}'.format(i)))
+        for i in range(self.num_participants, self.num_participants + num_participants):
+            user = create_user('user{}@testcamp.com'.format(i), 'First', 'Last{}'.format(i))
+            participant = Participant.objects.create(event=event, user=user, initial_score=i % 3,
+                                                     start_date=event.start_date, end_date=event.end_date)
+            participant.tags.add(*tags[:i % (len(tags) + 1)])
+        for i in range(self.num_task_types, self.num_task_types + num_task_types):
+            task_type = TaskType.objects.create(event=event, name='Task Type {}'.format(i), num_people=1 + i % 2,
+                                                score=10, start_date=event.start_date, end_date=event.end_date)
+            if i % 2 and tags:
+                task_type.tags.add(tags[0])
+        self.num_participants += num_participants
+        self.num_task_types += num_task_types
+        self.num_tags += num_tags
+        assign_for_filter(event)
+
+
+class QueryCountTest(TestCase):
+    """Verifies that the number of queries each view makes doesn't grow with the size of the event."""
+
+    def setUp(self):
+        self.fixture = EventFixture()
+        self.client.force_login(self.fixture.admin)
+
+    def url_kwargs(self):
+        event = self.fixture.event
+        return {
+            'camp_slug': event.camp.slug,
+            'event_slug': event.slug,
+            'task_type_pk': event.task_types.order_by('id').first().pk,
+            'date': date_to_slug(event.start_date),
+            'token': schedule_token(event.participants.order_by('id').first().pk),
+            'task_type_token': task_type_feed_token(event.task_types.order_by('id').first().pk),
+        }
+
+    # Views that only accept POST requests.
+    post_only_url_names = {'swap_assignments'}
+
+    # Query string parameters for views that need them.
+    url_query_params = {
+        'tag_autocomplete': {'q': 't'},
+        'participant_autocomplete': {'q': 'f', 'd': '2016-08-25', 't': 'tag0|tag1'},
+    }
+
+    def count_queries_per_view(self):
+        """Returns a map of url name -> number of queries made to GET that url."""
+        all_kwargs = self.url_kwargs()
+        ret = {}
+        for pattern in dicpick_urls.urlpatterns:
+            if pattern.name in self.post_only_url_names:
+                continue
+            url_kwargs = {k: all_kwargs[k] for k in pattern.regex.groupindex}
+            url = reverse('dicpick:{}'.format(pattern.name), kwargs=url_kwargs)
+            params = self.url_query_params.get(pattern.name, {})
+            self.client.get(url, params)  # Warm up (e.g., create the session) so that we only count steady state queries.
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, params)
+                if response.streaming:  # Streamed content (and therefore its queries) is generated lazily.
+                    b''.join(response.streaming_content)
+            self.assertEqual(200, response.status_code, url)
+            ret[pattern.name] = len(ctx)
+        return ret
+
+    def add_runs(self):
+        """Adds auto-assign and notification runs, both with and without a user who started them."""
+        event = self.fixture.event
+        # Note that grow() already auto-assigns with no user, as the command line and the scheduler do.
+        assign_for_filter(event, run_by=self.fixture.admin)
+        NotificationRun.objects.create(event=event, run_by=None, finished_at=timezone.now())
+        NotificationRun.objects.create(event=event, run_by=self.fixture.admin, finished_at=timezone.now())
+
+    def test_query_counts_are_constant(self):
+        self.fixture.grow(num_participants=20, num_task_types=4, num_tags=3)
+        self.add_runs()
+        small = self.count_queries_per_view()
+        self.fixture.grow(num_participants=60, num_task_types=8, num_tags=3)
+        self.add_runs()
+        large = self.count_queries_per_view()
+        self.assertEqual(small, large)
+        self.assertTrue(AutoAssignRun.objects.filter(event=self.fixture.event, run_by=None).exists())
+
+
+class TaskFormsetSaveTest(TestCase):
+    """Tests saving the assignees of a task formset, as a single diff against the existing assignments."""
+
+    def setUp(self):
+        self.fixture = EventFixture()
+        self.client.force_login(self.fixture.admin)
+
+    def post_data(self, url):
+        """Returns the POST data a browser would submit for the formset at the url unchanged, and its form prefixes.
+
+        The form prefixes are a map of task id -> the prefix of the task's form.
+        """
+        formset = self.client.get(url).context['form']
+        management_form = formset.management_form
+        data = {}
+        for name, field in management_form.fields.items():
+            data[management_form.add_prefix(name)] = management_form.initial.get(name, field.initial)
+        for form in formset.forms:
+            for bound_field in form:
+                value = bound_field.value()
+                if value is not None and value is not False:
+                    data[bound_field.html_name] = value
+        return data, {form.instance.id: form.prefix for form in formset.forms}
+
+    def edit(self, date):
+        """Edits the assignees of two tasks on the given date, and returns the number of queries the POST made.
+
+        Unassigns the one-person task, and replaces one of the two assignees of the two-person task with someone free.
+        """
+        event = self.fixture.event
+        url = reverse('dicpick:tasks_by_date_update', kwargs={'camp_slug': event.camp.slug, 'event_slug': event.slug,
+                                                              'date': date_to_slug(date)})
+        task0 = Task.objects.get(task_type__name='Task Type 0', date=date)
+        task1 = Task.objects.get(task_type__name='Task Type 1', date=date)
+        kept, removed = task1.assignment_set.order_by('id')
+        free = event.participants.exclude(tasks__date=date).order_by('id').first()
+
+        data, prefixes = self.post_data(url)
+        data['{}-assignees'.format(prefixes[task0.id])] = []
+        data['{}-assignees'.format(prefixes[task1.id])] = [kept.participant_id, free.id]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, data)
+        self.assertEqual(302, response.status_code)
+
+        task0.refresh_from_db()
+        task1.refresh_from_db()
+        self.assertFalse(task0.assignment_set.exists())
+        self.assertEqual(1, task0.open_slots)
+        self.assertEqual({(kept.participant_id, True), (free.id, False)},
+                         set(task1.assignment_set.values_list('participant_id', 'automatic')))
+        # The kept assignment is untouched, rather than deleted and recreated.
+        self.assertTrue(Assignment.objects.filter(id=kept.id).exists())
+        self.assertFalse(Assignment.objects.filter(id=removed.id).exists())
+        self.assertEqual(0, task1.open_slots)
+        return len(ctx)
+
+    def test_query_count_is_constant(self):
+        start_date = self.fixture.event.start_date
+        self.fixture.grow(num_participants=20, num_task_types=4, num_tags=3)
+        small = self.edit(start_date)
+        self.fixture.grow(num_participants=60, num_task_types=8, num_tags=3)
+        large = self.edit(start_date + datetime.timedelta(days=1))
+        self.assertEqual(small, large)
+
+
+class FailingEmailBackend(EmailBackend):
+    """A local email backend that fails once it has sent a given number of batches."""
+    def __init__(self, num_batches, *args, **kwargs):
+        super(FailingEmailBackend, self).__init__(*args, **kwargs)
+        self.num_batches = num_batches
+
+    def send_messages(self, messages):
+        if self.num_batches == 0:
+            raise IOError('Connection lost')
+        self.num_batches -= 1
+        return super(FailingEmailBackend, self).send_messages(messages)
+
+
+class NotifyTest(TestCase):
+    """Tests schedule notification emails, sent to the local (in-memory) email backend."""
+
+    def setUp(self):
+        self.fixture = EventFixture()
+        self.fixture.grow(num_participants=10, num_task_types=2, num_tags=0)
+        self.event = self.fixture.event
+
+    def send(self, **kwargs):
+        mail.outbox = []
+        return send_schedule_notifications(self.event, batch_size=3, sleep=lambda seconds: None, **kwargs)
+
+    def test_sends_to_all_participants(self):
+        run = self.send()
+        self.assertEqual(10, run.num_sent)
+        self.assertEqual(10, len(mail.outbox))
+        self.assertEqual(['user0@testcamp.com'], mail.outbox[0].to)
+        self.assertIn('/schedule/', mail.outbox[0].body)
+        self.assertIsNotNone(run.finished_at)
+
+    def test_changed_only(self):
+        self.send()
+        self.assertEqual(0, self.send(changed_only=True).num_sent)
+        # Unassign one participant from a task they don't share with anyone.
+        assignment = Assignment.objects.filter(task__task_type__event=self.event, task__num_people=1).first()
+        participant_id = assignment.participant_id
+        assignment.delete()
+        run = self.send(changed_only=True)
+        self.assertEqual(1, run.num_sent)
+        self.assertEqual([Participant.objects.get(pk=participant_id).user.email], mail.outbox[0].to)
+
+    def test_resume_after_failure(self):
+        mail.outbox = []
+        with self.assertRaises(NotificationError):
+            send_schedule_notifications(self.event, connection=FailingEmailBackend(num_batches=2), batch_size=3,
+                                        sleep=lambda seconds: None)
+        self.assertEqual(6, len(mail.outbox))
+        run = self.send(resume=True)
+        self.assertEqual(10, run.num_sent)
+        self.assertEqual(4, len(mail.outbox))
+        self.assertIsNotNone(run.finished_at)
+        self.assertEqual('', run.error)
+
+    def test_refuses_concurrent_sends(self):
+        run = start_notification_run(self.event)
+        with self.assertRaises(NotificationInProgress):
+            self.send()
+        with self.assertRaises(NotificationInProgress):
+            self.send(resume=True)
+        # Once the send is under way, it sends as usual.
+        self.assertEqual(10, self.send(run=run).num_sent)
+
+    def test_nothing_to_resume(self):
+        with self.assertRaises(NothingToResume):
+            self.send(resume=True)
+        self.client.force_login(self.fixture.admin)
+        url = reverse('dicpick:notify_participants', kwargs={'camp_slug': self.fixture.camp.slug,
+                                                             'event_slug': self.event.slug})
+        response = self.client.post(url, {'resume': 'Resume'})
+        self.assertEqual(200, response.status_code)
+        self.assertIn('error', response.context)
+        self.assertFalse(self.event.notification_runs.exists())
+
+    def test_rate_limit(self):
+        delays = []
+        mail.outbox = []
+        send_schedule_notifications(self.event, batch_size=3, rate_limit=60, sleep=delays.append)
+        # 10 emails in batches of 3, at one email per second: we wait after each batch but the last.
+        self.assertEqual(3, len(delays))
+        for delay in delays:
+            self.assertGreater(delay, 2.0)
+            self.assertLessEqual(delay, 3.0)
+
+
+class FillStatusTest(TestCase):
+    def setUp(self):
+        self.fixture = EventFixture()
+        self.fixture.grow(num_participants=10, num_task_types=2, num_tags=0)
+        self.event = self.fixture.event
+
+    def test_fully_assigned(self):
+        status = compute_fill_status(self.event)
+        # Two task types, of 1 and 2 people, with 7 tasks each, all worth 10 points per person.
+        self.assertEqual((14, 21, 21, 210, 0), tuple(status.total))
+        self.assertEqual(['Task Type 0', 'Task Type 1'], [name for (_, name) in status.task_types])
+        self.assertEqual((7, 7, 7, 70, 0), tuple(status.by_task_type_id[status.task_types[0][0]]))
+        self.assertEqual((2, 3, 3, 30, 0), tuple(status.by_date[self.event.start_date]))
+
+    def test_conflicts(self):
+        # Assign someone to a second (all-day) task on the same date.
+        task0 = Task.objects.get(task_type__name='Task Type 0', date=self.event.start_date)
+        task1 = Task.objects.get(task_type__name='Task Type 1', date=self.event.start_date)
+        participant = task0.assignees.get()
+        Assignment.objects.create(task=task1, participant=participant, automatic=False)
+        refresh_open_slots([task1.id])
+        status = compute_fill_status(self.event)
+        self.assertEqual(2, status.total.conflicts)
+        self.assertEqual(2, status.by_date[self.event.start_date].conflicts)
+        self.assertEqual(1, status.by_task_type_id[task0.task_type_id].conflicts)
+        self.assertEqual(1, status.by_task_type_id[task1.task_type_id].conflicts)
+
+
+class SwapTest(TestCase):
+    def setUp(self):
+        self.fixture = EventFixture()
+        self.fixture.grow(num_participants=10, num_task_types=2, num_tags=0)
+        self.event = self.fixture.event
+        # Two (all-day) tasks on the same date, and one assignee of each.
+        self.task0 = Task.objects.get(task_type__name='Task Type 0', date=self.event.start_date)
+        self.task1 = Task.objects.get(task_type__name='Task Type 1', date=self.event.start_date)
+        self.participant0 = self.task0.assignees.get()
+        self.participant1 = self.task1.assignees.order_by('id').first()
+
+    def assignee_ids(self, task):
+        return set(task.assignees.values_list('id', flat=True))
+
+    def test_substitute(self):
+        substitute = self.event.participants.exclude(tasks__date=self.event.start_date).first()
+        cells = swap_assignments(self.event, self.participant0.id, substitute.id, [self.task0.id])
+        self.assertEqual({substitute.id}, self.assignee_ids(self.task0))
+        self.assertEqual([self.task0.id], [cell['task'] for cell in cells])
+        self.assertEqual([substitute.short_name()], cells[0]['assignees'])
+
+    def test_exchange_on_same_date(self):
+        # Each participant is busy with the task they're handing over, so this can only be done in one step.
+        swap_assignments(self.event, self.participant0.id, self.participant1.id, [self.task0.id], [self.task1.id])
+        self.assertEqual({self.participant1.id}, self.assignee_ids(self.task0))
+        self.assertIn(self.participant0.id, self.assignee_ids(self.task1))
+        self.assertNotIn(self.participant1.id, self.assignee_ids(self.task1))
+
+    def test_conflict_changes_nothing(self):
+        with self.assertRaises(SwapError):
+            swap_assignments(self.event, self.participant0.id, self.participant1.id, [self.task0.id])
+        self.assertEqual({self.participant0.id}, self.assignee_ids(self.task0))
+
+    def test_view(self):
+        self.client.force_login(self.fixture.admin)
+        url = reverse('dicpick:swap_assignments', kwargs={'camp_slug': self.fixture.camp.slug,
+                                                          'event_slug': self.event.slug})
+        data = {'participant': self.participant0.id, 'other_participant': self.participant1.id,
+                'tasks': [self.task0.id], 'other_tasks': [self.task1.id]}
+        response = self.client.post(url, json.dumps(data), content_type='application/json')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({self.task0.id, self.task1.id},
+                         {cell['task'] for cell in json.loads(response.content.decode('utf-8'))['cells']})
+        # Swapping back in the wrong direction fails.
+        response = self.client.post(url, json.dumps(data), content_type='application/json')
+        self.assertEqual(400, response.status_code)
+
+
+@override_settings(DICPICK_REPLICA_DATABASE='replica', DICPICK_READ_YOUR_WRITES_SECONDS=10)
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_reads_go_to_replica_only_when_enabled(self):
+        self.assertEqual('default', self.router.db_for_read(Task))
+        with reads_from_replica():
+            self.assertEqual('replica', self.router.db_for_read(Task))
+            self.assertEqual('default', self.router.db_for_write(Task))
+            with reads_from_replica(False):
+                self.assertEqual('default', self.router.db_for_read(Task))
+            self.assertEqual('replica', self.router.db_for_read(Task))
+        self.assertEqual('default', self.router.db_for_read(Task))
+
+    def test_no_replica_configured(self):
+        with self.settings(DICPICK_REPLICA_DATABASE=None):
+            with reads_from_replica():
+                self.assertEqual('default', self.router.db_for_read(Task))
+
+    def test_read_your_writes(self):
+        factory = RequestFactory()
+        middleware = ReadYourWritesMiddleware()
+        self.assertNotIn(READ_YOUR_WRITES_COOKIE,
+                         middleware.process_response(factory.get('/'), HttpResponse()).cookies)
+        response = middleware.process_response(factory.post('/'), HttpResponse())
+        cookie = response.cookies[READ_YOUR_WRITES_COOKIE]
+
+        request = factory.get('/')
+        self.assertFalse(recently_wrote(request))
+        request.COOKIES[READ_YOUR_WRITES_COOKIE] = cookie.value
+        self.assertTrue(recently_wrote(request))
+        with self.settings(DICPICK_READ_YOUR_WRITES_SECONDS=0):
+            self.assertFalse(recently_wrote(request))
+        request.COOKIES[READ_YOUR_WRITES_COOKIE] = 'garbage'
+        self.assertFalse(recently_wrote(request))
+
+
+class IntervalIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.date = datetime.date(2016, 8, 24)
+        self.index = IntervalIndex()
+
+    def test_merges_overlapping_and_adjacent_intervals(self):
+        self.index.add(self.date, 60, 120)
+        self.index.add(self.date, 180, 240)
+        self.index.add(self.date, 300, 360)
+        self.assertEqual(([60, 180, 300], [120, 240, 360]), self.index._intervals_by_date[self.date])
+        # Touches the first interval, and overlaps the second.
+        self.index.add(self.date, 120, 200)
+        self.assertEqual(([60, 300], [240, 360]), self.index._intervals_by_date[self.date])
+        # Contained in an existing interval.
+        self.index.add(self.date, 310, 320)
+        self.assertEqual(([60, 300], [240, 360]), self.index._intervals_by_date[self.date])
+        # Spans everything.
+        self.index.add(self.date, 0, 400)
+        self.assertEqual(([0], [400]), self.index._intervals_by_date[self.date])
+
+    def test_overlaps(self):
+        self.index.add(self.date, 60, 120)
+        self.index.add(self.date, 180, 240)
+        # The intervals are half-open, so merely touching a busy interval isn't an overlap.
+        self.assertFalse(self.index.overlaps(self.date, 0, 60))
+        self.assertFalse(self.index.overlaps(self.date, 120, 180))
+        self.assertFalse(self.index.overlaps(self.date, 240, 300))
+        self.assertTrue(self.index.overlaps(self.date, 119, 121))
+        self.assertTrue(self.index.overlaps(self.date, 179, 181))
+        self.assertTrue(self.index.overlaps(self.date, 90, 100))
+        self.assertTrue(self.index.overlaps(self.date, 0, 300))
+        self.assertFalse(self.index.overlaps(self.date + datetime.timedelta(days=1), 0, 300))
+
+    def test_all_day_tasks(self):
+        self.index.add_task(Task(date=self.date, start_time=datetime.time(9), end_time=datetime.time(10)))
+        self.assertTrue(self.index.overlaps_task(Task(date=self.date)))
+        self.assertFalse(self.index.overlaps_task(Task(date=self.date, start_time=datetime.time(10))))
+        self.index.add_task(Task(date=self.date))
+        self.assertTrue(self.index.overlaps(self.date, MINUTES_PER_DAY - 1, MINUTES_PER_DAY))
+        self.assertEqual(([0], [MINUTES_PER_DAY]), self.index._intervals_by_date[self.date])
+
+
+class UnavailableDaysTest(TestCase):
+    def setUp(self):
+        self.fixture = EventFixture()
+        self.event = self.fixture.event
+        self.start_date = self.event.start_date
+
+    def day(self, i):
+        return self.start_date + datetime.timedelta(days=i)
+
+    def create_participant(self, unavailable_dates=()):
+        user = create_user('jane.doe@testcamp.com', 'Jane', 'Doe')
+        return Participant.objects.create(event=self.event, user=user, start_date=self.event.start_date,
+                                          end_date=self.event.end_date,
+                                          unavailable_days=dates_to_day_mask(self.start_date, unavailable_dates))
+
+    def test_day_mask(self):
+        dates = [self.day(0), self.day(3), self.day(MAX_DAYS_IN_MASK - 1)]
+        mask = dates_to_day_mask(self.start_date, dates)
+        self.assertEqual(1 | 1 << 3 | 1 << (MAX_DAYS_IN_MASK - 1), mask)
+        self.assertEqual(dates, day_mask_to_dates(self.start_date, mask))
+        self.assertEqual(0, dates_to_day_mask(self.start_date, []))
+        self.assertEqual([], day_mask_to_dates(self.start_date, 0))
+        with self.assertRaises(ValueError):
+            dates_to_day_mask(self.start_date, [self.day(-1)])
+        with self.assertRaises(ValueError):
+            dates_to_day_mask(self.start_date, [self.day(MAX_DAYS_IN_MASK)])
+
+    def test_is_available(self):
+        participant = self.create_participant([self.day(1), self.day(4)])
+        participant.refresh_from_db()
+        self.assertEqual([self.day(1), self.day(4)], participant.unavailable_dates)
+        self.assertEqual([True, False, True, True, False, True, True],
+                         [participant.is_available(self.day(i)) for i in range(7)])
+        # Outside the participant's date range.
+        self.assertFalse(participant.is_available(self.day(-1)))
+        self.assertFalse(participant.is_available(self.day(7)))
+
+    def test_rebase_on_start_date_change(self):
+        participant = self.create_participant([self.day(1), self.day(4)])
+        self.event.start_date = self.day(2)
+        self.event.save()
+        participant.refresh_from_db()
+        # Day 1 is now before the start of the event, so is dropped.
+        self.assertEqual(1 << 2, participant.unavailable_days)
+        self.assertEqual([self.day(4)], participant.unavailable_dates)
+
+    def import_participants(self, records):
+        """Imports the given participant records, as if fetched from a url, and returns the response."""
+        self.client.force_login(self.fixture.admin)
+        url = reverse('dicpick:participants_import', kwargs={'camp_slug': self.fixture.camp.slug,
+                                                             'event_slug': self.event.slug})
+        fetched = mock.Mock(status_code=200)
+        fetched.json.return_value = records
+        with mock.patch('dicpick.forms.requests.get', return_value=fetched):
+            return self.client.post(url, {'url': 'https://example.com/participants.json'})
+
+    def test_import(self):
+        record = {'firstName': 'Jane', 'lastName': 'Doe', 'email': 'jane.doe@testcamp.com',
+                  # Days outside the event are ignored.
+                  'unavailableDays': [self.day(-1).isoformat(), self.day(2).isoformat(), self.day(5).isoformat()]}
+        response = self.import_participants([record])
+        self.assertEqual(302, response.status_code)
+        participant = self.event.participants.get(user__email='jane.doe@testcamp.com')
+        self.assertEqual([self.day(2), self.day(5)], participant.unavailable_dates)
+
+        # Re-importing without unavailable days leaves them as they are.
+        del record['unavailableDays']
+        self.import_participants([record])
+        participant.refresh_from_db()
+        self.assertEqual([self.day(2), self.day(5)], participant.unavailable_dates)
+
+    def test_import_rejects_unrepresentable_days(self):
+        self.event.end_date = self.day(MAX_DAYS_IN_MASK)
+        self.event.save()
+        record = {'firstName': 'Jane', 'lastName': 'Doe', 'email': 'jane.doe@testcamp.com',
+                  'unavailableDays': [self.day(MAX_DAYS_IN_MASK).isoformat()]}
+        response = self.import_participants([record])
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(self.event.participants.exists())
+
+
+class FairnessTest(TestCase):
+    def test_score_stats(self):
+        stats = score_stats([3, 1])
+        self.assertEqual(ScoreStats(count=2, mean=2.0, stddev=1.0, minimum=1.0, maximum=3.0, gap=2.0, gini=0.25),
+                         stats)
+        self.assertEqual(ScoreStats(0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0), score_stats([]))
+
+    def test_gini(self):
+        self.assertAlmostEqual(0.0, score_stats([5, 5, 5, 5]).gini)
+        self.assertAlmostEqual(0.75, score_stats([0, 0, 0, 1]).gini)
+        # The order of the scores doesn't matter.
+        self.assertAlmostEqual(0.75, score_stats([0, 1, 0, 0]).gini)
+        self.assertAlmostEqual(0.0, score_stats([0, 0]).gini)
+
+    def test_compute_fairness_metrics(self):
+        fixture = EventFixture()
+        event = fixture.event
+        participant0 = Participant.objects.create(
+            event=event, user=create_user('user0@testcamp.com', 'First', 'Last0'), initial_score=0,
+            start_date=event.start_date, end_date=event.end_date)
+        Participant.objects.create(
+            event=event, user=create_user('user1@testcamp.com', 'First', 'Last1'), initial_score=6,
+            start_date=event.start_date, end_date=event.end_date,
+            unavailable_days=dates_to_day_mask(event.start_date, [event.end_date]))
+        task_type = TaskType.objects.create(event=event, name='Task Type 0', num_people=1, score=7,
+                                            start_date=event.start_date, end_date=event.end_date)
+        Assignment.objects.create(participant=participant0, task=task_type.tasks.get(date=event.start_date),
+                                  automatic=False)
+
+        metrics = compute_fairness_metrics(event)
+        self.assertEqual(2, metrics.overall.count)
+        self.assertAlmostEqual(6.5, metrics.overall.mean)
+        self.assertAlmostEqual(1.0, metrics.overall.gap)
+        # 7 points over 7 available days, and 6 over 6.
+        self.assertAlmostEqual(1.0, metrics.per_available_day.mean)
+        self.assertAlmostEqual(0.0, metrics.per_available_day.gini)
+        self.assertEqual([7, 6], [group.name for group in metrics.by_availability])
+        self.assertAlmostEqual(1.0, metrics.diversity)
+
+
+class SnapshotTest(TestCase):
+    def test_task_type_counts_cover_only_the_snapshot(self):
+        fixture = EventFixture()
+        fixture.grow(num_participants=10, num_task_types=2, num_tags=0)
+        event = fixture.event
+        task_type1 = event.task_types.get(name='Task Type 1')
+        # Free up a slot of Task Type 1, so the snapshot has a task, while the participants also hold tasks of
+        # Task Type 0, which is outside the snapshot.
+        task = task_type1.tasks.get(date=event.start_date)
+        task.assignment_set.order_by('id').last().delete()
+        refresh_open_slots([task.id])
+
+        snapshot = take_snapshot(event, task_type=task_type1)
+        expected = defaultdict(int)
+        for participant_id in Assignment.objects.filter(task__task_type=task_type1).values_list('participant_id',
+                                                                                                flat=True):
+            expected[participant_id] += 1
+        self.assertEqual({task_type1.id: dict(expected)}, snapshot.task_type_counts)
+
+        assign_for_filter(event, task_type=task_type1)
+        task.refresh_from_db()
+        self.assertEqual(0, task.open_slots)
+
+
+class RollbackTest(TestCase):
+    def test_rollback_only_touches_the_run(self):
+        fixture = EventFixture()
+        fixture.grow(num_participants=10, num_task_types=2, num_tags=0)
+        event = fixture.event
+        first_run = AutoAssignRun.objects.get(event=event)
+        num_first_run_assignments = first_run.assignments.count()
+
+        # Turn one assignee of a two-person task into a manual assignment, and unassign the other.
+        task = Task.objects.get(task_type__name='Task Type 1', date=event.start_date)
+        manual, removed = task.assignment_set.order_by('id')
+        Assignment.objects.filter(id=manual.id).update(run=None, automatic=False)
+        removed.delete()
+        refresh_open_slots([task.id])
+
+        assign_for_filter(event, date=event.start_date)
+        second_run = AutoAssignRun.objects.exclude(id=first_run.id).get()
+        self.assertEqual(1, second_run.assignments.count())
+        second_run.rollback()
+
+        second_run.refresh_from_db()
+        task.refresh_from_db()
+        self.assertTrue(second_run.rolled_back)
+        self.assertFalse(second_run.assignments.exists())
+        self.assertEqual([manual.id], list(task.assignment_set.values_list('id', flat=True)))
+        self.assertEqual(1, task.open_slots)
+        self.assertEqual(num_first_run_assignments - 2, first_run.assignments.count())
+
+    def test_view(self):
+        fixture = EventFixture()
+        fixture.grow(num_participants=10, num_task_types=2, num_tags=0)
+        event = fixture.event
+        run = AutoAssignRun.objects.get(event=event)
+        self.client.force_login(fixture.admin)
+        url = reverse('dicpick:auto_assign_runs', kwargs={'camp_slug': fixture.camp.slug, 'event_slug': event.slug})
+        for malformed in [{}, {'rollback': 'x'}, {'rollback': run.id + 1}]:
+            self.assertEqual(404, self.client.post(url, malformed).status_code)
+        self.assertEqual(302, self.client.post(url, {'rollback': run.id}).status_code)
+        run.refresh_from_db()
+        self.assertTrue(run.rolled_back)
+        self.assertFalse(Assignment.objects.filter(task__task_type__event=event).exists())
+
+
+class CloneEventTest(TestCase):
+    def setUp(self):
+        self.fixture = EventFixture()
+        self.fixture.grow(num_participants=10, num_task_types=2, num_tags=2)
+        self.event = self.fixture.event
+        self.participant0, self.participant1 = self.event.participants.order_by('id')[:2]
+        self.participant0.do_not_assign_with.add(self.participant1)
+        # A per-task override.
+        self.task = Task.objects.get(task_type__name='Task Type 1', date=self.event.start_date)
+        Task.objects.filter(id=self.task.id).update(num_people=3, score=20)
+        self.task.do_not_assign_to.add(self.participant0)
+        self.shift = datetime.timedelta(days=364)
+
+    def clone(self, with_do_not_assign_with=False):
+        return clone_event(self.event, 'Cloned Event', 'cloned', self.event.start_date + self.shift,
+                           with_do_not_assign_with)
+
+    def test_ids_are_remapped(self):
+        new_event = self.clone()
+        self.assertEqual((self.event.start_date + self.shift, self.event.end_date + self.shift),
+                         (new_event.start_date, new_event.end_date))
+        new_tags = set(new_event.tags.all())
+        self.assertEqual(set(self.event.tags.values_list('name', flat=True)), set(t.name for t in new_tags))
+
+        for task_type in self.event.task_types.all():
+            new_task_type = new_event.task_types.get(name=task_type.name)
+            self.assertEqual(set(t.name for t in task_type.tags.all()), set(t.name for t in new_task_type.tags.all()))
+            self.assertTrue(set(new_task_type.tags.all()) <= new_tags)
+
+        new_tasks = Task.objects.filter(task_type__event=new_event)
+        self.assertEqual(Task.objects.filter(task_type__event=self.event).count(), new_tasks.count())
+        for task in Task.objects.filter(task_type__event=self.event).select_related('task_type'):
+            new_task = new_tasks.get(task_type__name=task.task_type.name, date=task.date + self.shift)
+            self.assertEqual((task.num_people, task.score), (new_task.num_people, new_task.score))
+            self.assertEqual(new_task.num_people, new_task.open_slots)
+            self.assertEqual(set(t.name for t in task.tags.all()), set(t.name for t in new_task.tags.all()))
+            self.assertTrue(set(new_task.tags.all()) <= new_tags)
+            self.assertFalse(new_task.assignees.exists())
+            self.assertFalse(new_task.do_not_assign_to.exists())
+        self.assertEqual(3, new_tasks.get(task_type__name='Task Type 1', date=self.task.date + self.shift).num_people)
+
+        for participant in self.event.participants.all():
+            new_participant = new_event.participants.get(user=participant.user)
+            self.assertEqual(participant.start_date + self.shift, new_participant.start_date)
+            self.assertEqual(set(t.name for t in participant.tags.all()),
+                             set(t.name for t in new_participant.tags.all()))
+            self.assertTrue(set(new_participant.tags.all()) <= new_tags)
+            self.assertFalse(new_participant.do_not_assign_with.exists())
+
+    def test_with_do_not_assign_with(self):
+        new_event = self.clone(with_do_not_assign_with=True)
+        new_participant0 = new_event.participants.get(user=self.participant0.user)
+        new_participant1 = new_event.participants.get(user=self.participant1.user)
+        self.assertEqual([new_participant1], list(new_participant0.do_not_assign_with.all()))
+        self.assertEqual([new_participant0], list(new_participant1.do_not_assign_with.all()))
+
+
+class CacheTest(TestCase):
+    def setUp(self):
+        cache.invalidate_camps()
+        self.fixture = EventFixture()
+        self.camp = self.fixture.camp
+        self.event = self.fixture.event
+
+    def test_event_save_and_delete(self):
+        self.assertEqual('Test Event', cache.get_event('testcamp', 'test').name)
+        # Updates that bypass save() aren't seen until the entry expires, which shows that the event is cached.
+        Event.objects.filter(id=self.event.id).update(name='Updated Event')
+        self.assertEqual('Test Event', cache.get_event('testcamp', 'test').name)
+        self.event.name = 'Saved Event'
+        self.event.save()
+        self.assertEqual('Saved Event', cache.get_event('testcamp', 'test').name)
+        self.event.delete()
+        with self.assertRaises(Http404):
+            cache.get_event('testcamp', 'test')
+
+    def test_camp_save_and_delete(self):
+        self.assertEqual('Test Camp', cache.get_camp('testcamp').name)
+        self.assertEqual('Test Camp', cache.get_event('testcamp', 'test').camp.name)
+        Camp.objects.filter(id=self.camp.id).update(name='Updated Camp')
+        self.assertEqual('Test Camp', cache.get_camp('testcamp').name)
+        self.camp.name = 'Saved Camp'
+        self.camp.save()
+        self.assertEqual('Saved Camp', cache.get_camp('testcamp').name)
+        self.assertEqual('Saved Camp', cache.get_event('testcamp', 'test').camp.name)
+        self.camp.delete()
+        with self.assertRaises(Http404):
+            cache.get_camp('testcamp')
+        with self.assertRaises(Http404):
+            cache.get_event('testcamp', 'test')
+
+    def test_group_changes(self):
+        user = create_user('jane.doe@testcamp.com', 'Jane', 'Doe')
+        self.assertEqual(frozenset(), cache.get_admin_camp_ids(user))
+        user.groups.add(self.camp.admin_group)
+        self.assertEqual(frozenset([self.camp.id]), cache.get_admin_camp_ids(user))
+        # Changes made from the group's side of the relationship.
+        self.camp.admin_group.user_set.remove(user)
+        self.assertEqual(frozenset(), cache.get_admin_camp_ids(user))
+        self.camp.admin_group.user_set.add(user)
+        self.assertEqual(frozenset([self.camp.id]), cache.get_admin_camp_ids(user))
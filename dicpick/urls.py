@@ -17,6 +17,7 @@ urlpatterns = [
   url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/$', views.EventDetail.as_view(), name='event_detail'),
   url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/update/$', views.EventUpdate.as_view(), name='event_update'),
   url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/delete/$', views.EventDelete.as_view(), name='event_delete'),
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/clone/$', views.EventClone.as_view(), name='event_clone'),
 
   url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/tags/$', views.TagsUpdate.as_view(), name='tags_update'),
   url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/tags/autocomplete/$', views.TagAutocomplete.as_view(), name='tag_autocomplete'),
@@ -32,6 +33,18 @@ urlpatterns = [
   url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/tasks_by_date/$', views.TasksByDate.as_view(), name='tasks_by_date'),
   url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/tasks_by_date/(?P<date>\w+)$', views.TasksByDateUpdate.as_view(), name='tasks_by_date_update'),
 
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/unfilled/$', views.UnfilledTasks.as_view(), name='unfilled_tasks'),
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/feasibility/$', views.Feasibility.as_view(), name='feasibility'),
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/auto_assign_runs/$', views.AutoAssignRuns.as_view(), name='auto_assign_runs'),
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/swap/$', views.SwapAssignments.as_view(), name='swap_assignments'),
+
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/schedule_links/$', views.ScheduleLinks.as_view(), name='schedule_links'),
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/notify/$', views.NotifyParticipants.as_view(), name='notify_participants'),
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/my_tasks/$', views.MySchedule.as_view(), name='my_schedule'),
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/schedule/(?P<token>[\w:-]+)/$', views.ScheduleByToken.as_view(), name='schedule_by_token'),
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/schedule/(?P<token>[\w:-]+)/tasks.ics$', views.participant_feed, name='participant_feed'),
+  url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/task_type_feed/(?P<task_type_token>[\w:-]+)/tasks.ics$', views.task_type_feed, name='task_type_feed'),
+
   url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/tasks/all$', views.AllTasks.as_view(), name='all_tasks'),
   url(r'^(?P<camp_slug>\w+)/(?P<event_slug>\w+)/tasks/all.csv$', views.AllTasks.as_view(), {'emit_csv': True}, name='all_tasks_csv'),
 ]
@@ -0,0 +1,63 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+from django.db import transaction
+from django.db.models import F
+
+from dicpick import cache
+from dicpick.models import Event
+
+"""Event versions, which change whenever any of an event's data changes.
+
+Caches of data derived from an event (e.g., its fairness metrics) are keyed by the event's version, so they
+never serve stale data and need no explicit invalidation.
+
+Model saves and deletes bump the version via signal handlers (see signals.py).  Code that writes in bulk
+(e.g., with bulk_create or QuerySet.delete(), which don't send signals) must call bump_event_version() itself.
+
+We bump the version after the transaction commits, rather than inside it, so that concurrent transactions on
+the same event don't serialize on the event's row.  And we bump each event at most once per transaction, no
+matter how many of its objects changed.
+"""
+
+
+class _PendingBumps(object):
+  """The events whose versions to bump when the current transaction commits."""
+  def __init__(self):
+    self.event_ids = set()
+
+  def __call__(self):
+    _bump(self.event_ids)
+
+
+def _bump(event_ids):
+  Event.objects.filter(id__in=event_ids).update(version=F('version') + 1)
+  # Cached events carry their version, so they're now stale.
+  cache.invalidate_events()
+
+
+def bump_event_version(event_id):
+  """Bumps the version of the given event when the current transaction commits (or now, if not in a transaction)."""
+  connection = transaction.get_connection()
+  if not connection.in_atomic_block:
+    _bump([event_id])
+    return
+  # Note that if the transaction rolls back, django discards its on-commit callbacks, so we check that our
+  # callback is actually still scheduled, instead of assuming that it is.
+  pending = getattr(connection, 'dicpick_pending_bumps', None)
+  if pending is None or not any(func is pending for (_, func) in connection.run_on_commit):
+    pending = _PendingBumps()
+    connection.dicpick_pending_bumps = pending
+    transaction.on_commit(pending)
+  pending.event_ids.add(event_id)
+
+
+def get_event_version(event_id):
+  """Returns the current version of the given event.
+
+  Always reads the version from the database, as the event objects we cache (see cache.py) may be stale.
+  """
+  return Event.objects.filter(id=event_id).values_list('version', flat=True).first()
@@ -13,25 +13,44 @@ import textwrap
 from collections import defaultdict
 
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.mixins import UserPassesTestMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
+from django.core import signing
 from django.db import transaction
 from django.db.models import Q
+from django.db.models.query import prefetch_related_objects
 from django.forms import inlineformset_factory, modelformset_factory
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
+from django.template.loader import get_template, render_to_string
 from django.utils import translation
 from django.utils.functional import cached_property
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
+from django.views.decorators.http import condition
 from django.views.generic import CreateView, DeleteView, DetailView, FormView, TemplateView, UpdateView, View
 
 from dicpick.assign import assign_for_task_ids
-from dicpick.forms import (EventForm, InlineFormsetWithTagChoicesBase, ParticipantForm,
+from dicpick.cache import get_admin_camp_ids, get_camp, get_event
+from dicpick.clone import clone_event
+from dicpick.fairness import get_fairness_metrics
+from dicpick.fill_status import EMPTY_FILL_STATUS, get_fill_status
+from dicpick.feasibility import analyze_feasibility
+from dicpick.feeds import feed_etag, get_feeds, render_calendar, task_type_feed_token, task_type_id_from_token
+from dicpick.forms import (EventCloneForm, EventForm, InlineFormsetWithTagChoicesBase, ParticipantForm,
                            ParticipantImportForm, ParticipantInlineFormset, TagForm, TaskByDateForm,
                            TaskByTypeForm, TaskInlineFormset, TaskModelFormset, TaskTypeForm)
-from dicpick.models import Assignment, Camp, Event, Participant, Tag, Task, TaskType
-from dicpick.templatetags.dicpick_helpers import burn_logo, date_to_pretty_str, is_burn
+from dicpick.locks import LockTimeout, lock_event_dates
+from dicpick.models import (Assignment, AutoAssignRun, Camp, Event, Participant, Tag, Task, TaskType,
+                            dates_to_day_mask, refresh_open_slots, short_name)
+from dicpick.notify import NotificationInProgress, NothingToResume, start_background_send
+from dicpick.routers import reads_from_replica, recently_wrote
+from dicpick.schedules import get_schedules, participant_id_from_token, schedule_token
+from dicpick.swap import SwapError, swap_assignments
+from dicpick.templatetags.dicpick_helpers import burn_logo, date_to_pretty_str, date_to_slug, is_burn, nbspify
 from dicpick.util import create_user
+from dicpick.versions import bump_event_version
 from functools import reduce
 
 
@@ -49,7 +68,7 @@ class CampRelatedMixin(object):
   """Mixin for views relating to data on or under a certain camp."""
   @cached_property
   def camp(self):
-    return get_object_or_404(Camp, slug=self.kwargs['camp_slug'])
+    return get_camp(self.kwargs['camp_slug'])
 
 
 class IsCampAdminMixin(UserPassesTestMixin, CampRelatedMixin):
@@ -61,17 +80,44 @@ class IsCampAdminMixin(UserPassesTestMixin, CampRelatedMixin):
   so views that do so shouldn't decorate themselves with @login_required.
   """
   def test_func(self):
-    return self.request.user.is_superuser or self.request.user.groups.filter(pk=self.camp.admin_group_id).exists()
+    return self.request.user.is_superuser or self.camp.id in get_admin_camp_ids(self.request.user)
 
   def get(self, request, *args, **kwargs):
+    self.set_camp_language(request)
+    return super(IsCampAdminMixin, self).get(request, *args, **kwargs)
+
+  def set_camp_language(self, request):
     # We hard-code some special casing for mystopia.  If other camps want their own special language
     # variant, we'll come up with a more dynamic approach.
     # Note that setting the language in the session here will only take effect on the next request.
-    if self.camp.slug == 'mystopia':
-      request.session[translation.LANGUAGE_SESSION_KEY] = 'en-mystopia'
-    else:
-      request.session[translation.LANGUAGE_SESSION_KEY] = 'en'
-    return super(IsCampAdminMixin, self).get(request, *args, **kwargs)
+    # Also note that we only set it if it changed, as modifying the session forces it to be saved.
+    language = 'en-mystopia' if self.camp.slug == 'mystopia' else 'en'
+    if request.session.get(translation.LANGUAGE_SESSION_KEY) != language:
+      request.session[translation.LANGUAGE_SESSION_KEY] = language
+
+
+class ReadFromReplicaMixin(object):
+  """Mixin for read-only views whose queries may go to the read replica (see dicpick/routers.py).
+
+  Clients that wrote recently read from the default database instead, so that they see their own writes.
+
+  Note that the response must be rendered, and any streamed content generated, while still routed to the replica.
+  """
+  def dispatch(self, request, *args, **kwargs):
+    use_replica = not recently_wrote(request)
+    with reads_from_replica(use_replica):
+      response = super(ReadFromReplicaMixin, self).dispatch(request, *args, **kwargs)
+      if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    if response.streaming:
+      response.streaming_content = self._stream_from_replica(response.streaming_content, use_replica)
+    return response
+
+  @staticmethod
+  def _stream_from_replica(content, use_replica):
+    with reads_from_replica(use_replica):
+      for chunk in content:
+        yield chunk
 
 
 # Home page.
@@ -80,11 +126,13 @@ class IsCampAdminMixin(UserPassesTestMixin, CampRelatedMixin):
 def user_home(request):
   """View to render the user's home page.
 
-  Currently just a list of camps the user is an admin of.
+  A list of camps the user is an admin of, and of the events the user is a participant in.
   """
   camps = Camp.objects.filter(admin_group__in=list(request.user.groups.all()))
+  participant_events = Event.objects.filter(participants__user=request.user).select_related('camp')
   context = {
-    'camps': camps
+    'camps': camps,
+    'participant_events': participant_events,
   }
   return render(request, 'dicpick/user_home.html', context=context)
 
@@ -97,6 +145,9 @@ class CampDetail(IsCampAdminMixin, DetailView):
   slug_url_kwarg = 'camp_slug'
   context_object_name = 'camp'
 
+  def get_object(self):
+    return self.camp
+
 
 # Event views.
 
@@ -108,8 +159,9 @@ class EventRelatedMixin(IsCampAdminMixin):
 
   @cached_property
   def event(self):
-    return get_object_or_404(Event.objects.prefetch_related(*self.prefetch_related()),
-                             camp__slug=self.kwargs['camp_slug'], slug=self.kwargs['event_slug'])
+    event = get_event(self.kwargs['camp_slug'], self.kwargs['event_slug'])
+    prefetch_related_objects([event], self.prefetch_related())
+    return event
 
 
 
@@ -184,7 +236,35 @@ class EventDelete(EventMixin, DeleteView):
 
 
 class EventDetail(EventMixin, DetailView):
-  pass
+  def get_context_data(self, **kwargs):
+    data = super(EventDetail, self).get_context_data(**kwargs)
+    data['fairness'] = get_fairness_metrics(self.event)
+    return data
+
+
+class EventClone(EventRelatedSingleFormMixin, FormView):
+  """Create a new event as a copy of this one (e.g., to set up this year's event based on last year's)."""
+  form_class = EventCloneForm
+  legend = 'Copy event'
+
+  @property
+  def help_text(self):
+    return ("Creates a new event with copies of this event's tags, {task} types, {tasks} and {participants}, "
+            "with all dates shifted to the new start date.\nAssignments are not copied.".format(
+            task=_('Task'), tasks=_('Tasks'), participants=_('Participants')))
+
+  def get_form_kwargs(self):
+    kwargs = super(EventClone, self).get_form_kwargs()
+    kwargs['camp'] = self.camp
+    return kwargs
+
+  def form_valid(self, form):
+    self.new_event = clone_event(self.event, form.cleaned_data['name'], form.cleaned_data['slug'],
+                                 form.cleaned_data['start_date'], form.cleaned_data['with_do_not_assign_with'])
+    return super(EventClone, self).form_valid(form)
+
+  def get_success_url(self):
+    return self.new_event.get_absolute_url()
 
 
 # Event-related formset views.
@@ -220,13 +300,47 @@ class TagsUpdate(EventRelatedFormsetUpdate):
               "E.g., \"early arriver\", \"returner\", \"camp manager\""
 
 
-class ParticipantScores(EventRelatedTemplateMixin, TemplateView):
-  """Show all participants scores."""
+class ParticipantScores(ReadFromReplicaMixin, EventRelatedTemplateMixin, TemplateView):
+  """Show all participants scores.
+
+  The page is streamed: the participant rows are rendered in chunks as we iterate over the ranked participants, so the
+  response starts immediately, and memory use stays bounded, even for events with thousands of participants.
+
+  Note that the rows' queries run while the response is streamed, after QueryCountMiddleware has counted the
+  request's queries, so its X-DicPick-Queries header undercounts this view's queries.
+  """
   template_name = 'dicpick/participant_scores.html'
+  rows_template_name = 'dicpick/participant_scores_rows.html'
+  rows_per_chunk = 100
+
+  # Marks the spot in the page template where the rows are streamed in.
+  rows_placeholder = '<!-- participant-score-rows -->'
 
   @classmethod
   def prefetch_related(cls):
-    return ['participants', 'participants__user', 'participants__tasks']
+    return []
+
+  def get(self, request, *args, **kwargs):
+    # We render the page ourselves rather than calling super().get(), so we must set the language ourselves too.
+    self.set_camp_language(request)
+    page = render_to_string(self.template_name, self.get_context_data(**kwargs), request=request)
+    head, tail = page.split(self.rows_placeholder)
+    return StreamingHttpResponse(self._stream(head, tail))
+
+  def _stream(self, head, tail):
+    yield head
+    tasks_by_participant_id = self.event.assigned_tasks_by_participant_id()
+    rows_template = get_template(self.rows_template_name)
+    chunk = []
+    for participant in self.event.participants_sorted_by_score().iterator():
+      participant.assigned_tasks = tasks_by_participant_id.get(participant.id, [])
+      chunk.append(participant)
+      if len(chunk) == self.rows_per_chunk:
+        yield rows_template.render({'participants': chunk})
+        chunk = []
+    if chunk:
+      yield rows_template.render({'participants': chunk})
+    yield tail
 
 
 class ParticipantsUpdate(EventRelatedFormsetUpdate):
@@ -293,6 +407,7 @@ class ParticipantsImport(EventRelatedSingleFormMixin, FormView):
       points: 25,
       firstFullDay: "YYYY-MM-DD",
       lastFullDay: "YYYY-MM-DD",
+      unavailableDays: ["YYYY-MM-DD", ...],
     }```
 
     Re-importing multiple times is safe: existing users will be modified if necessary, but not deleted.
@@ -312,6 +427,21 @@ class ParticipantsImport(EventRelatedSingleFormMixin, FormView):
     def clean_name(s):
       return invalid_name_chars_re.sub('', s)
 
+    # Map of email -> unavailable_days bitmask.  We compute all the bitmasks up front, so that we can reject the
+    # import before changing anything if any of them can't be represented.
+    unavailable_days_by_email = {}
+    for record in participant_data:
+      # Unavailable days outside the event can't affect any task, so we ignore them.
+      dates = [dt for dt in (datetime.datetime.strptime(date_str.strip(), '%Y-%m-%d').date()
+                             for date_str in record.get('unavailableDays') or [])
+               if self.event.is_in_date_range(dt)]
+      try:
+        unavailable_days_by_email[record['email'].strip()] = dates_to_day_mask(self.event.start_date, dates)
+      except ValueError as e:
+        form.add_error(None, 'Cannot record the unavailable days of {}: {}.'.format(record['email'].strip(), e))
+    if not form.is_valid():
+      return self.form_invalid(form)
+
     for record in participant_data:
       email = record['email'].strip()
       first_name = clean_name(record['firstName'].strip())
@@ -326,6 +456,7 @@ class ParticipantsImport(EventRelatedSingleFormMixin, FormView):
       start_date = convert_date('firstFullDay')
       end_date = convert_date('lastFullDay')
       initial_score = int(record.get('points') or 0)
+      unavailable_days = unavailable_days_by_email[email]
 
       user = User.objects.filter(email=email).first()
       with transaction.atomic():
@@ -348,12 +479,15 @@ class ParticipantsImport(EventRelatedSingleFormMixin, FormView):
           if end_date:
             participant.end_date = end_date
           participant.initial_score = initial_score
+          if 'unavailableDays' in record:
+            participant.unavailable_days = unavailable_days
         else:
           participant = Participant(event=self.event,
                                     user=user,
                                     start_date=start_date or self.event.start_date,
                                     end_date=end_date or self.event.end_date,
-                                    initial_score=initial_score)
+                                    initial_score=initial_score,
+                                    unavailable_days=unavailable_days)
         participant.save()
 
     return super(ParticipantsImport, self).form_valid(form)
@@ -381,14 +515,40 @@ class TaskTypesUpdate(EventRelatedFormsetUpdate):
 
 
 class TasksByType(EventRelatedTemplateMixin, TemplateView):
-  """Browse tasks by type."""
+  """Browse tasks by type, with the fill status of each type."""
   template_name = 'dicpick/tasks_by_type.html'
 
+  @classmethod
+  def prefetch_related(cls):
+    return []
+
+  def get_context_data(self, **kwargs):
+    data = super(TasksByType, self).get_context_data(**kwargs)
+    fill_status = get_fill_status(self.event)
+    data['task_types'] = [(task_type_id, name, fill_status.by_task_type_id.get(task_type_id, EMPTY_FILL_STATUS))
+                          for (task_type_id, name) in fill_status.task_types]
+    data['total'] = fill_status.total
+    return data
+
 
 class TasksByDate(EventRelatedTemplateMixin, TemplateView):
-  """Browse tasks by date."""
+  """Browse tasks by date, with the fill status of each date."""
   template_name = 'dicpick/tasks_by_date.html'
 
+  @classmethod
+  def prefetch_related(cls):
+    return []
+
+  def get_context_data(self, **kwargs):
+    data = super(TasksByDate, self).get_context_data(**kwargs)
+    fill_status = get_fill_status(self.event)
+    # We format the dates here, rather than with per-date template filter calls.
+    data['dates'] = [(date_to_slug(date), date_to_pretty_str(date), is_burn(date),
+                      fill_status.by_date.get(date, EMPTY_FILL_STATUS))
+                     for date in self.event.date_range()]
+    data['total'] = fill_status.total
+    return data
+
 
 class InlineTaskFormsetUpdateBase(EventRelatedFormMixin, FormView):
   """Base class for views that update multiple tasks (by type, or by date)."""
@@ -408,17 +568,41 @@ class InlineTaskFormsetUpdateBase(EventRelatedFormMixin, FormView):
     )
     return kwargs
 
+  def task_dates(self):
+    """Returns the dates of the tasks on this page."""
+    return (Task.objects.filter(task_type__event=self.event, **self.queryset_filter())
+            .order_by().values_list('date', flat=True).distinct())
+
+  def post(self, request, *args, **kwargs):
+    # Validating the formset checks the assignees against their other tasks on these dates, so we must lock the dates
+    # (see locks.py) before the formset loads those tasks, and hold the locks until we've saved our changes.
+    try:
+      with transaction.atomic():
+        lock_event_dates(self.event.id, self.task_dates())
+        return super(InlineTaskFormsetUpdateBase, self).post(request, *args, **kwargs)
+    except LockTimeout:
+      # Someone else is changing assignments on the same dates, and is taking too long about it.
+      form = self.get_form()
+      form.non_form_errors().append(
+          'Someone else is changing {} on these dates.  Please try again in a moment.'.format(_('Tasks')))
+      return self.form_invalid(form)
+
   def form_valid(self, form):
+    # Note that post() runs this in a transaction, holding the locks on this page's dates.
     if 'delete-auto-assignments' in self.request.POST:
       # Delete auto assignees, but don't save any other form data.
       task_ids = [t['id'].id for t in form.cleaned_data]
       # Note that we filter by event, to ensure that the current user has permission to modify these tasks.
       Assignment.objects.filter(task__task_type__event=self.event, task_id__in=task_ids, automatic=True).delete()
+      refresh_open_slots(task_ids)
+      bump_event_version(self.event.id)
     elif 'delete-all-assignments' in self.request.POST:
       # Delete all assignees, but don't save any other form data.
       task_ids = [t['id'].id for t in form.cleaned_data]
       # Note that we filter by event, to ensure that the current user has permission to modify these tasks.
       Assignment.objects.filter(task__task_type__event=self.event, task_id__in=task_ids).delete()
+      refresh_open_slots(task_ids)
+      bump_event_version(self.event.id)
     else:
       if form.is_valid():
         form.save()
@@ -427,7 +611,8 @@ class InlineTaskFormsetUpdateBase(EventRelatedFormMixin, FormView):
         # Note that we must let the assign code re-fetch the Task objects, so it can prefetch
         # related objects, filter them etc.
         forms_by_task_id = {t['id'].id: f for (t, f) in zip(form.cleaned_data, form.forms)}
-        unassignable_tasks = assign_for_task_ids(self.event, [t['id'].id for t in form.cleaned_data])
+        unassignable_tasks = assign_for_task_ids(self.event, [t['id'].id for t in form.cleaned_data],
+                                                 run_by=self.request.user)
         if unassignable_tasks:
           for task_id in unassignable_tasks:
             forms_by_task_id[task_id].add_error(None,
@@ -507,28 +692,106 @@ class TasksByDateUpdate(InlineTaskFormsetUpdateBase):
     return data
 
 
-class AllTasks(EventRelatedTemplateMixin, TemplateView):
-  """Show a matrix (or a csv stream) of all task assignments."""
+class Feasibility(EventRelatedTemplateMixin, TemplateView):
+  """Show which open task slots can't possibly be filled, and why, without running the auto-assigner."""
+  template_name = 'dicpick/feasibility.html'
+
+  def get_context_data(self, **kwargs):
+    data = super(Feasibility, self).get_context_data(**kwargs)
+    data['report'] = analyze_feasibility(self.event)
+    return data
+
+
+class UnfilledTasks(EventRelatedTemplateMixin, TemplateView):
+  """Show the tasks that still need people, by date and by task type.
+
+  Uses a single query, on the partial index of tasks with open slots, so it's cheap even for large events.
+  """
+  template_name = 'dicpick/unfilled_tasks.html'
+
+  @classmethod
+  def prefetch_related(cls):
+    return []
+
+  def get_context_data(self, **kwargs):
+    data = super(UnfilledTasks, self).get_context_data(**kwargs)
+    rows = (
+      Task.objects
+        .filter(task_type__event=self.event, open_slots__gt=0)
+        .order_by('date', 'task_type__name')
+        .values_list('date', 'task_type_id', 'task_type__name', 'open_slots', 'num_people')
+    )
+    # List of [date, list of (task type name, open slots, num people), total open slots], in date order.
+    dates = []
+    # Map of task type id -> [task type name, number of tasks with open slots, total open slots].
+    task_types = {}
+    for date, task_type_id, task_type_name, open_slots, num_people in rows:
+      if not dates or dates[-1][0] != date:
+        dates.append([date, [], 0])
+      dates[-1][1].append((task_type_name, open_slots, num_people))
+      dates[-1][2] += open_slots
+      task_type = task_types.setdefault(task_type_id, [task_type_name, 0, 0])
+      task_type[1] += 1
+      task_type[2] += open_slots
+    data['dates'] = dates
+    data['task_types'] = [(task_type_id, name, num_tasks, open_slots) for (task_type_id, (name, num_tasks, open_slots))
+                          in sorted(task_types.items(), key=lambda x: x[1][0])]
+    data['open_slots'] = sum(total for (_, _, total) in dates)
+    return data
+
+
+class AutoAssignRuns(EventRelatedTemplateMixin, TemplateView):
+  """Show the history of auto-assign runs, and allow rolling back individual runs."""
+  template_name = 'dicpick/auto_assign_runs.html'
+
+  def get_context_data(self, **kwargs):
+    data = super(AutoAssignRuns, self).get_context_data(**kwargs)
+    data['runs'] = self.event.auto_assign_runs.select_related('run_by')
+    return data
+
+  def post(self, request, *args, **kwargs):
+    try:
+      run_id = int(request.POST.get('rollback'))
+    except (TypeError, ValueError):
+      raise Http404()
+    # Note that we filter by event, to ensure that the current user has permission to roll back this run.
+    run = get_object_or_404(AutoAssignRun, event=self.event, pk=run_id)
+    try:
+      run.rollback()
+    except LockTimeout:
+      # Someone else is changing assignments on the same dates, and is taking too long about it.
+      return self.render_to_response(self.get_context_data(
+          error='Someone else is changing {} on these dates.  Please try again in a moment.'.format(_('Tasks'))))
+    bump_event_version(self.event.id)
+    return HttpResponseRedirect(request.path)
+
+
+class AllTasks(ReadFromReplicaMixin, EventRelatedTemplateMixin, TemplateView):
+  """Show a matrix (or a csv stream) of all task assignments.
+
+  The matrix can be large, so rather than have the template look up and format each cell, we precompute each row
+  as a string of pre-escaped cells, and the template merely emits them.
+  """
   template_name = 'dicpick/all_tasks.html'
 
   @classmethod
   def prefetch_related(cls):
-    return ['task_types', 'task_types__tasks', 'task_types__tasks__assignees', 'task_types__tasks__assignees__user']
+    return []
 
   def get(self, request, emit_csv=False, *args, **kwargs):
     if emit_csv:
-      assignments = self._get_assignments_dict()
-      dates = list(self.event.date_range())
+      task_types, assignments = self._get_assignments()
+      dates = self.event.dates
       data = io.StringIO()
       out = csv.writer(data)
       out.writerow([''] + [dt.strftime('%a. %m/%d') for dt in dates])
-      for task_type in self.event.task_types.all():
+      for task_type_id, task_type_name in task_types:
         rows = []
         for i, dt in enumerate(dates):
-          for j, assignee in enumerate(assignments[task_type.id][dt]):
+          for j, (first_name, last_name) in enumerate(assignments[task_type_id][dt]):
             while len(rows) <= j:
-              rows.append([task_type.name] + [''] * len(dates))
-            rows[j][1 + i] = assignee
+              rows.append([task_type_name] + [''] * len(dates))
+            rows[j][1 + i] = '{} {}'.format(first_name, last_name).strip()
         for row in rows:
           out.writerow(row)
       return HttpResponse(data.getvalue(), content_type='application/csv')
@@ -537,22 +800,208 @@ class AllTasks(EventRelatedTemplateMixin, TemplateView):
 
   def get_context_data(self, **kwargs):
     data = super(AllTasks, self).get_context_data(**kwargs)
-    data['assignments'] = self._get_assignments_dict()
+    task_types, assignments = self._get_assignments()
+    rows = []
+    for task_type_id, task_type_name in task_types:
+      cells = (' '.join(nbspify(short_name(first_name, last_name)) for (first_name, last_name) in
+                        assignments[task_type_id][dt])
+               for dt in self.event.dates)
+      rows.append((nbspify(task_type_name), format_html_join('', '<td>{}</td>', ((mark_safe(c),) for c in cells))))
+    data['dates'] = self.event.dates
+    data['rows'] = rows
     return data
 
-  def _get_assignments_dict(self):
+  def _get_assignments(self):
+    """Returns a pair (task types, assignments).
+
+    The task types are a list of (id, name) pairs, sorted by name.
+    The assignments are a map of task type id -> date -> list of (first name, last name) of the assignees.
+    """
+    task_types = list(self.event.task_types.order_by('name').values_list('id', 'name'))
+
     # We put all the task assignments into a dict, so that we don't have to assume anything
     # about which task types and dates we have data for, what order we see them in, etc.
     assignments = defaultdict(lambda: defaultdict(list))
+    rows = (
+      Assignment.objects
+        .filter(task__task_type__event=self.event)
+        .order_by('id')
+        .values_list('task__task_type_id', 'task__date', 'participant__user__first_name', 'participant__user__last_name')
+    )
+    for task_type_id, date, first_name, last_name in rows:
+      assignments[task_type_id][date].append((first_name, last_name))
+
+    return task_types, assignments
+
 
-    for task_type in self.event.task_types.all():
-      for task in task_type.tasks.all():
-        assignments[task_type.id][task.date] = list(task.assignees.all())
+class ScheduleLinks(EventRelatedTemplateMixin, TemplateView):
+  """Show the link to each participant's schedule, so the admins can send the links to the participants.
 
-    return assignments
+  Also show the link to each task type's calendar feed.
+  """
+  template_name = 'dicpick/schedule_links.html'
+
+  @classmethod
+  def prefetch_related(cls):
+    return []
 
+  def get_context_data(self, **kwargs):
+    data = super(ScheduleLinks, self).get_context_data(**kwargs)
+    schedules = sorted(get_schedules(self.event).by_participant_id.values(), key=lambda s: s.name)
+    data['links'] = [(s, schedule_token(s.participant_id)) for s in schedules]
+    task_types = self.event.task_types.order_by('name').values_list('id', 'name')
+    data['task_type_links'] = [(name, task_type_feed_token(task_type_id)) for (task_type_id, name) in task_types]
+    return data
+
+
+class NotifyParticipants(EventRelatedTemplateMixin, TemplateView):
+  """Email the participants their schedules, in the background, and show the history of such emails."""
+  template_name = 'dicpick/notify_participants.html'
+
+  @classmethod
+  def prefetch_related(cls):
+    return []
 
-class TagAutocomplete(EventRelatedMixin, View):
+  def get_context_data(self, **kwargs):
+    data = super(NotifyParticipants, self).get_context_data(**kwargs)
+    data['runs'] = self.event.notification_runs.select_related('run_by')
+    return data
+
+  def post(self, request, *args, **kwargs):
+    try:
+      start_background_send(self.event, run_by=request.user, changed_only='changed_only' in request.POST,
+                            resume='resume' in request.POST)
+    except NotificationInProgress:
+      return self.render_to_response(self.get_context_data(
+          error='Emails are already being sent.  Please wait for them to finish.'))
+    except NothingToResume:  # E.g., because the send was resumed already.
+      return self.render_to_response(self.get_context_data(
+          error='There are no unfinished emails to resume.  Perhaps they were resumed already.'))
+    return HttpResponseRedirect(request.path)
+
+
+# Participant views.  Unlike the views above, these are for the participants, not just the camp admins.
+
+class ParticipantScheduleMixin(CampRelatedMixin):
+  """Mixin for views that show a single participant's schedule."""
+  template_name = 'dicpick/participant_schedule.html'
+
+  @cached_property
+  def event(self):
+    return get_event(self.kwargs['camp_slug'], self.kwargs['event_slug'])
+
+  def get_schedule(self):
+    """Returns the ParticipantSchedule to show, or None if there isn't one."""
+    raise NotImplementedError()
+
+  def get_context_data(self, **kwargs):
+    data = super(ParticipantScheduleMixin, self).get_context_data(**kwargs)
+    data['event'] = self.event
+    data['schedule'] = self.get_schedule()
+    if data['schedule'] is not None:
+      data['token'] = schedule_token(data['schedule'].participant_id)
+    return data
+
+
+class MySchedule(LoginRequiredMixin, ParticipantScheduleMixin, TemplateView):
+  """Show the logged-in user their own schedule."""
+  def get_schedule(self):
+    return get_schedules(self.event).by_user_id.get(self.request.user.id)
+
+
+class ScheduleByToken(ParticipantScheduleMixin, TemplateView):
+  """Show the schedule of the participant identified by the signed token in the url, without requiring a login."""
+  def get_schedule(self):
+    try:
+      participant_id = participant_id_from_token(self.kwargs['token'])
+    except signing.BadSignature:
+      raise Http404()
+    # Note that this also verifies that the participant belongs to the event in the url.
+    schedule = get_schedules(self.event).by_participant_id.get(participant_id)
+    if schedule is None:
+      raise Http404()
+    return schedule
+
+
+def _feed_etag(request, camp_slug, event_slug, token=None, task_type_token=None):
+  # We return no etag for an invalid token, so that the view runs (and responds with a 404) even if the request has
+  # an If-None-Match header, rather than a 304 that would imply that the feed exists.
+  event = get_event(camp_slug, event_slug)
+  try:
+    if token is not None:
+      participant_id_from_token(token)
+    elif task_type_id_from_token(task_type_token) not in get_feeds(event).task_type_names:
+      return None
+  except signing.BadSignature:
+    return None
+  return feed_etag(event)
+
+
+def _calendar_response(name, vevents):
+  return HttpResponse(render_calendar(name, vevents), content_type='text/calendar; charset=utf-8')
+
+
+@condition(etag_func=_feed_etag)
+def participant_feed(request, camp_slug, event_slug, token):
+  """Serve the iCalendar feed of the participant identified by the signed token in the url.
+
+  Note that a participant who isn't in the event (or has no tasks in it) gets an empty calendar.
+  """
+  try:
+    participant_id = participant_id_from_token(token)
+  except signing.BadSignature:
+    raise Http404()
+  event = get_event(camp_slug, event_slug)
+  vevents = get_feeds(event).by_participant_id.get(participant_id, [])
+  return _calendar_response('{}: {}'.format(event.name, _('Tasks')), vevents)
+
+
+@condition(etag_func=_feed_etag)
+def task_type_feed(request, camp_slug, event_slug, task_type_token):
+  """Serve the iCalendar feed of the task type identified by the signed token in the url."""
+  try:
+    task_type_id = task_type_id_from_token(task_type_token)
+  except signing.BadSignature:
+    raise Http404()
+  event = get_event(camp_slug, event_slug)
+  feeds = get_feeds(event)
+  name = feeds.task_type_names.get(task_type_id)
+  if name is None:
+    raise Http404()
+  return _calendar_response('{}: {}'.format(event.name, name), feeds.by_task_type_id[task_type_id])
+
+
+class SwapAssignments(EventRelatedMixin, View):
+  """View to serve ajax requests to swap tasks between two participants, or to substitute one for another.
+
+  Expects a json body with the ids of the 'participant' and 'other_participant', and lists of the ids of the 'tasks'
+  to move from the former to the latter and (optionally) the 'other_tasks' to move back.  Responds with the updated
+  cells of those tasks (see swap.py), or with an error message.
+  """
+  @classmethod
+  def prefetch_related(cls):
+    return []
+
+  def post(self, request, *args, **kwargs):
+    try:
+      data = json.loads(request.body.decode('utf-8'))
+      participant_id = int(data['participant'])
+      other_participant_id = int(data['other_participant'])
+      task_ids = [int(task_id) for task_id in data.get('tasks', [])]
+      other_task_ids = [int(task_id) for task_id in data.get('other_tasks', [])]
+    except (ValueError, KeyError, TypeError):
+      return JsonResponse({'error': 'Malformed request.'}, status=400)
+    try:
+      cells = swap_assignments(self.event, participant_id, other_participant_id, task_ids, other_task_ids)
+    except SwapError as e:
+      return JsonResponse({'error': str(e)}, status=400)
+    except LockTimeout:
+      return JsonResponse({'error': 'Someone else is changing {} on these dates.  Please try again in a moment.'.format(
+          _('Tasks'))}, status=409)
+    return JsonResponse({'cells': cells})
+
+
+class TagAutocomplete(ReadFromReplicaMixin, EventRelatedMixin, View):
   """View to serve tag autocomplete ajax requests."""
   def get(self, request, camp_slug, event_slug):
     query = request.GET.get('q') or ''
@@ -565,7 +1014,7 @@ class TagAutocomplete(EventRelatedMixin, View):
     return JsonResponse(ret, safe=False)
 
 
-class ParticipantAutocomplete(EventRelatedMixin, View):
+class ParticipantAutocomplete(ReadFromReplicaMixin, EventRelatedMixin, View):
   """View to serve participant autocomplete ajax requests."""
   def get(self, request, camp_slug, event_slug):
     query = request.GET.get('q') or ''
@@ -578,10 +1027,10 @@ class ParticipantAutocomplete(EventRelatedMixin, View):
     for_tags = set(Tag.objects.filter(event=self.event, name__in=for_tags_strs))
 
     filters = [Q(**{'user__{}__istartswith'.format(f): query}) for f in ['username', 'first_name', 'last_name', 'email']]
-    combined_filter = Q(event=self.event) & reduce(lambda x, y: x | y, filters)
+    combined_filter = reduce(lambda x, y: x | y, filters)
     # Note that we return just the first 5 results.
     qs = (
-      Participant.objects.filter(combined_filter)
+      self.event.participants.filter(combined_filter)
         .select_related('user')
         .prefetch_related('tags')
         .order_by('user__first_name', 'user__last_name')
@@ -593,10 +1042,12 @@ class ParticipantAutocomplete(EventRelatedMixin, View):
     results = []
     for p in qs:
       result = {'id': p.id, 'text': '{} {}'.format(p.user.first_name, p.user.last_name)}
-      if for_date and (for_date < p.start_date or for_date > p.end_date):
+      if for_date and not p.is_available(for_date):
         result['disabled'] = True
         result['disqualified_for_date'] = True
         result['tooltip'] = 'Available {}-{}.'.format(fmt_date(p.start_date), fmt_date(p.end_date))
+        if p.unavailable_days:
+          result['tooltip'] += ' Unavailable {}.'.format(', '.join(fmt_date(dt) for dt in p.unavailable_dates))
       if for_tags and not for_tags.intersection(p.tags.all()):
         result['disabled'] = True
         result['disqualified_for_tags'] = True
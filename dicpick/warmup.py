@@ -0,0 +1,117 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+import importlib
+import os
+import pkgutil
+import time
+
+from django.core.urlresolvers import resolve, reverse
+from django.db import connections
+from django.template.loader import get_template
+
+import dicpick
+from dicpick import urls as dicpick_urls
+
+"""Helper functions to warm up a freshly started process, so that its first requests aren't slow.
+
+Used by the `warmup` management command, and by our gunicorn hooks (see gunicorn.conf.py).
+"""
+
+# Packages we don't import when warming up: migrations are only needed by migrate, and tests only by the test runner.
+_skipped_modules = ['dicpick.migrations', 'dicpick.tests']
+
+
+def import_modules():
+  """Imports all our modules, and therefore all the third-party modules they use (e.g., requests).
+
+  Returns the number of modules imported.
+  """
+  count = 0
+  for _, name, _ in pkgutil.walk_packages(dicpick.__path__, 'dicpick.'):
+    if any(name == skipped or name.startswith(skipped + '.') for skipped in _skipped_modules):
+      continue
+    importlib.import_module(name)
+    count += 1
+  return count
+
+
+def compile_templates():
+  """Loads (and therefore compiles) every template under dicpick/templates.
+
+  In production we use the cached template loader, so each template remains compiled for the life of the process.
+
+  Returns the number of templates compiled.
+  """
+  template_dir = os.path.join(os.path.dirname(dicpick.__file__), 'templates')
+  count = 0
+  for dirpath, _, filenames in os.walk(template_dir):
+    for filename in filenames:
+      get_template(os.path.relpath(os.path.join(dirpath, filename), template_dir).replace(os.sep, '/'))
+      count += 1
+  return count
+
+
+def resolve_urls():
+  """Reverses and resolves each of our url patterns once, which populates and compiles the url resolver.
+
+  Returns the number of url patterns resolved.
+  """
+  count = 0
+  for pattern in dicpick_urls.urlpatterns:
+    # Note that '1' matches every group in our url patterns.
+    path = reverse('dicpick:{}'.format(pattern.name), kwargs={k: '1' for k in pattern.regex.groupindex})
+    resolve(path)
+    count += 1
+  return count
+
+
+def connect_databases():
+  """Opens a connection to each configured database.
+
+  Note that connections must not be shared across processes, so in a forking server this must run in each worker,
+  after the fork.
+
+  Returns the number of connections opened.
+  """
+  count = 0
+  for connection in connections.all():
+    connection.ensure_connection()
+    count += 1
+  return count
+
+
+# The warm-up steps, in the order in which they run.
+# Each is a pair (description, function), where the function returns the number of items it warmed up.
+steps = [
+  ('Import modules', import_modules),
+  ('Compile templates', compile_templates),
+  ('Resolve urls', resolve_urls),
+  ('Connect to databases', connect_databases),
+]
+
+
+def warm_up(step_functions=None):
+  """Runs the given warm-up steps (or all steps, if unspecified).
+
+  Returns a list of (description, number of items, seconds taken), one per step, as a startup timing report.
+  """
+  report = []
+  for description, func in steps:
+    if step_functions is not None and func not in step_functions:
+      continue
+    start = time.time()
+    count = func()
+    report.append((description, count, time.time() - start))
+  return report
+
+
+def format_report(report):
+  """Returns a human-readable version of the given report, as a list of lines."""
+  lines = ['{:<24} {:>6} {:>10.1f} ms'.format(description, count, seconds * 1000)
+           for (description, count, seconds) in report]
+  lines.append('{:<24} {:>6} {:>10.1f} ms'.format('Total', '', sum(r[2] for r in report) * 1000))
+  return lines
@@ -0,0 +1,31 @@
+# coding=utf-8
+# Copyright 2016 Mystopia.
+
+# Gunicorn configuration.  Gunicorn reads this file automatically when started from the repo root.
+
+from __future__ import (absolute_import, division, generators, nested_scopes,
+                        print_function, unicode_literals, with_statement)
+
+# Load the app in the master process, so that the warm-up work below is done once, before forking, and is shared by
+# all workers (including ones started later, e.g., when a worker is recycled).
+preload_app = True
+
+
+def when_ready(server):
+  """Runs in the master process, after the app is loaded, before the workers are forked."""
+  from django.db import connections
+  from dicpick.warmup import compile_templates, format_report, import_modules, resolve_urls, warm_up
+
+  for line in format_report(warm_up([import_modules, compile_templates, resolve_urls])):
+    server.log.info('Warm-up: %s', line)
+  # Database connections must not be shared with the workers.
+  for connection in connections.all():
+    connection.close()
+
+
+def post_fork(server, worker):
+  """Runs in each worker, after it's forked."""
+  from dicpick.warmup import connect_databases, format_report, warm_up
+
+  for line in format_report(warm_up([connect_databases])):
+    server.log.info('Warm-up (worker %s): %s', worker.pid, line)
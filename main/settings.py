@@ -87,6 +87,9 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+  # Must be first, so it sees the queries made by all other middleware.
+  'dicpick.middleware.QueryCountMiddleware',
+
   # Uncomment to see the debug toolbar.
   #'debug_toolbar.middleware.DebugToolbarMiddleware',
 
@@ -96,11 +99,53 @@ MIDDLEWARE_CLASSES = (
   'django.middleware.csrf.CsrfViewMiddleware',
   'django.contrib.auth.middleware.AuthenticationMiddleware',
   'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+  'dicpick.routers.ReadYourWritesMiddleware',
   'django.contrib.messages.middleware.MessageMiddleware',
   'django.middleware.clickjacking.XFrameOptionsMiddleware',
   'django.middleware.security.SecurityMiddleware',
+
+  # Must come after the auth middleware, as only staff users may profile requests.
+  'dicpick.middleware.ProfilingMiddleware',
 )
 
+# Log a warning for any request that makes more than this many SQL queries (see dicpick/middleware.py).
+DICPICK_QUERY_BUDGET = 50
+
+# Requests profiled on demand by staff users are saved here (see dicpick/middleware.py).
+DICPICK_PROFILE_DIR = os.environ.get('DICPICK_PROFILE_DIR', '/tmp/dicpick_profiles')
+
+# Profile at most this many requests per process in any DICPICK_PROFILE_RATE_PERIOD seconds.
+DICPICK_PROFILE_RATE_LIMIT = 5
+DICPICK_PROFILE_RATE_PERIOD = 60
+
+# How long each process caches camps, events and admin permissions, in seconds (see dicpick/cache.py).
+DICPICK_CACHE_TTL = 60
+
+# How long a transaction waits for another transaction changing assignments on the same dates, in milliseconds
+# (see dicpick/locks.py).
+DICPICK_LOCK_TIMEOUT = 10000
+
+# The number of independently seeded trials each auto-assign runs, keeping the best (see dicpick/assign.py).
+DICPICK_ASSIGN_TRIALS = 1
+
+# Schedule notification emails are sent in batches of this size, at most DICPICK_NOTIFY_RATE_LIMIT emails per minute
+# (see dicpick/notify.py).
+DICPICK_NOTIFY_BATCH_SIZE = 50
+DICPICK_NOTIFY_RATE_LIMIT = 600
+
+# The base url of links in emails.
+DICPICK_SITE_URL = os.environ.get('DICPICK_SITE_URL', 'http://localhost:8000')
+
+# The alias of a read replica of the default database, if any.  Views that opt in read from it (see
+# dicpick/routers.py).
+DICPICK_REPLICA_DATABASE = None
+
+# After a write, a client's reads go to the default database for this many seconds, so that it sees its own writes
+# even if the replica lags.
+DICPICK_READ_YOUR_WRITES_SECONDS = 10
+
+DATABASE_ROUTERS = ['dicpick.routers.ReplicaRouter']
+
 AUTHENTICATION_BACKENDS = (
   'django.contrib.auth.backends.ModelBackend',
 )
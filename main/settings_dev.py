@@ -34,6 +34,13 @@ DATABASES = {
    }
 }
 
+# To try out read-replica routing locally, set REPLICA_DATABASE_NAME in settings_local.py to the name of a second local
+# database, e.g., a copy of the default database (see dicpick/routers.py).  In tests the replica mirrors the default
+# database.
+if 'REPLICA_DATABASE_NAME' in globals():
+  DATABASES['replica'] = dict(DATABASES['default'], NAME=REPLICA_DATABASE_NAME, TEST={'MIRROR': 'default'})
+  DICPICK_REPLICA_DATABASE = 'replica'
+
 
 WITH_CACHING = False
 def maybe_cache_templates(loaders):
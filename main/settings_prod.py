@@ -34,6 +34,12 @@ DATABASES = {
 
 DATABASES['default']['CONN_MAX_AGE'] = 3600
 
+# Read-only views read from a replica, if one is configured (see dicpick/routers.py).
+if 'REPLICA_DATABASE_URL' in os.environ:
+  DATABASES['replica'] = dj_database_url.config('REPLICA_DATABASE_URL')
+  DATABASES['replica']['CONN_MAX_AGE'] = 3600
+  DICPICK_REPLICA_DATABASE = 'replica'
+
 ALLOWED_HOSTS = [
     '.herokuapp.com',
     '.dicpick.herokuapp.com',